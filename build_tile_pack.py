@@ -0,0 +1,115 @@
+"""
+Build a tile pack holding every map tile around the stations in the station catalogue, from
+zoom 0 up to --max-zoom, so that the explorer can show them without touching the network.
+
+    python build_tile_pack.py --max-zoom 12
+
+Tiles already in the local cache (mapscache/) are used as they are; the rest are downloaded and
+cached on the way through. Put the resulting pack in the directory that the explorer runs from.
+"""
+import argparse
+from functools import partial
+import os
+import threading
+import time
+import traceback
+
+from google.protobuf.message import DecodeError
+
+from map import flight_path
+from map.map_widget import decode_vector_tile, new_tile_fetcher
+from map.tile_fetcher import TileFetcher
+from map.tile_pack import TilePackWriter
+from map.tile_store import TileStore
+from map.worker_pool import shutdown_worker_pool
+from stations.catalogue import open_catalogue
+
+
+def tiles_around(locations, max_zoom: int, width: int, height: int) -> set:
+    """Every tile visible around the locations, for a screen of the given size."""
+    tiles = set()
+    for latitude, longitude in locations:
+        for zoom in range(max_zoom + 1):
+            # Tiles are at their smallest mid-animation, which is when the most are visible.
+            view = flight_path.View(latitude, longitude, zoom, flight_path.ZOOM_OUT_SIZE)
+            tiles.update(flight_path.visible_tiles(view, width, height))
+    return tiles
+
+
+def tile_data(
+    store: TileStore, fetcher: TileFetcher, z: int, x: int, y: int, satellite: bool
+) -> bytes | None:
+    """The pack payload for a tile, from the local cache if possible. None if there's no tile."""
+    if satellite:
+        path = store.image_path(z, x, y)
+        if not os.path.isfile(path):
+            store.save_image(z, x, y, fetcher.download(z, x, y))
+        with open(path, "rb") as f:
+            return f.read()
+
+    tile = store.load_vector(z, x, y)
+    if tile is None:
+        try:
+            packed = decode_vector_tile(fetcher.download(z, x, y))
+        except DecodeError:
+            return None
+        store.save_packed_vector(z, x, y, packed)
+        return packed
+    return tile.to_bytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default="stations.tilepack")
+    parser.add_argument("--max-zoom", type=int, default=12)
+    parser.add_argument("--width", type=int, default=200, help="screen width to cover")
+    parser.add_argument("--height", type=int, default=60, help="screen height to cover")
+    parser.add_argument("--satellite", action="store_true", help="pack satellite tiles")
+    args = parser.parse_args()
+
+    catalogue = open_catalogue()
+    tiles = tiles_around(
+        [station["location"] for station in catalogue],
+        args.max_zoom,
+        args.width,
+        args.height,
+    )
+    print("Packing {} tiles for {} stations".format(len(tiles), len(catalogue)))
+
+    store = TileStore("mapscache")
+    fetcher = new_tile_fetcher(args.satellite)
+    lock = threading.Lock()
+    failures = []
+
+    with TilePackWriter(args.output, args.satellite) as pack:
+
+        def load(z, x, y):
+            # noinspection PyBroadException
+            try:
+                data = tile_data(store, fetcher, z, x, y, args.satellite)
+            # pylint: disable=broad-except
+            except Exception:
+                failures.append(
+                    "{} - tile loc: {} {} {}".format(traceback.format_exc(), x, y, z)
+                )
+                return
+            if data is not None:
+                with lock:
+                    pack.add(z, x, y, data)
+
+        # Low zoom levels first - they are shared by every station.
+        for z, x, y in sorted(tiles):
+            fetcher.submit(z, x, y, partial(load, z, x, y), (z,))
+        while fetcher.in_flight:
+            print("{} tiles to go...".format(fetcher.in_flight), end="\r")
+            time.sleep(0.5)
+
+    fetcher.shutdown()
+    shutdown_worker_pool()
+    for failure in failures:
+        print(failure)
+    print("Wrote {} ({} failed)".format(args.output, len(failures)))
+
+
+if __name__ == "__main__":
+    main()
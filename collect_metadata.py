@@ -0,0 +1,53 @@
+"""
+Log what every station in the catalogue (or in one country) is playing, without playing any
+of it - the metadata is read straight out of the streams.
+
+    python collect_metadata.py --country Canada --log canada.log
+
+Each title change is appended to the log as a line of JSON. Stop it with Ctrl-C.
+"""
+import argparse
+import asyncio
+
+from history.store import PlayHistory
+from stations.catalogue import open_catalogue
+from stream_meta.collector import Collector
+
+_REPORT_SECONDS = 10
+
+
+async def collect(collector: Collector) -> None:
+    task = asyncio.create_task(collector.run())
+    while not task.done():
+        await asyncio.wait([task], timeout=_REPORT_SECONDS)
+        print(
+            "{open} streams open, {connects} connects, {failures} failures, "
+            "{titles} titles logged".format(**collector.stats)
+        )
+    task.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--country", help="only watch the stations in this country")
+    parser.add_argument("--log", default="metadata.log")
+    parser.add_argument("--streams", type=int, default=200, help="streams to hold open at once")
+    parser.add_argument("--history", help="also record the titles in this play history directory")
+    args = parser.parse_args()
+
+    catalogue = open_catalogue()
+    stations = catalogue.in_country(args.country) if args.country else list(catalogue)
+    print("Watching {} stations, logging to {}".format(len(stations), args.log))
+
+    history = PlayHistory(args.history) if args.history else None
+    try:
+        asyncio.run(collect(Collector(stations, args.log, args.streams, history=history)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if history:
+            history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
+import argparse
 import sys
+import threading
+import time
 
-from waiting import wait
-
+from asciimatics.effects import Effect
 from asciimatics.event import KeyboardEvent, Event
 from asciimatics.scene import Scene
 from asciimatics.screen import Screen
@@ -13,55 +15,57 @@ from asciimatics.widgets import (
 )
 
 from mpv_util import MPVWrapper
+from mpv_util.events import WORKER, EventBus
+from mpv_util.standby import StandbyPool
 from mpv_util.stream_player import StreamPlayer
+from history.store import PlayHistory
 from map.map_widget import Map
-
-# to be replaced with... something. wrote to radio.garden about API docs.
-STATIONS_DB = [
-    {
-        "name": "Radio Thiossane",
-        "city": "Dakar",
-        "country": "Senegal",
-        "location": (14.716677, -17.467686),
-        "stream": "http://listen.senemultimedia.net:8110/stream",
-    },
-    {
-        "name": "Dr. Dick's Dub Shack",
-        "city": "Hamilton",
-        "country": "Bermuda",
-        "location": (32.339008, -64.738419),
-        "stream": "https://streamer.radio.co/s0635c8b0d/listen",
-    },
-    {
-        "name": "Ycoden Daute Radio",
-        "city": "Icod de los Vinos",
-        "country": "Spain",
-        "location": (28.367571, -16.718861),
-        "stream": "http://pr1cen101.emisionlocal.com:8060/live",
-    },
-    {
-        "name": "CJAM 99.1 Windsor/Detroit",
-        "city": "Windsor",
-        "country": "Canada",
-        "location": (42.314079, -83.036858),
-        "stream": "http://stream.cjam.ca/CJAM-live-256k.mp3.m3u",
-    },
-    {
-        "name": "Bullshit folk from Germany",
-        "city": "Lantsberg aum Smth",
-        "country": "DE",
-        "location": (48.0, 10.8),
-        "stream": "https://radio-jodlerwirt.stream.laut.fm/radio-jodlerwirt",
-    },
-
-]
+from map.render_scheduler import RenderScheduler
+from map.station_overlay import StationOverlay
+from map.worker_pool import shutdown_worker_pool
+from stations.catalogue import StationCatalogue, StationCursor, open_catalogue
+from stations.geo_index import EAST, NORTH, SOUTH, WEST, StationIndex
+from stream_meta.titles import SongInfo
 
 PLAYER_HEIGHT = 5
 DEFAULT_ZOOM = 10
+# Neighbouring stations kept buffered (muted) for instant switching - each one is another mpv
+# instance and stream, so this is off unless asked for with --standby.
+STANDBY_POOL_SIZE = 0
+# the most that the standby players may buffer between them
+STANDBY_MAX_BYTES = 16 * 1024 * 1024
+
+
+class EventPump(Effect):
+    """
+    Runs the player's UI callbacks on the UI thread, once per frame at most - so a burst of
+    title or station changes becomes one update, before the frames that show it redraw.
+    """
+
+    def __init__(self, screen: Screen, events: EventBus, scheduler: RenderScheduler):
+        super(EventPump, self).__init__(screen)
+        self._events = events
+        # wake the screen up for new events, which it would otherwise sit on until a key press
+        self._events.set_waker(scheduler.request_redraw)
+
+    def reset(self):
+        pass
+
+    def _update(self, frame_no):
+        self._events.dispatch()
+
+    @property
+    def frame_update_count(self):
+        # never on a timer - the waker brings the next frame forward when there are events
+        return 0
+
+    @property
+    def stop_frame(self):
+        return 0
 
 
 class MapFrame(Frame):
-    def __init__(self, screen: Screen, world_map: Map):
+    def __init__(self, screen: Screen, world_map: Map, scheduler: RenderScheduler):
         super(MapFrame, self).__init__(
             screen,
             height=screen.height - PLAYER_HEIGHT,
@@ -74,12 +78,17 @@ class MapFrame(Frame):
         )
 
         self._map = world_map
+        self._scheduler = scheduler
 
         layout = Layout([100], fill_frame=True)
         self.add_layout(layout)
         layout.add_widget(self._map, 0)
         self.fix()
 
+    def update(self, frame_no):
+        with self._scheduler.drawing(frame_no):
+            super(MapFrame, self).update(frame_no)
+
 
 class PlayerFrame(Frame):
     __empty_data = {
@@ -90,7 +99,14 @@ class PlayerFrame(Frame):
         "album": "-",
     }
 
-    def __init__(self, screen: Screen, stream_player: StreamPlayer, world_map: Map):
+    def __init__(
+        self,
+        screen: Screen,
+        stream_player: StreamPlayer,
+        world_map: Map,
+        station_index: StationIndex,
+        scheduler: RenderScheduler,
+    ):
         super(PlayerFrame, self).__init__(
             screen,
             height=PLAYER_HEIGHT,
@@ -101,15 +117,20 @@ class PlayerFrame(Frame):
             hover_focus=True,
             can_scroll=False,
             is_modal=True,
+            # no blinking cursor - it would keep the whole screen redrawing while idle
+            reduce_cpu=True,
             title="Player",
         )
 
         self._world_map = world_map
+        self._scheduler = scheduler
+        self._station_index = station_index
 
         self._player = stream_player
         self._player.register_songinfo_callback(self._update_song)
         self._player.register_stationinfo_callback(self._update_map_with_station)
         self._player.register_stationinfo_callback(self._update_station)
+        self._player.register_switch_callback(self._update_switch_latency)
 
         # Label initialization (station)
         self._station_location = Text(
@@ -135,14 +156,22 @@ class PlayerFrame(Frame):
     def _load(self):
         self.data = self.__empty_data
         self.save()
-        self._player.play()
+        # playback is normally already under way from startup - don't restart the stream
+        if not self._player.playing:
+            self._player.play()
         self._world_map.force_center(*self._player.current_station["location"])
         self._player.force_callbacks()
 
-    def _update_song(self, now_playing: str) -> None:
+    def update(self, frame_no):
+        with self._scheduler.drawing(frame_no):
+            super(PlayerFrame, self).update(frame_no)
+
+    def _update_song(self, song: SongInfo) -> None:
         """this is called from the player when new song information is available"""
         updated_song = {
-            "now_playing": now_playing
+            "now_playing": str(song),
+            "artist": song.artist or "-",
+            "song": song.title,
         }
 
         self.data = updated_song
@@ -156,6 +185,11 @@ class PlayerFrame(Frame):
 
         self.data = updated_station
 
+    def _update_switch_latency(self, latency: float, from_standby: bool) -> None:
+        """this is called from the player when audio starts after a station switch"""
+        source = "standby" if from_standby else "cold"
+        self.title = f"Player - switched in {latency * 1000:.0f} ms ({source})"
+
     def _update_map_with_station(self, station: dict) -> None:
         """this is called from the player when new station information is available"""
 
@@ -165,7 +199,6 @@ class PlayerFrame(Frame):
             "zoom": DEFAULT_ZOOM,
         }
         self._world_map.value = map_data
-        self._world_map.update(0)
 
     def play_pause(self):
         self._player.play_pause()
@@ -176,6 +209,26 @@ class PlayerFrame(Frame):
     def next_station(self):
         self._player.next_station()
 
+    def station_towards(self, direction: str):
+        # tune to the nearest station in a compass direction from the current one
+        current = self._player.current_station
+        station_id = self._station_index.towards(
+            *current["location"], direction, exclude=current["id"]
+        )
+        if station_id is not None:
+            self._player.select_station(station_id)
+
+    def nearest_station(self):
+        # tune to the station nearest the centre of the map
+        centre = self._world_map.value
+        station_id = self._station_index.nearest(centre["latitude"], centre["longitude"])
+        if station_id is not None:
+            self._player.select_station(station_id)
+
+    def stations_in_view(self):
+        count = len(self._station_index.within(*self._world_map.bounds()))
+        self.title = f"Player - {count} stations in view"
+
     def process_event(self, event: Event):
         if isinstance(event, KeyboardEvent):
             c = event.key_code
@@ -192,30 +245,117 @@ class PlayerFrame(Frame):
                     self.next_station()
                 case 112:
                     self.play_pause()
+                case Screen.KEY_UP:
+                    self.station_towards(NORTH)
+                case Screen.KEY_DOWN:
+                    self.station_towards(SOUTH)
+                case Screen.KEY_LEFT:
+                    self.station_towards(WEST)
+                case Screen.KEY_RIGHT:
+                    self.station_towards(EAST)
+                case 110:
+                    self.nearest_station()
+                case 118:
+                    self.stations_in_view()
                 case (3 | 113):
                     raise StopApplication("User terminated app")
 
 
+class StartupMetrics:
+    """Times the startup pipeline, from launch to the first audio and the first map frame."""
+
+    def __init__(self):
+        self._started = time.monotonic()
+        self._marks: dict[str, float] = {}
+
+    def mark(self, name: str, when: float | None = None) -> None:
+        # only the first time something happens counts
+        self._marks.setdefault(name, (when or time.monotonic()) - self._started)
+
+    def report(self) -> str:
+        if world_map and world_map.first_frame_at:
+            self.mark("first map frame", world_map.first_frame_at)
+        marks = sorted(self._marks.items(), key=lambda k: k[1])
+        return "Startup: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in marks)
+
+
 # these need to be globals so we don't step on ourselves later
 stream_player: StreamPlayer | None = None
+standby_pool: StandbyPool | None = None
+station_index: StationIndex | None = None
+station_overlay: StationOverlay | None = None
+play_history: PlayHistory | None = None
 world_map: Map | None = None
+render_scheduler = RenderScheduler()
+startup_metrics = StartupMetrics()
+
 
+def start_audio(player: StreamPlayer, metrics: StartupMetrics):
+    """Bring up mpv and attach it to the player, which starts the stream playing."""
+    wrapper = MPVWrapper()
+    metrics.mark("mpv ready")
+    player.attach(wrapper)
 
-def initialize_player_and_map():
-    global stream_player, world_map
+
+def index_stations(catalogue: StationCatalogue, index: StationIndex, overlay: StationOverlay):
+    """Fill the spatial index and the map markers from the catalogue."""
+    locations = list(catalogue.locations())
+    index.add(locations)
+    overlay.add(locations)
+
+
+def initialize_player_and_map(standby_size: int = STANDBY_POOL_SIZE):
+    global stream_player, standby_pool, station_index, station_overlay, play_history, world_map
     if not stream_player:
-        stream_player = StreamPlayer(MPVWrapper(), STATIONS_DB)
+        catalogue = open_catalogue()
+        # these fill in the background - until then, lookups and the map see fewer stations
+        station_index = StationIndex()
+        station_overlay = StationOverlay()
+        threading.Thread(
+            target=index_stations,
+            args=(catalogue, station_index, station_overlay),
+            daemon=True,
+        ).start()
+
+        # mpv starts up, and the first station starts playing, in the background while the map
+        # and the UI come up. The standby players start once the first station has its player.
+        if standby_size:
+            standby_pool = StandbyPool(standby_size, STANDBY_MAX_BYTES)
+        stream_player = StreamPlayer(None, StationCursor(catalogue), standby_pool)
+        stream_player.register_switch_callback(
+            lambda _latency, _standby: startup_metrics.mark("first audio"), WORKER
+        )
+        # keep every title that we hear
+        play_history = PlayHistory()
+        stream_player.register_play_callback(play_history.record)
+        stream_player.play()
+        threading.Thread(
+            target=start_audio, args=(stream_player, startup_metrics), daemon=True
+        ).start()
     if not world_map:
-        world_map = Map(name="Map", zoom=DEFAULT_ZOOM, satellite=False)
-        wait(lambda: world_map.is_ready, timeout_seconds=120, waiting_for="world map")
+        world_map = Map(
+            name="Map",
+            zoom=DEFAULT_ZOOM,
+            satellite=False,
+            stations=station_overlay,
+            scheduler=render_scheduler,
+        )
+        world_map.force_center(*stream_player.current_station["location"])
 
 
-def player(screen: Screen):
-    initialize_player_and_map()
-    map_frame = MapFrame(screen, world_map)
-    player_frame = PlayerFrame(screen, stream_player, world_map)
+def player(screen: Screen, standby_size: int = STANDBY_POOL_SIZE):
+    initialize_player_and_map(standby_size)
+    render_scheduler.attach(screen)
+    map_frame = MapFrame(screen, world_map, render_scheduler)
+    # the map frame sets the size of the map, so we can start on its tiles now
+    world_map.warm()
+    player_frame = PlayerFrame(
+        screen, stream_player, world_map, station_index, render_scheduler
+    )
 
+    # the pump goes first, so that the frames draw whatever it has just updated
     frames = [
+        EventPump(screen, stream_player.events, render_scheduler),
         map_frame,
         player_frame
     ]
@@ -232,9 +372,56 @@ def player(screen: Screen):
     )
 
 
-while True:
-    try:
-        Screen.wrapper(player, catch_interrupt=True)
-        sys.exit(0)
-    except ResizeScreenError as e:
-        last_scene = e.scene
+# the tile workers are spawned processes, which import this module - they mustn't start the UI
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Explore radio stations on a map of the world.")
+    parser.add_argument(
+        "--standby",
+        type=int,
+        default=STANDBY_POOL_SIZE,
+        metavar="N",
+        help="keep N neighbouring stations buffered for instant switching, at the cost of an "
+        "mpv instance and a stream each",
+    )
+    args = parser.parse_args()
+    if args.standby < 0:
+        parser.error("--standby can't be negative")
+    while True:
+        try:
+            Screen.wrapper(player, catch_interrupt=True, arguments=[args.standby])
+            if standby_pool:
+                standby_pool.close()
+            if play_history:
+                play_history.close()
+            shutdown_worker_pool()
+            print(startup_metrics.report())
+            render_stats = render_scheduler.stats
+            print(
+                f"Rendering: {render_stats['frames']} frames, "
+                f"mean {render_stats['mean'] * 1000:.1f} ms, "
+                f"slowest {render_stats['slowest'] * 1000:.1f} ms, "
+                f"{render_stats['redraws']} redraws for {render_stats['requests']} requests"
+            )
+            fetch_stats = world_map.fetch_stats
+            print(
+                f"Tiles: {fetch_stats['downloads']} downloaded ({fetch_stats['bytes']} bytes), "
+                f"{fetch_stats['cancelled']} cancelled, {fetch_stats['wasted_bytes']} bytes wasted, "
+                f"{fetch_stats['timeouts']} timeouts, {fetch_stats['failures']} failures"
+            )
+            cache_stats = world_map.cache_stats
+            print(
+                f"Tile cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                f"{cache_stats['evictions']} evictions, {cache_stats['tiles']} tiles "
+                f"({cache_stats['bytes']} of {cache_stats['max_bytes']} bytes)"
+            )
+            for name, stats in stream_player.events.stats().items():
+                print(
+                    f"{name}: {stats['calls']} calls, mean {stats['mean'] * 1000:.2f} ms, "
+                    f"slowest {stats['slowest'] * 1000:.2f} ms, {stats['dropped']} coalesced, "
+                    f"{stats['errors']} errors"
+                )
+            if stream_player.events.last_error:
+                print(f"Last callback error: {stream_player.events.last_error}")
+            sys.exit(0)
+        except ResizeScreenError as e:
+            last_scene = e.scene
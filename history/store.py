@@ -0,0 +1,330 @@
+"""
+Play history - every title change that we hear about, kept in an append-only store for later
+analytics.
+
+New plays go to a small journal (one JSON line each, numbered, so nothing is lost on a crash)
+and are batched up in memory. Each full batch is written out as an immutable, compressed
+segment:
+
+    header   magic "SEPH", version (u16), play count (u32), first and last time (i64),
+             compressed sizes of the strings and the columns (u32), and the journal number
+             of the last play in it (u64)
+    strings  the segment's distinct countries, artists and titles, NUL separated
+    columns  time (i64), station id, country, artist and title (u32 string numbers) -
+             a whole column at a time, which compresses far better than row by row
+
+Queries stream through the segments one at a time. Segments outside the time range are
+skipped on their header alone, and when looking for a title, so are any whose strings don't
+include it - without decompressing their columns.
+
+The journal is emptied once a segment is written. If that never happens, because of a crash,
+the plays that the segments already cover are skipped when the journal is read back. Segments
+that can't be read are set aside, with a .bad suffix, rather than stopping the whole history
+from opening.
+"""
+from array import array
+from collections import Counter
+from collections.abc import Iterator
+from datetime import date, timedelta
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from typing import NamedTuple
+import zlib
+
+from stream_meta.titles import SongInfo, artist_key
+
+_MAGIC = b"SEPH"
+_VERSION = 2
+_HEADER = struct.Struct("<4sHIqqIIQ")
+# Version 1 segments are the same without the journal number, which counts as 0.
+_V1_HEADER = struct.Struct("<4sHIqqII")
+_MAGIC_AND_VERSION = struct.Struct("<4sH")
+_JOURNAL = "journal.jsonl"
+_SEGMENT_NAME = "segment-{:08d}.seg"
+_BATCH_SIZE = 50_000
+_COLUMN_TYPES = ("q", "I", "I", "I", "I")
+_SECONDS_PER_DAY = 24 * 60 * 60
+# 1970-01-01 was a Thursday - this lines weeks up with Mondays.
+_EPOCH_WEEKDAY = 3
+
+
+class Play(NamedTuple):
+    time: int
+    station: int
+    country: str
+    artist: str
+    title: str
+
+
+def _week(timestamp: int) -> int:
+    # the Monday of the week that a (UTC) timestamp is in, in days since 1970-01-01
+    days = timestamp // _SECONDS_PER_DAY
+    return days - (days + _EPOCH_WEEKDAY) % 7
+
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class _Segment:
+    """A segment file, of which only the header is read until its plays are needed."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+        try:
+            magic, version = _MAGIC_AND_VERSION.unpack_from(header)
+            if magic == _MAGIC and version == _VERSION:
+                fields = _HEADER.unpack(header)[2:]
+                self._offset = _HEADER.size
+            elif magic == _MAGIC and version == 1:
+                fields = _V1_HEADER.unpack_from(header)[2:] + (0,)
+                self._offset = _V1_HEADER.size
+            else:
+                raise ValueError("{} is not a history segment".format(path))
+        except struct.error as e:
+            raise ValueError("{} is not a history segment".format(path)) from e
+        self.count, self.first, self.last, self._strings_size, columns_size, self.sequence = (
+            fields
+        )
+        if os.path.getsize(path) != self._offset + self._strings_size + columns_size:
+            raise ValueError("{} is cut short".format(path))
+
+    def strings(self) -> list[str]:
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = zlib.decompress(f.read(self._strings_size))
+        return data.decode("utf-8").split("\0")
+
+    def columns(self) -> list[array]:
+        with open(self.path, "rb") as f:
+            f.seek(self._offset + self._strings_size)
+            data = zlib.decompress(f.read())
+        columns = []
+        offset = 0
+        for typecode in _COLUMN_TYPES:
+            column = array(typecode)
+            end = offset + self.count * column.itemsize
+            column.frombytes(data[offset:end])
+            columns.append(_little_endian(column))
+            offset = end
+        return columns
+
+    @staticmethod
+    def write(path: str, plays: list[Play], sequence: int) -> None:
+        strings: dict[str, int] = {}
+        columns = [array(typecode) for typecode in _COLUMN_TYPES]
+        times, stations, countries, artists, titles = columns
+        for play in plays:
+            times.append(play.time)
+            stations.append(play.station)
+            countries.append(strings.setdefault(play.country, len(strings)))
+            artists.append(strings.setdefault(play.artist, len(strings)))
+            titles.append(strings.setdefault(play.title, len(strings)))
+
+        packed_strings = zlib.compress("\0".join(strings).encode("utf-8"), 9)
+        packed_columns = zlib.compress(
+            b"".join(_little_endian(column).tobytes() for column in columns), 9
+        )
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(
+                _HEADER.pack(
+                    _MAGIC,
+                    _VERSION,
+                    len(plays),
+                    min(times),
+                    max(times),
+                    len(packed_strings),
+                    len(packed_columns),
+                    sequence,
+                )
+            )
+            f.write(packed_strings)
+            f.write(packed_columns)
+        os.replace(temp_path, path)
+
+
+class PlayHistory:
+    """The play history store. Plays can be recorded from any thread."""
+
+    def __init__(self, directory: str = "history", batch_size: int = _BATCH_SIZE):
+        self._directory = directory
+        self._batch_size = batch_size
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._segments = []
+        names = sorted(os.listdir(directory))
+        for name in names:
+            if name.endswith(".seg"):
+                path = os.path.join(directory, name)
+                try:
+                    self._segments.append(_Segment(path))
+                except (OSError, ValueError):
+                    # e.g. cut short by a full disk - keep it for a look, but out of the way
+                    os.replace(path, path + ".bad")
+        # numbered after every segment there has been, including any set aside
+        self._next_segment = 1 + max(
+            (int(name[8:16]) for name in names if name.startswith("segment-")), default=0
+        )
+        # the last title recorded per station, so that repeats of the same one are ignored
+        self._last_titles: dict[int, str] = {}
+
+        # Plays that haven't made it into a segment yet survive in the journal, each one
+        # numbered so that the segments can say how far through the journal they go.
+        self._batch: list[Play] = []
+        covered = max((segment.sequence for segment in self._segments), default=0)
+        self._sequence = covered
+        journal_path = os.path.join(directory, _JOURNAL)
+        if os.path.isfile(journal_path):
+            with open(journal_path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                        # lines from before the journal was numbered have no number
+                        sequence = entry.pop(0) if len(entry) > len(Play._fields) else None
+                        play = Play(*entry)
+                    except (ValueError, TypeError, AttributeError):
+                        # a line cut short by a crash
+                        continue
+                    if sequence is not None:
+                        if sequence <= covered:
+                            # written out to a segment, before a crash stopped the journal
+                            # being emptied
+                            continue
+                        self._sequence = max(self._sequence, sequence)
+                    self._batch.append(play)
+        self._journal = open(journal_path, "a", encoding="utf-8")
+
+    def record(self, station: dict, song: SongInfo | None, when: float | None = None) -> None:
+        """Record that a station started playing a song. Anything that isn't one is ignored."""
+        if song is None or song.raw == "-":
+            return
+        play = Play(
+            int(when if when is not None else time.time()),
+            station["id"],
+            station["country"],
+            song.artist.replace("\0", ""),
+            song.title.replace("\0", ""),
+        )
+        with self._lock:
+            if self._last_titles.get(play.station) == song.raw:
+                return
+            self._last_titles[play.station] = song.raw
+            self._sequence += 1
+            self._journal.write(json.dumps([self._sequence, *play], ensure_ascii=False) + "\n")
+            self._journal.flush()
+            self._batch.append(play)
+            if len(self._batch) >= self._batch_size:
+                self._write_segment()
+
+    def flush(self) -> None:
+        """Write out any batched plays as a segment."""
+        with self._lock:
+            if self._batch:
+                self._write_segment()
+
+    def close(self) -> None:
+        self.flush()
+        self._journal.close()
+
+    def _write_segment(self) -> None:
+        path = os.path.join(self._directory, _SEGMENT_NAME.format(self._next_segment))
+        _Segment.write(path, self._batch, self._sequence)
+        self._next_segment += 1
+        self._segments.append(_Segment(path))
+        self._batch = []
+        self._journal.truncate(0)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(segment.count for segment in self._segments) + len(self._batch)
+
+    def scan(
+        self,
+        since: int | None = None,
+        until: int | None = None,
+        title: str | None = None,
+        country: str | None = None,
+    ) -> Iterator[Play]:
+        """
+        Every play in [since, until), optionally only of a title (ignoring case) or only in a
+        country. Reads one segment at a time.
+        """
+        since = since if since is not None else -(2 ** 63)
+        until = until if until is not None else 2 ** 63 - 1
+        title = title.casefold() if title is not None else None
+        with self._lock:
+            segments = list(self._segments)
+            batch = list(self._batch)
+
+        for segment in segments:
+            if segment.last < since or segment.first >= until:
+                continue
+            strings = segment.strings()
+            # narrow the filters down to this segment's string numbers
+            titles = countries = None
+            if title is not None:
+                titles = {i for i, s in enumerate(strings) if s.casefold() == title}
+                if not titles:
+                    continue
+            if country is not None:
+                countries = {i for i, s in enumerate(strings) if s == country}
+                if not countries:
+                    continue
+            for t, station, c, a, s in zip(*segment.columns()):
+                if (
+                    since <= t < until
+                    and (titles is None or s in titles)
+                    and (countries is None or c in countries)
+                ):
+                    yield Play(t, station, strings[c], strings[a], strings[s])
+
+        for play in batch:
+            if (
+                since <= play.time < until
+                and (title is None or play.title.casefold() == title)
+                and (country is None or play.country == country)
+            ):
+                yield play
+
+    def top_artists(
+        self,
+        since: int | None = None,
+        until: int | None = None,
+        country: str | None = None,
+        limit: int = 10,
+    ) -> dict[tuple[str, date], list[tuple[str, int]]]:
+        """
+        The most played artists for each (country, week), most played first. Different spellings
+        of an artist (see artist_key) count as one, under the spelling heard most often.
+        """
+        counts: dict[tuple[str, int], Counter] = {}
+        spellings: dict[str, Counter] = {}
+        for play in self.scan(since, until, country=country):
+            if play.artist:
+                artist = artist_key(play.artist)
+                key = (play.country, _week(play.time))
+                counts.setdefault(key, Counter())[artist] += 1
+                spellings.setdefault(artist, Counter())[play.artist] += 1
+        names = {artist: counter.most_common(1)[0][0] for artist, counter in spellings.items()}
+        return {
+            (country, date(1970, 1, 1) + timedelta(days=week)): [
+                (names[artist], count) for artist, count in counter.most_common(limit)
+            ]
+            for (country, week), counter in sorted(counts.items())
+        }
+
+    def plays_by_station(
+        self, title: str, since: int | None = None, until: int | None = None
+    ) -> Counter:
+        """How many times each station (by id) has played a title."""
+        return Counter(play.station for play in self.scan(since, until, title=title))
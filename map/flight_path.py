@@ -0,0 +1,115 @@
+"""
+The animated "flight" of the map from one location to another: zoom out until the destination
+is close, pan across, then zoom back in.
+
+The animation is worked out here as a pure function of the current view, so that the map can
+step through it a frame at a time and the tile prefetcher can plan the whole flight up front.
+"""
+from math import ceil, exp, floor, log, sqrt
+from typing import NamedTuple
+
+from map import projection
+
+# The size of a tile (in text lines) at rest, and the sizes at which the map swaps to the next
+# zoom level while animating.
+START_SIZE = 64
+ZOOM_IN_SIZE = START_SIZE * 2
+ZOOM_OUT_SIZE = START_SIZE // 2
+ZOOM_ANIMATION_STEPS = 6
+ZOOM_STEP = exp(log(2) / ZOOM_ANIMATION_STEPS)
+MAX_ZOOM = 20
+
+# A flight never takes anywhere near this many frames - it is just a guard for planning.
+_MAX_STEPS = 2000
+
+
+class View(NamedTuple):
+    latitude: float
+    longitude: float
+    zoom: int
+    size: float
+
+
+def zoom_step(view: View, zoom_out: bool, satellite: bool) -> View:
+    """Animate the zoom in/out as appropriate for the displayed map tile."""
+    latitude, longitude, zoom, size = view
+    size_step = 1 / ZOOM_STEP if zoom_out else ZOOM_STEP
+    if satellite:
+        size_step **= ZOOM_ANIMATION_STEPS
+    size *= size_step
+    if size <= ZOOM_OUT_SIZE:
+        if zoom > 0:
+            zoom -= 1
+            size = START_SIZE
+        else:
+            size = ZOOM_OUT_SIZE
+    elif size >= ZOOM_IN_SIZE:
+        if zoom < MAX_ZOOM:
+            zoom += 1
+            size = START_SIZE
+        else:
+            size = ZOOM_IN_SIZE
+    return View(latitude, longitude, zoom, size)
+
+
+def step(view: View, desired: View, satellite: bool) -> tuple[View, bool]:
+    """
+    Move one animation frame from `view` towards `desired` (whose size is ignored).
+    Returns the new view and whether anything moved.
+    """
+    moved = False
+    x_start = projection.convert_longitude(view.longitude, view.zoom, view.size)
+    y_start = projection.convert_latitude(view.latitude, view.zoom, view.size)
+    x_end = projection.convert_longitude(desired.longitude, view.zoom, view.size)
+    y_end = projection.convert_latitude(desired.latitude, view.zoom, view.size)
+    if sqrt((x_end - x_start) ** 2 + (y_end - y_start) ** 2) > START_SIZE // 4:
+        view = zoom_step(view, True, satellite)
+        moved = True
+    elif view.zoom != desired.zoom:
+        view = zoom_step(view, desired.zoom < view.zoom, satellite)
+        moved = True
+
+    latitude, longitude, zoom, size = view
+    if longitude != desired.longitude:
+        moved = True
+        if desired.longitude < longitude:
+            longitude = max(longitude - 360 / 2 ** zoom / size * 2, desired.longitude)
+        else:
+            longitude = min(longitude + 360 / 2 ** zoom / size * 2, desired.longitude)
+    if latitude != desired.latitude:
+        moved = True
+        if desired.latitude < latitude:
+            latitude = max(projection.inc_lat(latitude, 2, zoom, size), desired.latitude)
+        else:
+            latitude = min(projection.inc_lat(latitude, -2, zoom, size), desired.latitude)
+    return View(latitude, longitude, zoom, size), moved
+
+
+def plan(view: View, desired: View, satellite: bool) -> list[View]:
+    """Every view that the map will show on its way to `desired`, starting with `view`."""
+    path = [view]
+    for _ in range(_MAX_STEPS):
+        view, moved = step(view, desired, satellite)
+        if not moved:
+            break
+        path.append(view)
+    return path
+
+
+def visible_tiles(view: View, width: int, height: int) -> list[tuple[int, int, int]]:
+    """The (z, x, y) tiles that can be seen in a `width` x `height` canvas showing `view`."""
+    zoom, size = view.zoom, view.size
+    n = 2 ** zoom
+    x_offset = projection.convert_longitude(view.longitude, zoom, size)
+    y_offset = projection.convert_latitude(view.latitude, zoom, size)
+
+    # Tiles are 2 characters wide for every text line that they are high.
+    left = x_offset - width // 4
+    top = y_offset - height // 2
+    x_range = range(
+        max(0, ceil((left - size) / size)), min(n, floor((left + width / 2) / size) + 1)
+    )
+    y_range = range(
+        max(0, ceil((top - size) / size)), min(n, floor((top + height) / size) + 1)
+    )
+    return [(zoom, x, y) for x in x_range for y in y_range]
@@ -0,0 +1,72 @@
+"""
+Map labels, placed over the map so that they don't overwrite each other.
+
+Whenever the view changes, every label in the tiles on screen is offered to the label layer,
+which places them most important first: each one that fits is marked in an occupancy grid of
+the canvas, and any later one that would overlap it is dropped. While the view is still, the
+labels that were placed are just printed again.
+"""
+from typing import NamedTuple
+
+from wcwidth import wcswidth
+
+# Text widths are remembered, as the same labels come round again and again - up to a point.
+_MAX_WIDTHS = 4096
+
+
+class Label(NamedTuple):
+    # lowest first
+    priority: tuple
+    # where the middle of the text goes, in characters
+    x: float
+    y: float
+    text: str
+    colour: int
+    bg: int
+
+
+class LabelLayer:
+    """The labels placed for the current view of the map."""
+
+    def __init__(self):
+        # (x, y, text, colour, bg) for each label that was placed
+        self._placed: list[tuple[int, int, str, int, int]] = []
+        self._widths: dict[str, int] = {}
+
+    def _width(self, text: str, unicode: bool) -> int:
+        if not unicode:
+            return len(text)
+        width = self._widths.get(text)
+        if width is None:
+            if len(self._widths) >= _MAX_WIDTHS:
+                self._widths.clear()
+            # wide characters take two cells - and unprintable ones are counted as one
+            width = self._widths[text] = max(wcswidth(text), len(text))
+        return width
+
+    def place(self, labels: list[Label], width: int, height: int, unicode: bool) -> None:
+        """
+        Place `labels` on a `width` x `height` canvas, replacing the ones placed before. Labels
+        that would overlap one of higher priority, or run off the canvas, are left out.
+        """
+        placed = []
+        occupied = bytearray(width * height)
+        for label in sorted(labels, key=lambda k: k.priority):
+            y = int(label.y)
+            if not 0 <= y < height:
+                continue
+            text_width = self._width(label.text, unicode)
+            x = int(label.x - text_width / 2)
+            if x < 0 or x + text_width > width:
+                continue
+            start = y * width + x
+            if any(occupied[start:start + text_width]):
+                continue
+            occupied[start:start + text_width] = b"\x01" * text_width
+            placed.append((x, y, label.text, label.colour, label.bg))
+        self._placed = placed
+
+    def draw(self, canvas) -> None:
+        """Print the placed labels onto a canvas."""
+        for x, y, text, colour, bg in self._placed:
+            canvas.print_at(text, x, y, colour, 0, bg)
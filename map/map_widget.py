@@ -2,22 +2,30 @@
 
 # -*- coding: utf-8 -*-
 import traceback
-from math import pi, exp, atan, log, tan, sqrt
 import os
-import json
 import threading
-from ast import literal_eval
-from collections import OrderedDict
-from asciimatics.renderers import ColourImageFile
+import time
+from functools import partial
+from math import ceil
 from asciimatics.widgets import (
     Widget,
 )
-from asciimatics.screen import Screen
+from asciimatics.screen import Canvas, Screen
 
-import mapbox_vector_tile
-import requests
 from google.protobuf.message import DecodeError
 
+from map import flight_path, projection
+from map.label_layer import Label, LabelLayer
+from map.render_scheduler import RenderScheduler
+from map.satellite_tile import SatelliteTile, render as render_satellite
+from map.station_overlay import StationOverlay
+from map.tile_cache import TileCache
+from map.tile_fetcher import VISIBLE, TileCancelled, TileFetcher, TileUnavailable
+from map.tile_pack import TilePack
+from map.tile_store import TileStore
+from map.vector_tile import VectorTile, POINT, LINESTRING, POLYGON, lod_for_size
+from map.worker_pool import worker_pool
+
 # Global constants for the applications
 # Replace `_KEY` with the free one that you get from signing up with www.mapbox.com
 _KEY = "pk.eyJ1IjoibWVjaGFuaXNtcy1jYSIsImEiOiJja2NrcDdpbnYxdjI2MnRwMHk2dnNuNWkwIn0.RGSSo89KbvbC0ca6iGyXdw"
@@ -25,12 +33,55 @@ _VECTOR_URL = (
     "http://a.tiles.mapbox.com/v4/mapbox.mapbox-streets-v7/{}/{}/{}.mvt?access_token={}"
 )
 _IMAGE_URL = "https://api.mapbox.com/styles/v1/mapbox/satellite-v9/tiles/256/{}/{}/{}?access_token={}"
-_START_SIZE = 64
-_ZOOM_IN_SIZE = _START_SIZE * 2
-_ZOOM_OUT_SIZE = _START_SIZE // 2
-_ZOOM_ANIMATION_STEPS = 6
-_ZOOM_STEP = exp(log(2) / _ZOOM_ANIMATION_STEPS)
-_CACHE_SIZE = 180
+_START_SIZE = flight_path.START_SIZE
+# How many zoom levels up to look for a loaded tile to stand in for one that is still loading.
+_STAND_IN_LEVELS = 3
+# Tiles are served from this pack, if there is one, before the cache or the network.
+_TILE_PACK = "stations.tilepack"
+# Memory budget for decoded tiles held in memory.
+_CACHE_BYTES = 64 * 1024 * 1024
+# The vector tile layers that Map._get_features ever draws - the rest are dropped as tiles are
+# decoded. (Tiles already on disk or in a pack keep the layers that they were decoded with.)
+_DRAWN_LAYERS = frozenset(
+    [
+        "admin",
+        "building",
+        "country_label",
+        "landuse",
+        "marine_label",
+        "place_label",
+        "poi_label",
+        "road",
+        "state_label",
+        "water",
+        "waterway",
+    ]
+)
+
+
+def new_tile_fetcher(satellite: bool) -> TileFetcher:
+    """A fetcher for the Mapbox vector or satellite tile server."""
+    return TileFetcher(_IMAGE_URL if satellite else _VECTOR_URL, _KEY)
+
+
+def decode_vector_tile(data: bytes) -> bytes:
+    """
+    Decode raw MVT data in the worker processes, keeping only the layers that the map draws.
+    Returns the packed tile (see VectorTile.to_bytes), and blocks the calling thread - which
+    mustn't be the UI thread - until it is ready.
+    Raises google.protobuf.message.DecodeError if this isn't a valid tile.
+    """
+    return worker_pool().submit(VectorTile.from_mvt_packed, data, _DRAWN_LAYERS).result()
+
+
+class _OffscreenCanvas(Canvas):
+    """A Canvas that can also be copied onto another canvas, at an offset."""
+
+    def __init__(self, canvas, height, width):
+        super(_OffscreenCanvas, self).__init__(canvas, height, width, x=0, y=0)
+
+    def blit_to(self, canvas, x, y):
+        canvas.block_transfer(self._buffer, x, y)
 
 
 class Map(Widget):
@@ -53,16 +104,52 @@ class Map(Widget):
         self._desired_latitude = value_dict.get("latitude")
         self._desired_longitude = value_dict.get("longitude")
         self._desired_zoom = value_dict.get("zoom")
-        self.update(0)
+        self._prefetch_flight()
+        self._scheduler.request_redraw()
+
+    def bounds(self):
+        """The (south, west, north, east) latitude/longitude box that is on screen."""
+        width = self._frame.canvas.width
+        height = self._frame.canvas.height
+        # Tiles are 2 characters wide for every text line that they are high.
+        left = self._convert_longitude(self._longitude) - width // 4
+        top = self._convert_latitude(self._latitude) - height // 2
+        return (
+            projection.y_to_latitude(top + height, self._zoom, self._size),
+            max(projection.x_to_longitude(left, self._zoom, self._size), -180),
+            projection.y_to_latitude(top, self._zoom, self._size),
+            min(projection.x_to_longitude(left + width / 2, self._zoom, self._size), 180),
+        )
 
     def force_center(self, lat, lon):
-        self._latitude = lat
-        self._longitude = lon
+        self._latitude = self._desired_latitude = lat
+        self._longitude = self._desired_longitude = lon
+
+    def start(self):
+        """Start the background thread that loads tiles, if it isn't already running."""
+        if self._thread.ident is None:
+            self._thread.start()
+
+    def warm(self):
+        """
+        Start loading the tiles around the current centre straight away, rather than waiting
+        for the first frame to be drawn.
+        """
+        view = flight_path.View(self._latitude, self._longitude, self._zoom, self._size)
+        for tile in flight_path.visible_tiles(
+            view, self._frame.canvas.width, self._frame.canvas.height
+        ):
+            self._request_tile(*tile, self._tile_priority(view, *tile))
+        self.start()
 
     def update(self, frame_no):
+        # the frame copies its canvas to the screen once everything in it is drawn
         self._update(frame_no)
-        self._updated.set()
-        self._frame.canvas.refresh()
+
+    @property
+    def frame_update_count(self):
+        # while flying, ask for frames at the animation rate - otherwise only when needed
+        return self._scheduler.animation_interval if self._next_update == 1 else 0
 
     def reset(self):
         self.update(0)
@@ -101,6 +188,14 @@ class Map(Widget):
         "road": Screen.COLOUR_WHITE,
         "poi_label": Screen.COLOUR_RED,
     }
+    # Label layers, most important first - so where labels collide, the earlier layer wins.
+    _LABEL_PRIORITY = {
+        "country_label": 0,
+        "marine_label": 1,
+        "state_label": 2,
+        "place_label": 3,
+        "poi_label": 4,
+    }
 
     __slots__ = [
         "_latitude",
@@ -121,6 +216,17 @@ class Map(Widget):
         "_frame",
         "_ready",
         "_value_update_count",
+        "_fetcher",
+        "_store",
+        "_pack",
+        "_canvas",
+        "_spare_canvas",
+        "_rendered",
+        "_rendered_count",
+        "_first_frame_at",
+        "_stations",
+        "_scheduler",
+        "_labels",
     ]
 
     def __init__(
@@ -130,6 +236,11 @@ class Map(Widget):
         zoom: int = 5,
         satellite: bool = False,
         name: str = None,
+        fetcher: TileFetcher = None,
+        cache_bytes: int = _CACHE_BYTES,
+        tile_pack: str = _TILE_PACK,
+        stations: StationOverlay = None,
+        scheduler: RenderScheduler = None,
         **kwargs,
     ):
         super(Map, self).__init__(name, disabled=True, **kwargs)
@@ -138,10 +249,21 @@ class Map(Widget):
         self._zoom = zoom
         self._latitude = latitude
         self._longitude = longitude
-        self._tiles = OrderedDict()
+        self._tiles = TileCache(cache_bytes)
         self._size = _START_SIZE
         self._satellite = satellite
 
+        # Off-screen rendering of the map, and what it was rendered from: the view, the version
+        # of the tile cache and the offsets of the centre of the view.
+        self._canvas = None
+        self._spare_canvas = None
+        self._rendered = None
+        self._rendered_count = 0
+        self._first_frame_at = None
+
+        # The labels over the map, placed afresh whenever the view changes.
+        self._labels = LabelLayer()
+
         # Desired viewing location and animation flags
         self._desired_zoom = self._zoom
         self._desired_latitude = self._latitude
@@ -155,10 +277,21 @@ class Map(Widget):
         self._oops = None
         self._thread = threading.Thread(target=self._get_tiles)
         self._thread.daemon = True
+        self._fetcher = fetcher or new_tile_fetcher(satellite)
 
         # a separate directory to store cached files.
-        if not os.path.isdir("mapscache"):
-            os.mkdir("mapscache")
+        self._store = TileStore("mapscache")
+        self._pack = None
+        if tile_pack and os.path.isfile(tile_pack):
+            pack = TilePack(tile_pack)
+            if pack.satellite == satellite:
+                self._pack = pack
+
+        # Station markers, drawn over the map.
+        self._stations = stations
+
+        # Redraws are asked for here, rather than made straight away from whichever thread.
+        self._scheduler = scheduler or RenderScheduler()
 
         self._ready = True
 
@@ -166,83 +299,102 @@ class Map(Widget):
     def is_ready(self):
         return self._ready
 
-    def _scale_coords(self, x, y, extent, xo, yo):
-        """Convert from tile coordinates to "pixels" - i.e. text characters."""
-        return xo + (x * self._size * 2 / extent), yo + (
-            (extent - y) * self._size / extent
-        )
+    @property
+    def first_frame_at(self):
+        """The time.monotonic() at which the first map tiles were drawn, or None."""
+        return self._first_frame_at
+
+    @property
+    def cache_stats(self):
+        """Hit, miss and eviction counts and the memory held by the in-memory tile cache."""
+        return self._tiles.stats
+
+    @property
+    def fetch_stats(self):
+        """Download, cancellation, wasted byte, timeout and failure counts for tile loads."""
+        return self._fetcher.stats
 
     def _convert_longitude(self, longitude):
         """Convert from longitude to the x position in overall map."""
-        return int((180 + longitude) * (2 ** self._zoom) * self._size / 360)
+        return projection.convert_longitude(longitude, self._zoom, self._size)
 
     def _convert_latitude(self, latitude):
         """Convert from latitude to the y position in overall map."""
-        return int(
-            (180 - (180 / pi * log(tan(pi / 4 + latitude * pi / 360))))
-            * (2 ** self._zoom)
-            * self._size
-            / 360
-        )
+        return projection.convert_latitude(latitude, self._zoom, self._size)
 
-    def _inc_lat(self, latitude, delta):
-        """Shift the latitude by the required number of pixels (i.e. text lines)."""
-        y = self._convert_latitude(latitude)
-        y += delta
-        return (
-            360
-            / pi
-            * atan(exp((180 - y * 360 / (2 ** self._zoom) / self._size) * pi / 180))
-            - 90
-        )
+    def _tile_key(self, x_tile, y_tile, z_tile, satellite):
+        """The cache file for a tile, which also keys it in the in-memory tile cache."""
+        if satellite:
+            return self._store.image_path(z_tile, x_tile, y_tile)
+        return self._store.vector_path(z_tile, x_tile, y_tile)
 
     def _get_satellite_tile(self, x_tile, y_tile, z_tile):
-        """Load up a single satellite image tile."""
-        cache_file = "mapscache/{}.{}.{}.jpg".format(z_tile, x_tile, y_tile)
+        """
+        Load up a single satellite image tile - rendered for this screen, from the disk cache
+        if it has been before, otherwise by the worker processes.
+        """
+        cache_file = self._tile_key(x_tile, y_tile, z_tile, True)
         if cache_file not in self._tiles:
-            if not os.path.isfile(cache_file):
-                url = _IMAGE_URL.format(z_tile, x_tile, y_tile, _KEY)
-                data = requests.get(url).content
-                with open(cache_file, "wb") as f:
-                    f.write(data)
-            self._tiles[cache_file] = [
-                x_tile,
-                y_tile,
-                z_tile,
-                ColourImageFile(
-                    self._frame.canvas,
-                    cache_file,
-                    height=_START_SIZE,
-                    dither=True,
-                    uni=self._frame.canvas.unicode_aware,
-                ),
-                True,
-            ]
-            if len(self._tiles) > _CACHE_SIZE:
-                self._tiles.popitem(False)
-            self._frame.canvas.refresh()
+            colours = self._frame.canvas.colours
+            unicode = self._frame.canvas.unicode_aware
+            tile = self._store.load_satellite(z_tile, x_tile, y_tile, colours, unicode)
+            if tile is None:
+                image = self._pack.get(z_tile, x_tile, y_tile) if self._pack else None
+                source = "pack"
+                if image is not None:
+                    # a view of the pack can't be pickled over to the workers - but a copy can
+                    image = bytes(image)
+                elif os.path.isfile(cache_file):
+                    with open(cache_file, "rb") as f:
+                        image = f.read()
+                    source = "disk"
+                else:
+                    image = self._fetcher.download(z_tile, x_tile, y_tile)
+                    source = "server"
+                try:
+                    packed = worker_pool().submit(
+                        render_satellite,
+                        image,
+                        self._frame.canvas.palette,
+                        unicode,
+                        _START_SIZE,
+                    ).result()
+                except (OSError, ValueError) as e:
+                    # Not an image - e.g. an error page saved by an older version. Don't keep
+                    # it, so that the tile is downloaded again next time it is wanted.
+                    if source == "disk":
+                        os.remove(cache_file)
+                    raise TileUnavailable(cache_file) from e
+                # Only keep what the server sent us once we know it is a real tile.
+                if source == "server":
+                    self._store.save_image(z_tile, x_tile, y_tile, image)
+                tile = SatelliteTile.from_bytes(packed)
+                self._store.save_satellite(z_tile, x_tile, y_tile, colours, unicode, packed)
+            self._tiles.put(cache_file, [x_tile, y_tile, z_tile, tile, True], tile.nbytes)
+            self._scheduler.request_redraw()
 
     def _get_vector_tile(self, x_tile, y_tile, z_tile):
         """Load up a single vector tile."""
-        cache_file = "mapscache/{}.{}.{}.json".format(z_tile, x_tile, y_tile)
+        cache_file = self._tile_key(x_tile, y_tile, z_tile, False)
         if cache_file not in self._tiles:
-            if os.path.isfile(cache_file):
-                with open(cache_file, "rb") as f:
-                    tile = json.loads(f.read().decode("utf-8"))
-            else:
-                url = _VECTOR_URL.format(z_tile, x_tile, y_tile, _KEY)
-                data = requests.get(url).content
+            tile = self._pack.vector(z_tile, x_tile, y_tile) if self._pack else None
+            if tile is None:
+                tile = self._store.load_vector(z_tile, x_tile, y_tile)
+            if tile is None:
+                data = self._fetcher.download(z_tile, x_tile, y_tile)
                 try:
-                    tile = mapbox_vector_tile.decode(data)
-                    with open(cache_file, mode="w") as f:
-                        json.dump(literal_eval(repr(tile)), f)
+                    packed = decode_vector_tile(data)
                 except DecodeError:
-                    tile = None
+                    packed = None
+                if packed is not None:
+                    # Only keep what the server sent us once we know it is a real tile.
+                    tile = VectorTile.from_bytes(packed)
+                    self._store.save_packed_vector(z_tile, x_tile, y_tile, packed)
             if tile:
-                self._tiles[cache_file] = [x_tile, y_tile, z_tile, tile, False]
-                if len(self._tiles) > _CACHE_SIZE:
-                    self._tiles.popitem(False)
-                self._frame.canvas.refresh()
+                self._tiles.put(
+                    cache_file, [x_tile, y_tile, z_tile, tile, False], tile.nbytes
+                )
+                self._scheduler.request_redraw()
 
     def _get_tiles(self):
         """Background thread to download map tiles as required."""
@@ -250,73 +402,75 @@ class Map(Widget):
             self._updated.wait()
             self._updated.clear()
 
-            # Save off current view and find the nearest tile.
-            satellite = self._satellite
-            zoom = self._zoom
-            size = self._size
-            n = 2 ** zoom
-            x_offset = self._convert_longitude(self._longitude)
-            y_offset = self._convert_latitude(self._latitude)
-
-            # Get the visible tiles around that location - getting most relevant first
-            for x, y, z in [
-                (0, 0, 0),
-                (1, 0, 0),
-                (0, 1, 0),
-                (-1, 0, 0),
-                (0, -1, 0),
-                (0, 0, -1),
-                (0, 0, 1),
-                (1, 1, 0),
-                (1, -1, 0),
-                (-1, -1, 0),
-                (-1, 1, 0),
-            ]:
-                # Restart if we've already zoomed to another level
-                if self._zoom != zoom:
-                    break
-
-                # Don't get tile if it falls off the grid
-                x_tile = int(x_offset // size) + x
-                y_tile = int(y_offset // size) + y
-                z_tile = zoom + z
-                if (
-                    x_tile < 0
-                    or x_tile >= n
-                    or y_tile < 0
-                    or y_tile >= n
-                    or z_tile < 0
-                    or z_tile > 20
-                ):
-                    continue
-                # noinspection PyBroadException
-                try:
-
-                    # Don't bother rendering if the tile is not visible
-                    top = y_tile * size - y_offset + self._frame.canvas.height // 2
-                    left = (
-                        x_tile * size - x_offset + self._frame.canvas.width // 4
-                    ) * 2
-                    if z == 0 and (
-                        left > self._frame.canvas.width
-                        or left + self._size * 2 < 0
-                        or top > self._frame.canvas.height
-                        or top + self._size < 0
-                    ):
-                        continue
+            # Save off current view.
+            view = flight_path.View(self._latitude, self._longitude, self._zoom, self._size)
+            x_offset = self._convert_longitude(view.longitude)
+            y_offset = self._convert_latitude(view.latitude)
+
+            # The visible tiles, plus the ones a zoom level either side of the centre, ready
+            # for zooming. The fetcher loads the most relevant first.
+            wanted = {
+                tile: self._tile_priority(view, *tile)
+                for tile in flight_path.visible_tiles(
+                    view, self._frame.canvas.width, self._frame.canvas.height
+                )
+            }
+            for z_tile in (view.zoom - 1, view.zoom + 1):
+                if 0 <= z_tile <= flight_path.MAX_ZOOM:
+                    scale = 2 ** (z_tile - view.zoom) / view.size
+                    tile = (z_tile, int(x_offset * scale), int(y_offset * scale))
+                    wanted[tile] = self._tile_priority(view, *tile)
+
+            # Tiles that were wanted for an earlier view, but aren't now, aren't worth waiting
+            # for - whether or not they have started loading. (Tiles for a flight in progress
+            # are looked after by _prefetch_flight.)
+            self._fetcher.cancel_where(
+                lambda key, priority: priority[0] == VISIBLE[0] and key not in wanted
+            )
+            for tile, priority in wanted.items():
+                self._request_tile(*tile, priority)
 
-                    if satellite:
-                        self._get_satellite_tile(x_tile, y_tile, z_tile)
-                    else:
-                        self._get_vector_tile(x_tile, y_tile, z_tile)
-                # pylint: disable=broad-except
-                except Exception:
-                    self._oops = "{} - tile loc: {} {} {}".format(
-                        traceback.format_exc(), x_tile, y_tile, z_tile
-                    )
+    def _tile_priority(self, view, z_tile, x_tile, y_tile, rank=VISIBLE[0]):
+        """
+        The fetcher priority for a tile: after `rank`, tiles at the zoom level of `view` come
+        first, then the closer to the centre of the view the better.
+        """
+        scale = 2 ** (z_tile - view.zoom) / view.size
+        x = projection.convert_longitude(view.longitude, view.zoom, view.size) * scale
+        y = projection.convert_latitude(view.latitude, view.zoom, view.size) * scale
+        distance = (x_tile + 0.5 - x) ** 2 + (y_tile + 0.5 - y) ** 2
+        return rank, abs(z_tile - view.zoom), round(distance, 2)
+
+    def _request_tile(self, z_tile, x_tile, y_tile, priority=VISIBLE):
+        """Queue a tile up on the fetcher, unless we already have it."""
+        # this is where a wanted tile is looked up, so it counts towards the cache's hit rate
+        if self._tiles.get(self._tile_key(x_tile, y_tile, z_tile, self._satellite)) is None:
+            self._fetcher.submit(
+                z_tile,
+                x_tile,
+                y_tile,
+                partial(self._load_tile, x_tile, y_tile, z_tile, self._satellite),
+                priority,
+            )
 
-                # Generally refresh screen after we've downloaded everything
-                self._frame.canvas.refresh()
+    def _load_tile(self, x_tile, y_tile, z_tile, satellite):
+        """Load a single tile - this runs on one of the fetcher's worker threads."""
+        # noinspection PyBroadException
+        try:
+            if satellite:
+                self._get_satellite_tile(x_tile, y_tile, z_tile)
+            else:
+                self._get_vector_tile(x_tile, y_tile, z_tile)
+        except (TileCancelled, TileUnavailable):
+            # it is asked for again if it is still wanted next time the map moves
+            return
+        # pylint: disable=broad-except
+        except Exception:
+            self._oops = "{} - tile loc: {} {} {}".format(
+                traceback.format_exc(), x_tile, y_tile, z_tile
+            )
+            # the next frame raises it
+            self._scheduler.request_redraw()
 
     def _get_features(self):
         """Decide which layers to render based on current zoom level and view type."""
@@ -377,206 +531,379 @@ class Map(Widget):
         """Helper to draw lines connecting a set of nodes that are scaled for the Screen."""
         for i, (x, y) in enumerate(coords):
             if i == 0:
-                self._frame.canvas.move(x, y)
+                self._canvas.move(x, y)
             else:
-                self._frame.canvas.draw(x, y, colour=colour, bg=bg, thin=True)
-
-    def _draw_polygons(self, feature, bg, colour, extent, polygons, xo, yo):
-        """Draw a set of polygons from a vector tile."""
-        coords = []
-        for polygon in polygons:
-            coords.append(
-                [self._scale_coords(x, y, extent, xo, yo) for x, y in polygon]
-            )
-        # Polygons are expensive to draw and the buildings layer is huge - so we convert to
-        # lines in order to process updates fast enough to animate.
-        if (
-            "type" in feature["properties"]
-            and "building" in feature["properties"]["type"]
-        ):
-            for line in coords:
-                self._draw_lines_internal(line, colour, bg)
-        else:
-            self._frame.canvas.fill_polygon(coords, colour=colour, bg=bg)
-
-    def _draw_lines(self, bg, colour, extent, line, xo, yo):
-        """Draw a set of lines from a vector tile."""
-        coords = [self._scale_coords(x, y, extent, xo, yo) for x, y in line]
-        self._draw_lines_internal(coords, colour, bg)
-
-    def _draw_feature(self, feature, extent, colour, bg, xo, yo):
-        """Draw a single feature from a layer in a vector tile."""
-        geometry = feature["geometry"]
-        if geometry["type"] == "Polygon":
-            self._draw_polygons(
-                feature, bg, colour, extent, geometry["coordinates"], xo, yo
-            )
-        elif feature["geometry"]["type"] == "MultiPolygon":
-            for multi_polygon in geometry["coordinates"]:
-                self._draw_polygons(feature, bg, colour, extent, multi_polygon, xo, yo)
-        elif feature["geometry"]["type"] == "LineString":
-            self._draw_lines(bg, colour, extent, geometry["coordinates"], xo, yo)
-        elif feature["geometry"]["type"] == "MultiLineString":
-            for line in geometry["coordinates"]:
-                self._draw_lines(bg, colour, extent, line, xo, yo)
-        elif feature["geometry"]["type"] == "Point":
-            x, y = self._scale_coords(
-                geometry["coordinates"][0], geometry["coordinates"][1], extent, xo, yo
-            )
-            text = " {} ".format(feature["properties"]["name_en"])
-            self._frame.canvas.print_at(
-                text, int(x - len(text) / 2), int(y), colour=colour, bg=bg
-            )
+                self._canvas.draw(x, y, colour=colour, bg=bg, thin=True)
+
+    def _draw_polygons(self, group, points, bg, colour):
+        """Draw the polygons in a feature group, given its scaled points."""
+        rings = [points[start // 2:end // 2] for start, end in group.rings()]
+        for start, end in group.polygons():
+            if group.outline:
+                for line in rings[start:end]:
+                    self._draw_lines_internal(line, colour, bg)
+            else:
+                self._canvas.fill_polygon(rings[start:end], colour=colour, bg=bg)
+
+    def _draw_lines(self, group, points, bg, colour):
+        """Draw the lines in a feature group, given its scaled points."""
+        for start, end in group.rings():
+            self._draw_lines_internal(points[start // 2:end // 2], colour, bg)
 
     def _draw_tile_layer(
-        self, tile, layer_name, c_filters, colour, t_filters, x, y, bg
+        self, tile, layer_name, c_filters, colour, t_filters, x, y, size, bg
     ):
-        """Draw the visible geometry in the specified map tile."""
+        """Draw the visible geometry in the specified map tile, `size` lines high."""
         # Don't bother rendering if the tile is not visible
-        left = (x + self._frame.canvas.width // 4) * 2
-        top = y + self._frame.canvas.height // 2
+        left = (x + self._canvas.width // 4) * 2
+        top = y + self._canvas.height // 2
         if (
-            left > self._frame.canvas.width
-            or left + self._size * 2 < 0
-            or top > self._frame.canvas.height
-            or top + self._size < 0
+            left > self._canvas.width
+            or left + size * 2 < 0
+            or top > self._canvas.height
+            or top + size < 0
         ):
             return 0
 
         # Not all layers are available in every tile.
-        try:
-            _layer = tile[layer_name]
-            _extent = float(_layer["extent"])
-        except KeyError:
+        if layer_name not in tile.layers:
             return 0
 
-        for _feature in _layer["features"]:
-            try:
-                if c_filters and _feature["properties"]["class"] not in c_filters:
-                    continue
-                if (
-                    t_filters
-                    and _feature["type"] not in t_filters
-                    and _feature["properties"]["type"] not in t_filters
-                ):
-                    continue
-                self._draw_feature(
-                    _feature,
-                    _extent,
-                    colour,
-                    bg,
-                    (x + self._frame.canvas.width // 4) * 2,
-                    y + self._frame.canvas.height // 2,
-                )
-            except KeyError:
-                pass
+        extent = tile.extent(layer_name)
+        level = lod_for_size(size)
+        for group in tile.select(layer_name, c_filters, t_filters, level):
+            if group.geometry_type == POINT:
+                # labels go in the label layer, over everything else
+                continue
+
+            points = projection.scale_coords(group.coords, extent, size, left, top)
+            if group.geometry_type == POLYGON:
+                self._draw_polygons(group, points, bg, colour)
+            elif group.geometry_type == LINESTRING:
+                self._draw_lines(group, points, bg, colour)
         return 1
 
-    def _draw_satellite_tile(self, tile, x, y):
-        """Draw a satellite image tile to screen."""
-        image, colours = tile.rendered_text
-        for (i, line) in enumerate(image):
-            self._frame.canvas.paint(line, x, y + i, colour_map=colours[i])
+    def _draw_satellite_tile(self, tile, x, y, size):
+        """
+        Draw a satellite image tile to screen - its cells are copied straight in, scaled if it
+        is standing in for a tile `size` lines high from another zoom level.
+        """
+        if size != tile.height:
+            tile = tile.scaled(size / tile.height)
+        self._canvas.block_transfer(tile, x, y)
         return 1
 
-    def _draw_tiles(self, x_offset, y_offset, bg):
-        """Render all visible tiles a layer at a time."""
-        count = 0
-        for layer_name, c_filters, t_filters in self._get_features():
-            colour = (
-                self._256_PALETTE[layer_name]
-                if self._frame.canvas.colours >= 256
-                else self._16_PALETTE[layer_name]
-            )
-            for x, y, z, tile, satellite in sorted(
-                self._tiles.values(), key=lambda k: k[0]
+    def _tile_in_clip(self, x, y, size, clip):
+        """
+        Whether a tile `size` lines high, at (x, y) relative to the view, overlaps any
+        (x, y, w, h) in clip.
+        """
+        left = (x + self._canvas.width // 4) * 2
+        top = y + self._canvas.height // 2
+        return any(
+            left < clip_x + clip_w
+            and clip_x < left + size * 2
+            and top < clip_y + clip_h
+            and clip_y < top + size
+            for clip_x, clip_y, clip_w, clip_h in clip
+        )
+
+    def _clear_tile(self, x, y, size, bg):
+        """Blank out the area of a tile `size` lines high, at (x, y) relative to the view."""
+        left = int((x + self._canvas.width // 4) * 2)
+        top = int(y + self._canvas.height // 2)
+        right = min(self._canvas.width, left + ceil(size * 2))
+        bottom = min(self._canvas.height, top + ceil(size))
+        left = max(0, left)
+        top = max(0, top)
+        if left < right and top < bottom:
+            self._canvas.clear_buffer(bg, 0, bg, left, top, right - left, bottom - top)
+
+    def _tiles_to_draw(self, x_offset, y_offset, clip):
+        """
+        The loaded tiles that cover the view, as (size, [(x, y, tile), ...]) passes to draw in
+        order, with x and y relative to the view. If `clip` is set, only the places that overlap
+        one of its (x, y, w, h) screen regions are covered.
+
+        Where a tile for this zoom level hasn't loaded yet, the nearest loaded tile from a level
+        above stands in for it, scaled up, with any loaded tiles from the level below over that.
+        """
+        cached = {
+            (z, x, y): (key, tile)
+            for key, (x, y, z, tile, satellite) in self._tiles.items()
+            if satellite == self._satellite
+        }
+        view = flight_path.View(self._latitude, self._longitude, self._zoom, self._size)
+        chosen = {}
+        for z, x, y in flight_path.visible_tiles(
+            view, self._canvas.width, self._canvas.height
+        ):
+            if clip and not self._tile_in_clip(
+                x * self._size - x_offset, y * self._size - y_offset, self._size, clip
             ):
-                # Don't draw the wrong type or zoom of tile.
-                if satellite != self._satellite or z != self._zoom:
-                    continue
-
-                # Convert tile location into pixels and draw the tile.
-                x *= self._size
-                y *= self._size
-                if satellite:
+                continue
+            if (z, x, y) in cached:
+                chosen[(z, x, y)] = cached[(z, x, y)]
+                continue
+            for level in range(1, _STAND_IN_LEVELS + 1):
+                parent = (z - level, x >> level, y >> level)
+                if parent in cached:
+                    chosen[parent] = cached[parent]
+                    break
+            for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+                child = (z + 1, x * 2 + dx, y * 2 + dy)
+                if child in cached:
+                    chosen[child] = cached[child]
+        self._tiles.touch(key for key, _ in chosen.values())
+
+        passes = {}
+        for (z, x, y), (_, tile) in sorted(chosen.items(), key=lambda k: k[0][1]):
+            size = self._size * 2 ** (self._zoom - z)
+            passes.setdefault(z, (size, []))[1].append(
+                (x * size - x_offset, y * size - y_offset, tile)
+            )
+        # The levels furthest from this one go first, so that the closest end up on top.
+        return [
+            passes[z] for z in sorted(passes, key=lambda z: (-abs(z - self._zoom), z))
+        ]
+
+    def _draw_tiles(self, x_offset, y_offset, bg, clip=None):
+        """
+        Render all visible tiles a layer at a time. If `clip` is set, only the tiles that overlap
+        one of its (x, y, w, h) screen regions are drawn.
+
+        Tiles standing in from other zoom levels (see _tiles_to_draw) are drawn first, and each
+        closer level blanks out the places that it covers before it is drawn over them.
+        """
+        count = 0
+        passes = self._tiles_to_draw(x_offset, y_offset, clip)
+        for i, (size, tiles) in enumerate(passes):
+            if self._satellite:
+                for x, y, tile in tiles:
                     count += self._draw_satellite_tile(
                         tile,
-                        int((x - x_offset + self._frame.canvas.width // 4) * 2),
-                        int(y - y_offset + self._frame.canvas.height // 2),
+                        int((x + self._canvas.width // 4) * 2),
+                        int(y + self._canvas.height // 2),
+                        size,
                     )
-                else:
+                continue
+
+            if i > 0:
+                for x, y, _ in tiles:
+                    self._clear_tile(x, y, size, bg)
+            for layer_name, c_filters, t_filters in self._get_features():
+                colour = self._layer_colour(layer_name)
+                for x, y, tile in tiles:
                     count += self._draw_tile_layer(
-                        tile,
-                        layer_name,
-                        c_filters,
-                        colour,
-                        t_filters,
-                        x - x_offset,
-                        y - y_offset,
-                        bg,
+                        tile, layer_name, c_filters, colour, t_filters, x, y, size, bg
                     )
+
+        if not self._satellite:
+            # Drawing can work out coarser levels of detail for a tile, which the cache counts.
+            drawn = {id(tile) for _, tiles in passes for _, _, tile in tiles}
+            for key, (_, _, _, tile, _) in self._tiles.items():
+                if id(tile) in drawn:
+                    self._tiles.resize(key, tile.nbytes)
         return count
 
-    def _zoom_map(self, zoom_out=True):
-        """Animate the zoom in/out as appropriate for the displayed map tile."""
-        size_step = 1 / _ZOOM_STEP if zoom_out else _ZOOM_STEP
-        self._next_update = 1
-        if self._satellite:
-            size_step **= _ZOOM_ANIMATION_STEPS
-        self._size *= size_step
-        if self._size <= _ZOOM_OUT_SIZE:
-            if self._zoom > 0:
-                self._zoom -= 1
-                self._size = _START_SIZE
-            else:
-                self._size = _ZOOM_OUT_SIZE
-        elif self._size >= _ZOOM_IN_SIZE:
-            if self._zoom < 20:
-                self._zoom += 1
-                self._size = _START_SIZE
-            else:
-                self._size = _ZOOM_IN_SIZE
+    def _layer_colour(self, layer_name):
+        """The colour to draw a map layer in."""
+        if self._canvas.colours >= 256:
+            return self._256_PALETTE[layer_name]
+        return self._16_PALETTE[layer_name]
+
+    def _label_candidates(self, x_offset, y_offset):
+        """
+        Every label in the tiles that cover the view, for the label layer to place. Labels from
+        tiles standing in for other zoom levels come after those at this level.
+        """
+        features = [
+            feature for feature in self._get_features() if feature[0] in self._LABEL_PRIORITY
+        ]
+        if not features:
+            return []
+
+        bg = self._background()
+        labels = []
+        passes = self._tiles_to_draw(x_offset, y_offset, None)
+        for i, (size, tiles) in enumerate(passes):
+            # the passes come furthest level first
+            level_rank = len(passes) - 1 - i
+            for x, y, tile in tiles:
+                left = (x + self._canvas.width // 4) * 2
+                top = y + self._canvas.height // 2
+                for layer_name, c_filters, t_filters in features:
+                    if layer_name not in tile.layers:
+                        continue
+                    extent = tile.extent(layer_name)
+                    colour = self._layer_colour(layer_name)
+                    for group in tile.select(layer_name, c_filters, t_filters):
+                        if group.geometry_type != POINT:
+                            continue
+                        # e.g. cities before towns, in the order that the filters give them
+                        type_rank = (
+                            t_filters.index(group.feature_type)
+                            if group.feature_type in t_filters
+                            else len(t_filters)
+                        )
+                        priority = (self._LABEL_PRIORITY[layer_name], type_rank, level_rank)
+                        for label_x, label_y, text in group.labels:
+                            label_x, label_y = projection.scale_point(
+                                label_x, label_y, extent, size, left, top
+                            )
+                            labels.append(Label(priority, label_x, label_y, text, colour, bg))
+        return labels
+
+    def _draw_marker(self, text, x, y, colour):
+        """Print a marker onto the frame, keeping the map colour underneath it."""
+        canvas = self._frame.canvas
+        if 0 <= x and x + len(text) <= canvas.width and 0 <= y < canvas.height:
+            _, _, _, bg = canvas.get_from(x, y)
+            canvas.print_at(text, x, y, colour, Screen.A_BOLD, bg)
+
+    def _draw_stations(self, x_offset, y_offset):
+        """Draw the station markers - one per cluster - with the current station on top."""
+        if self._stations is None:
+            return
+
+        width = self._frame.canvas.width
+        height = self._frame.canvas.height
+        left = x_offset - width // 4
+        top = y_offset - height // 2
+        # The clusters are worked out at the resting size of a tile.
+        scale = self._size / _START_SIZE
+        single = "●" if self._frame.canvas.unicode_aware else "*"
+        colour = 21 if self._frame.canvas.colours >= 256 else Screen.COLOUR_BLUE
+        for x, y, count, _ in self._stations.visible(
+            self._zoom, left / scale, top / scale, width / 2 / scale, height / scale
+        ):
+            text = single if count == 1 else str(count) if count < 100 else "99+"
+            self._draw_marker(
+                text,
+                int((x * scale - left) * 2) - len(text) // 2,
+                int(y * scale - top),
+                colour,
+            )
+
+        # The station that is playing is where the map is heading.
+        self._draw_marker(
+            single,
+            int((self._convert_longitude(self._desired_longitude) - left) * 2),
+            self._convert_latitude(self._desired_latitude) - top,
+            196 if self._frame.canvas.colours >= 256 else Screen.COLOUR_RED,
+        )
 
     def _move_to_desired_location(self):
         """Animate movement to desired location on map."""
-        self._next_update = 100000
-        x_start = self._convert_longitude(self._longitude)
-        y_start = self._convert_latitude(self._latitude)
-        x_end = self._convert_longitude(self._desired_longitude)
-        y_end = self._convert_latitude(self._desired_latitude)
-        if sqrt((x_end - x_start) ** 2 + (y_end - y_start) ** 2) > _START_SIZE // 4:
-            self._zoom_map(True)
-        elif self._zoom != self._desired_zoom:
-            self._zoom_map(self._desired_zoom < self._zoom)
-        if self._longitude != self._desired_longitude:
-            self._next_update = 1
-            if self._desired_longitude < self._longitude:
-                self._longitude = max(
-                    self._longitude - 360 / 2 ** self._zoom / self._size * 2,
-                    self._desired_longitude,
-                )
-            else:
-                self._longitude = min(
-                    self._longitude + 360 / 2 ** self._zoom / self._size * 2,
-                    self._desired_longitude,
-                )
-        if self._latitude != self._desired_latitude:
-            self._next_update = 1
-            if self._desired_latitude < self._latitude:
-                self._latitude = max(
-                    self._inc_lat(self._latitude, 2), self._desired_latitude
-                )
-            else:
-                self._latitude = min(
-                    self._inc_lat(self._latitude, -2), self._desired_latitude
-                )
-        if self._next_update == 1:
+        view, moved = flight_path.step(
+            flight_path.View(self._latitude, self._longitude, self._zoom, self._size),
+            flight_path.View(
+                self._desired_latitude, self._desired_longitude, self._desired_zoom, None
+            ),
+            self._satellite,
+        )
+        self._latitude, self._longitude, self._zoom, self._size = view
+        self._next_update = 1 if moved else 100000
+        if moved:
             self._updated.set()
 
+    def _prefetch_flight(self):
+        """
+        Plan the whole animated flight to the desired location and queue up every tile it
+        will pass over - the destination first, then the rest in the order they'll be seen.
+        Anything still loading that isn't on the new flight path is cancelled.
+        """
+        if self._frame is None:
+            return
+
+        width = self._frame.canvas.width
+        height = self._frame.canvas.height
+        path = flight_path.plan(
+            flight_path.View(self._latitude, self._longitude, self._zoom, self._size),
+            flight_path.View(
+                self._desired_latitude, self._desired_longitude, self._desired_zoom, None
+            ),
+            self._satellite,
+        )
+        wanted = {}
+        for tile in flight_path.visible_tiles(path[-1], width, height):
+            wanted[tile] = self._tile_priority(path[-1], *tile, rank=1)
+        for i, view in enumerate(path):
+            for tile in flight_path.visible_tiles(view, width, height):
+                wanted.setdefault(tile, (2, i))
+
+        self._fetcher.cancel_except(wanted)
+        for tile, priority in sorted(wanted.items(), key=lambda k: k[1]):
+            self._request_tile(*tile, priority)
+
+    def _background(self):
+        """The colour used for empty space on the map."""
+        return (
+            253
+            if self._frame.canvas.unicode_aware and self._frame.canvas.colours >= 256
+            else 0
+        )
+
+    def _render_all(self, view, x_offset, y_offset):
+        """Render every visible tile into the off-screen canvas."""
+        tiles_version = self._tiles.version
+        if (
+            self._canvas is None
+            or self._canvas.width != self._frame.canvas.width
+            or self._canvas.height != self._frame.canvas.height
+        ):
+            self._canvas = _OffscreenCanvas(
+                self._frame.canvas, self._frame.canvas.height, self._frame.canvas.width
+            )
+            self._spare_canvas = _OffscreenCanvas(
+                self._frame.canvas, self._frame.canvas.height, self._frame.canvas.width
+            )
+
+        bg = self._background()
+        self._canvas.clear_buffer(bg, 0, bg)
+        self._rendered_count = self._draw_tiles(x_offset, y_offset, bg) if self._tiles else 0
+        if self._rendered_count and self._first_frame_at is None:
+            self._first_frame_at = time.monotonic()
+        self._rendered = (view, tiles_version, (x_offset, y_offset))
+
+    def _render_pan(self, view, x_offset, y_offset):
+        """
+        Update the off-screen canvas after a pan: the previous rendering is shifted across and
+        only the strips that it doesn't cover are drawn.
+        """
+        tiles_version = self._tiles.version
+        old_x_offset, old_y_offset = self._rendered[2]
+        dx = (old_x_offset - x_offset) * 2
+        dy = old_y_offset - y_offset
+        width = self._canvas.width
+        height = self._canvas.height
+        if abs(dx) >= width or abs(dy) >= height:
+            self._render_all(view, x_offset, y_offset)
+            return
+
+        strips = []
+        if dx > 0:
+            strips.append((0, 0, dx, height))
+        elif dx < 0:
+            strips.append((width + dx, 0, -dx, height))
+        if dy > 0:
+            strips.append((0, 0, width, dy))
+        elif dy < 0:
+            strips.append((0, height + dy, width, -dy))
+
+        # Draw the strips onto the spare canvas, then lay the shifted old rendering over them.
+        bg = self._background()
+        canvas, self._canvas = self._canvas, self._spare_canvas
+        self._spare_canvas = canvas
+        self._canvas.clear_buffer(bg, 0, bg)
+        count = self._draw_tiles(x_offset, y_offset, bg, strips)
+        canvas.blit_to(self._canvas, dx, dy)
+        self._rendered_count = max(self._rendered_count, count)
+        self._rendered = (view, tiles_version, (x_offset, y_offset))
+
     def _update(self, frame_no):
         """Draw the latest set of tiles to the Screen."""
-        if not self._thread.is_alive():
-            self._thread.start()
+        self.start()
 
         # Check for any fatal errors from the background thread and quit if we hit anything.
         if self._oops:
@@ -585,25 +912,44 @@ class Map(Widget):
         # Calculate new positions for animated movement.
         self._move_to_desired_location()
 
-        # Re-draw the tiles - if we have any suitable ones downloaded.
-        count = 0
+        # Re-draw the tiles - if we have any suitable ones downloaded. Work is only done when
+        # something changed since the last frame, otherwise the last rendering is reused.
         x_offset = self._convert_longitude(self._longitude)
         y_offset = self._convert_latitude(self._latitude)
-        if self._tiles:
-            # Clear the area first.
-            bg = (
-                253
-                if self._frame.canvas.unicode_aware
-                and self._frame.canvas.colours >= 256
-                else 0
+        moved = True
+        view = (
+            self._zoom,
+            self._size,
+            self._satellite,
+            self._frame.canvas.width,
+            self._frame.canvas.height,
+            self._frame.canvas.colours,
+        )
+        if self._rendered is None or self._rendered[0] != view:
+            self._render_all(view, x_offset, y_offset)
+        elif self._rendered[1] != self._tiles.version:
+            self._render_all(view, x_offset, y_offset)
+        elif self._rendered[2] != (x_offset, y_offset):
+            self._render_pan(view, x_offset, y_offset)
+        else:
+            moved = False
+
+        # The tile thread only needs to re-think which tiles it wants when something changed -
+        # and the labels only need placing again then.
+        if moved:
+            self._updated.set()
+            self._labels.place(
+                self._label_candidates(x_offset, y_offset),
+                self._canvas.width,
+                self._canvas.height,
+                self._frame.canvas.unicode_aware,
             )
-            for y in range(self._frame.canvas.height):
-                self._frame.canvas.print_at(
-                    "." * self._frame.canvas.width, 0, y, colour=bg, bg=bg
-                )
 
-            # Now draw all the available tiles.
-            count = self._draw_tiles(x_offset, y_offset, bg)
+        count = self._rendered_count
+        if self._tiles:
+            self._canvas.refresh()
+            self._labels.draw(self._frame.canvas)
+        self._draw_stations(x_offset, y_offset)
 
         # If no tiles were drawn
         if count == 0:
@@ -0,0 +1,85 @@
+"""
+Web Mercator projection helpers for the map.
+
+The batch functions transform a whole sequence of coordinates in one pass, hoisting all of the
+per-call arithmetic out of the loop, and are the ones to use on anything per-vertex. The scalar
+functions are kept for the odd single point - e.g. the centre of the view.
+"""
+from math import pi, exp, atan, log, tan
+
+import numpy
+
+_DEGREES = 180 / pi
+_RADIANS = pi / 180
+# Below this many vertices, setting up the numpy arrays costs more than it saves.
+_NUMPY_MIN_VERTICES = 24
+
+
+def scale_point(x, y, extent, size, xo, yo):
+    """Convert from tile coordinates to "pixels" - i.e. text characters."""
+    y_scale = size / extent
+    return xo + x * (y_scale * 2), yo + extent * y_scale - y * y_scale
+
+
+def scale_coords(coords, extent, size, xo, yo) -> list:
+    """
+    Convert a packed sequence of tile coordinates (x0, y0, x1, y1...) to a list of (x, y)
+    "pixels" - as 2-item lists or tuples.
+    """
+    y_scale = size / extent
+    x_scale = y_scale * 2
+    y_origin = yo + extent * y_scale
+    if len(coords) < _NUMPY_MIN_VERTICES * 2:
+        return [
+            (xo + x * x_scale, y_origin - y * y_scale)
+            for x, y in zip(coords[0::2], coords[1::2])
+        ]
+    points = numpy.asarray(coords, dtype=float).reshape(-1, 2)
+    points *= (x_scale, -y_scale)
+    points += (xo, y_origin)
+    return points.tolist()
+
+
+def convert_longitude(longitude, zoom, size) -> int:
+    """Convert from longitude to the x position in overall map."""
+    return int((180 + longitude) * ((2 ** zoom) * size / 360))
+
+
+def convert_longitudes(longitudes, zoom, size) -> list[int]:
+    """Convert a sequence of longitudes to x positions in overall map."""
+    scale = (2 ** zoom) * size / 360
+    return [int((180 + longitude) * scale) for longitude in longitudes]
+
+
+def convert_latitude(latitude, zoom, size) -> int:
+    """Convert from latitude to the y position in overall map."""
+    return int(
+        (180 - _DEGREES * log(tan(pi / 4 + latitude * (pi / 360))))
+        * ((2 ** zoom) * size / 360)
+    )
+
+
+def convert_latitudes(latitudes, zoom, size) -> list[int]:
+    """Convert a sequence of latitudes to y positions in overall map."""
+    scale = (2 ** zoom) * size / 360
+    quarter = pi / 4
+    half_radians = pi / 360
+    return [
+        int((180 - _DEGREES * log(tan(quarter + latitude * half_radians))) * scale)
+        for latitude in latitudes
+    ]
+
+
+def y_to_latitude(y, zoom, size) -> float:
+    """Convert from the y position in overall map back to a latitude."""
+    return 360 / pi * atan(exp((180 - y * (360 / (2 ** zoom) / size)) * _RADIANS)) - 90
+
+
+def x_to_longitude(x, zoom, size) -> float:
+    """Convert from the x position in overall map back to a longitude."""
+    return x * (360 / (2 ** zoom) / size) - 180
+
+
+def inc_lat(latitude, delta, zoom, size) -> float:
+    """Shift the latitude by the required number of pixels (i.e. text lines)."""
+    return y_to_latitude(convert_latitude(latitude, zoom, size) + delta, zoom, size)
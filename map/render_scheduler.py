@@ -0,0 +1,96 @@
+from contextlib import contextmanager
+import threading
+import time
+
+# Screen.play draws at most one frame every 0.05s.
+_TICKS_PER_SECOND = 20
+# The frame rate while the map is flying somewhere.
+_ANIMATION_FPS = 20
+
+
+class RenderScheduler:
+    """
+    Decides when the screen is redrawn, for everything on it.
+
+    Anything can ask for a redraw from any thread (a tile arriving, a new song title) - however
+    many ask, the screen is woken for one redraw at the next frame. While the map is animating,
+    its frames come at most `fps` times a second, and when nothing is happening the screen only
+    redraws when it is asked to (or a key is pressed).
+    """
+
+    def __init__(self, fps: int = _ANIMATION_FPS):
+        self._interval = max(1, round(_TICKS_PER_SECOND / fps))
+        self._lock = threading.Lock()
+        self._wake = lambda: None
+        self._pending = False
+
+        # the frame being drawn, and how long its parts have taken so far
+        self._frame_no = None
+        self._frame_seconds = 0.0
+
+        self._requests = 0
+        self._redraws = 0
+        self._frames = 0
+        self._seconds = 0.0
+        self._slowest = 0.0
+
+    def attach(self, screen) -> None:
+        """Redraw this screen from now on - e.g. after a resize has replaced the old one."""
+        with self._lock:
+            self._wake = screen.force_update
+            self._pending = False
+
+    @property
+    def animation_interval(self) -> int:
+        """How many of the screen's frames to wait between frames of an animation."""
+        return self._interval
+
+    def request_redraw(self) -> None:
+        """Ask for the screen to be redrawn at the next frame. Safe to call from any thread."""
+        with self._lock:
+            self._requests += 1
+            if self._pending:
+                return
+            self._pending = True
+            self._redraws += 1
+            wake = self._wake
+        wake()
+
+    @contextmanager
+    def drawing(self, frame_no: int):
+        """Time a part of the screen (i.e. a Frame) being drawn for frame `frame_no`."""
+        with self._lock:
+            if frame_no != self._frame_no:
+                # the first part of a new frame - so the redraw that was asked for is under way
+                self._finish_frame()
+                self._frame_no = frame_no
+                self._pending = False
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._frame_seconds += elapsed
+
+    def _finish_frame(self) -> None:
+        if self._frame_no is not None:
+            self._frames += 1
+            self._seconds += self._frame_seconds
+            self._slowest = max(self._slowest, self._frame_seconds)
+        self._frame_seconds = 0.0
+
+    @property
+    def stats(self) -> dict[str, float]:
+        """
+        Frames drawn with their mean and slowest times, and how many redraws were asked for
+        against how many times the screen was actually woken for one.
+        """
+        with self._lock:
+            return {
+                "frames": self._frames,
+                "mean": self._seconds / self._frames if self._frames else 0.0,
+                "slowest": self._slowest,
+                "requests": self._requests,
+                "redraws": self._redraws,
+            }
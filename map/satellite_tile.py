@@ -0,0 +1,140 @@
+"""
+Satellite tiles, turned once from a JPEG into the character cells that the map draws - so that
+drawing one is a copy of its rows into the canvas, with no decoding, resizing or dithering.
+
+Rendering is slow (Pillow plus a lot of per-pixel Python), so it is done by `render` in the
+worker processes, which hand back the packed form below. The same form is kept on disk.
+
+Packed layout (zlib compressed, little-endian):
+
+    header   height and width in cells (u16), number of distinct cells (u32)
+    cells    per distinct cell: code point (u32), foreground, attributes, background (u8)
+    grid     per character, row by row: the number of its cell (u16)
+"""
+from array import array
+import io
+import struct
+import sys
+import zlib
+
+from asciimatics.renderers import ColourImageFile
+
+_HEADER = struct.Struct("<HHI")
+_CELL = struct.Struct("<IBBB")
+# Rough CPython overheads, for estimating how much memory a tile holds.
+_CELL_BYTES = 100
+_POINTER_BYTES = 8
+
+# What Canvas.paint uses for any colour that a colour map leaves unset.
+_DEFAULT_COLOURS = (7, 0, 0)
+
+
+class _Palette:
+    # all that ColourImageFile needs from a screen
+    def __init__(self, palette):
+        self.palette = palette
+
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def render(image: bytes, palette: list[int], unicode: bool, height: int) -> bytes:
+    """
+    Render a satellite image `height` lines high, dithered to `palette` (a Canvas's palette),
+    using half-block characters if `unicode`. Returns the packed tile.
+    """
+    text, colour_maps = ColourImageFile(
+        _Palette(palette), io.BytesIO(image), height=height, dither=True, uni=unicode
+    ).rendered_text
+
+    # The renderer starts with an empty line, and in unicode mode ends every line with an
+    # extra character to reset the colours - neither is needed on a canvas.
+    cells: dict[tuple, int] = {}
+    grid = array("H")
+    rows = list(zip(text, colour_maps))[1:]
+    width = max((len(line) for line, _ in rows), default=0) - (1 if unicode else 0)
+    for line, colour_map in rows:
+        # exactly as Canvas.paint would print the line, colours carrying on until changed
+        colours = list(_DEFAULT_COLOURS)
+        row = []
+        for char, mapped in zip(line, colour_map):
+            if mapped:
+                for i, value in enumerate(mapped[:3]):
+                    if value is not None:
+                        colours[i] = value
+            cell = (char, *colours)
+            row.append(cells.setdefault(cell, len(cells)))
+        blank = cells.setdefault((" ", *_DEFAULT_COLOURS), len(cells))
+        row = (row + [blank] * width)[:width]
+        grid.extend(row)
+
+    out = bytearray(_HEADER.pack(len(rows), width, len(cells)))
+    for char, foreground, attributes, background in cells:
+        out += _CELL.pack(ord(char), foreground, attributes, background)
+    out += _little_endian(grid).tobytes()
+    return zlib.compress(bytes(out))
+
+
+class SatelliteTile:
+    """
+    A rendered satellite tile: rows of ready-made canvas cells. It has the `width`, `height`
+    and `slice` of an asciimatics double buffer, so it can be handed to Canvas.block_transfer.
+    """
+
+    __slots__ = ["width", "height", "_rows", "nbytes"]
+
+    def __init__(self, rows: list[list[tuple]], distinct_cells: int):
+        self._rows = rows
+        self.height = len(rows)
+        self.width = len(rows[0]) if rows else 0
+        self.nbytes = distinct_cells * _CELL_BYTES + self.width * self.height * _POINTER_BYTES
+
+    def slice(self, x: int, y: int, width: int) -> list[tuple]:
+        return self._rows[y][x:x + width]
+
+    def scaled(self, scale: float) -> "_ScaledTile":
+        """This tile drawn `scale` times the size, e.g. to stand in for another zoom level."""
+        return _ScaledTile(self._rows, self.width, self.height, scale)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SatelliteTile":
+        """Read back a tile packed by `render`. Raises ValueError if it is corrupt."""
+        try:
+            view = memoryview(zlib.decompress(data))
+            height, width, count = _HEADER.unpack_from(view)
+            offset = _HEADER.size
+            # every cell the same is the same tuple, which is what a canvas is made of
+            cells = []
+            for _ in range(count):
+                code, foreground, attributes, background = _CELL.unpack_from(view, offset)
+                cells.append((chr(code), foreground, attributes, background, 1))
+                offset += _CELL.size
+            grid = _little_endian(array("H", bytes(view[offset:offset + width * height * 2])))
+            if len(grid) != width * height:
+                raise ValueError("truncated")
+            rows = [
+                [cells[i] for i in grid[start:start + width]]
+                for start in range(0, width * height, width)
+            ]
+        except (zlib.error, struct.error, IndexError, ValueError) as e:
+            raise ValueError("corrupt satellite tile") from e
+        return cls(rows, count)
+
+
+class _ScaledTile:
+    """A satellite tile scaled up or down by repeating or skipping its cells."""
+
+    __slots__ = ["width", "height", "_rows", "_scale"]
+
+    def __init__(self, rows: list[list[tuple]], width: int, height: int, scale: float):
+        self._rows = rows
+        self._scale = scale
+        self.width = int(width * scale)
+        self.height = int(height * scale)
+
+    def slice(self, x: int, y: int, width: int) -> list[tuple]:
+        row = self._rows[int(y / self._scale)]
+        return [row[int(i / self._scale)] for i in range(x, x + width)]
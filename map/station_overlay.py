@@ -0,0 +1,113 @@
+"""
+Station markers for the map. Stations are clustered into cells a few characters across, for
+every zoom level up front, so that drawing them only costs as much as the cells on screen -
+however many stations there are.
+"""
+from collections.abc import Iterable
+import threading
+
+from map import flight_path, projection
+
+# Cluster cells, in map units at START_SIZE: 6 characters wide and 3 lines high.
+_CELL = 3
+_MAX_LATITUDE = 85.05
+
+
+class StationOverlay:
+    """Clusters of station locations, per zoom level."""
+
+    def __init__(self, locations: Iterable[tuple[int, float, float]] = ()):
+        """
+        :param locations: (station id, latitude, longitude) for every station to show.
+        """
+        self._lock = threading.Lock()
+        self._stations: list[tuple[int, float, float]] = []
+        # zoom -> {(cell x, cell y): (count, sum of x, sum of y, a station id)}, with x and y
+        # in map units for that zoom at START_SIZE
+        self._levels: list[dict[tuple[int, int], tuple[int, float, float, int]]] = []
+        self.add(locations)
+
+    def __len__(self) -> int:
+        return len(self._stations)
+
+    def add(self, locations: Iterable[tuple[int, float, float]]) -> None:
+        """Add stations, and re-cluster every zoom level."""
+        stations = self._stations + list(locations)
+        levels = self._cluster(stations)
+        with self._lock:
+            self._stations, self._levels = stations, levels
+
+    @staticmethod
+    def _cluster(stations):
+        # Cluster at the top zoom level, then merge cells pairwise on the way down - a cell
+        # at one zoom level is exactly 2 x 2 cells at the next one up.
+        size = flight_path.START_SIZE
+        xs = projection.convert_longitudes(
+            [longitude for _, _, longitude in stations], flight_path.MAX_ZOOM, size
+        )
+        # the map itself stops short of the poles
+        ys = projection.convert_latitudes(
+            [min(max(latitude, -_MAX_LATITUDE), _MAX_LATITUDE) for _, latitude, _ in stations],
+            flight_path.MAX_ZOOM,
+            size,
+        )
+        level = {}
+        for (station_id, _, _), x, y in zip(stations, xs, ys):
+            key = (x // _CELL, y // _CELL)
+            count, sum_x, sum_y, first = level.get(key, (0, 0, 0, station_id))
+            level[key] = (count + 1, sum_x + x, sum_y + y, first)
+
+        levels = [level]
+        for _ in range(flight_path.MAX_ZOOM):
+            merged = {}
+            for (cell_x, cell_y), (count, sum_x, sum_y, first) in level.items():
+                key = (cell_x // 2, cell_y // 2)
+                other = merged.get(key)
+                if other is None:
+                    merged[key] = (count, sum_x / 2, sum_y / 2, first)
+                else:
+                    merged[key] = (
+                        other[0] + count,
+                        other[1] + sum_x / 2,
+                        other[2] + sum_y / 2,
+                        min(other[3], first),
+                    )
+            level = merged
+            levels.append(level)
+        levels.reverse()
+        return levels
+
+    def visible(
+        self, zoom: int, left: float, top: float, width: float, height: float
+    ) -> list[tuple[float, float, int, int]]:
+        """
+        The clusters inside a box of map units at START_SIZE for the zoom level, as
+        (x, y, number of stations, a station id) - where x, y is the middle of the cluster.
+        """
+        with self._lock:
+            if not self._levels:
+                return []
+            level = self._levels[min(max(zoom, 0), flight_path.MAX_ZOOM)]
+        first_x, last_x = int(left // _CELL), int((left + width) // _CELL)
+        first_y, last_y = int(top // _CELL), int((top + height) // _CELL)
+
+        # Look up the cells on screen, unless there are fewer clusters than that in total.
+        if (last_x - first_x + 1) * (last_y - first_y + 1) < len(level):
+            cells = [
+                (x, y)
+                for x in range(first_x, last_x + 1)
+                for y in range(first_y, last_y + 1)
+                if (x, y) in level
+            ]
+        else:
+            cells = [
+                (x, y)
+                for x, y in level
+                if first_x <= x <= last_x and first_y <= y <= last_y
+            ]
+
+        clusters = []
+        for cell in cells:
+            count, sum_x, sum_y, first = level[cell]
+            clusters.append((sum_x / count, sum_y / count, count, first))
+        return clusters
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+import threading
+
+
+class TileCache:
+    """
+    The in-memory tile cache - a least-recently-used cache bounded by an estimate of the memory
+    held by its tiles, rather than by a count, as a satellite tile can be many times the size
+    of a vector tile.
+
+    Tiles are added by the fetcher threads and read by the UI thread, so everything is done
+    under a lock. Every change to the set of tiles bumps `version`, so that the map can tell
+    when it needs to redraw.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (entry, estimated size in bytes), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._version = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        """Look up a tile, marking it as recently used. Counts towards the hit/miss stats."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def touch(self, keys) -> None:
+        """Mark tiles as recently used - e.g. because they have just been drawn."""
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+
+    def put(self, key, entry, size: int) -> None:
+        """Add a tile, evicting the least recently used tiles to stay inside the budget."""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (entry, size)
+            self._bytes += size
+
+            # Always keep the tile that we just added, even if it blows the budget by itself.
+            while self._bytes > self._max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._evictions += 1
+            self._version += 1
+
+    def resize(self, key, size: int) -> None:
+        """
+        Update the estimated size of a tile that has grown (or shrunk) since it was added,
+        evicting the least recently used others if that takes it over the budget.
+        """
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[1] == size:
+                return
+            self._entries[key] = (item[0], size)
+            self._bytes += size - item[1]
+            evicted = False
+            while self._bytes > self._max_bytes and len(self._entries) > 1:
+                evicted_key = next(iter(self._entries))
+                if evicted_key == key:
+                    # keep the tile itself - it is in use
+                    self._entries.move_to_end(key)
+                    continue
+                _, evicted_size = self._entries.pop(evicted_key)
+                self._bytes -= evicted_size
+                self._evictions += 1
+                evicted = True
+            # only a change to the set of tiles needs a redraw
+            if evicted:
+                self._version += 1
+
+    def items(self) -> list:
+        """A snapshot of the (key, tile) pairs, least recently used first."""
+        with self._lock:
+            return [(key, entry) for key, (entry, _) in self._entries.items()]
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "tiles": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+            }
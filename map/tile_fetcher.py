@@ -0,0 +1,247 @@
+from collections.abc import Callable, Container
+import heapq
+import itertools
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+
+# Browsers open about this many connections per host, which tile servers are happy with.
+_WORKERS = 6
+# Downloads are read in chunks of this size, checking for cancellation in between.
+_CHUNK_SIZE = 16 * 1024
+# Seconds to wait for a connection, and for each read. A server that trickles data slowly
+# enough to dodge the read timeout is still given up on after the deadline.
+_TIMEOUT = (5, 10)
+_DEADLINE = 30
+
+# Priority for tiles that are on screen right now - lower priorities are loaded first.
+VISIBLE = (0,)
+
+
+class TileCancelled(Exception):
+    """Raised inside a tile load when the tile is no longer wanted."""
+
+
+class TileUnavailable(Exception):
+    """
+    Raised inside a tile load when the tile server can't be reached, is too slow, or answers
+    with an error.
+    """
+
+
+class _Job:
+    __slots__ = ["key", "load", "priority", "started", "cancelled"]
+
+    def __init__(self, key, load, priority):
+        self.key = key
+        self.load = load
+        self.priority = priority
+        self.started = False
+        self.cancelled = False
+
+
+class TileFetcher:
+    """
+    Loads map tiles on a bounded pool of worker threads.
+
+    All downloads share a single keep-alive `requests.Session`, so only the first tile from
+    a host pays for the TCP/TLS handshake. Loads are de-duplicated by (z, x, y): asking for a
+    tile that is already queued or downloading re-uses the existing job rather than starting a
+    second one.
+
+    Queued loads are run in priority order (any comparable value, lowest first) and loads that
+    are no longer wanted can be cancelled - including ones that are part way through a download.
+    Every download has a timeout, so a flaky server holds up a worker for a bounded time.
+    """
+
+    def __init__(
+        self,
+        url_template: str,
+        access_token: str = "",
+        workers: int = _WORKERS,
+        timeout: tuple[float, float] = _TIMEOUT,
+        deadline: float = _DEADLINE,
+    ):
+        """
+        :param url_template: format string taking (z, x, y, access_token) - point this at a
+            local HTTP server to run against a stand-in for the tile server.
+        :param access_token: the access token to substitute into the url.
+        :param workers: the maximum number of concurrent loads (and pooled connections).
+        :param timeout: seconds to wait for a connection, and for each read.
+        :param deadline: the most seconds that a whole download may take.
+        """
+        self._url_template = url_template
+        self._access_token = access_token
+        self._timeout = timeout
+        self._deadline = deadline
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        # Jobs by key, and a heap of (priority, sequence, job) to run. When a job's priority
+        # changes it is pushed again, and the out of date heap entry is skipped when popped.
+        self._condition = threading.Condition()
+        self._jobs: dict[tuple[int, int, int], _Job] = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._running = True
+
+        # what happened to the loads: see `stats`
+        self._stats = {
+            "downloads": 0,
+            "bytes": 0,
+            "cancelled": 0,
+            "wasted_bytes": 0,
+            "timeouts": 0,
+            "failures": 0,
+        }
+
+        # Lets `download` find the job of the worker thread that it is running on.
+        self._local = threading.local()
+        for i in range(workers):
+            threading.Thread(
+                target=self._work, name="tile-fetcher-{}".format(i), daemon=True
+            ).start()
+
+    def submit(
+        self, z: int, x: int, y: int, load: Callable[[], None], priority=VISIBLE
+    ) -> None:
+        """
+        Run `load` for the tile (z, x, y) on the worker pool, unless that tile is already
+        being loaded - in which case the existing job is moved up to `priority` if that is
+        more urgent than it had before.
+        """
+        key = (z, x, y)
+        with self._condition:
+            job = self._jobs.get(key)
+            if job is None or job.cancelled:
+                job = self._jobs[key] = _Job(key, load, priority)
+            elif job.started or priority >= job.priority:
+                return
+            else:
+                job.priority = priority
+            heapq.heappush(self._queue, (priority, next(self._sequence), job))
+            self._condition.notify()
+
+    def cancel_except(self, keys: Container[tuple[int, int, int]]) -> None:
+        """Cancel every queued or running load for a tile that isn't in `keys`."""
+        self.cancel_where(lambda key, _priority: key not in keys)
+
+    def cancel_where(self, unwanted: Callable[[tuple[int, int, int], object], bool]) -> None:
+        """Cancel every queued or running load for which `unwanted(key, priority)` is true."""
+        with self._condition:
+            for key, job in list(self._jobs.items()):
+                if not job.cancelled and unwanted(key, job.priority):
+                    job.cancelled = True
+                    self._stats["cancelled"] += 1
+                    if not job.started:
+                        del self._jobs[key]
+
+    def download(self, z: int, x: int, y: int) -> bytes:
+        """
+        Download the raw tile data for (z, x, y) over the shared session.
+        Raises TileCancelled if the load that called this is cancelled part way through, and
+        TileUnavailable if the server can't be reached, doesn't answer in time or answers with
+        an error status - so that an error page is never taken for a tile.
+        """
+        job = getattr(self._local, "job", None)
+        url = self._url_template.format(z, x, y, self._access_token)
+        deadline = time.monotonic() + self._deadline
+        chunks = []
+        received = 0
+        try:
+            with self._session.get(url, stream=True, timeout=self._timeout) as response:
+                if not 200 <= response.status_code < 300:
+                    # don't bother reading the error page
+                    self._count(failures=1)
+                    raise TileUnavailable("{} gave HTTP {}".format(url, response.status_code))
+                for chunk in response.iter_content(_CHUNK_SIZE):
+                    received += len(chunk)
+                    if job is not None and job.cancelled:
+                        raise TileCancelled(job.key)
+                    if time.monotonic() > deadline:
+                        raise requests.Timeout("{} took over {}s".format(url, self._deadline))
+                    chunks.append(chunk)
+        except TileCancelled:
+            self._count(wasted_bytes=received)
+            raise
+        except requests.Timeout as e:
+            self._count(timeouts=1, wasted_bytes=received)
+            raise TileUnavailable(url) from e
+        except requests.RequestException as e:
+            # a read timing out part way through the body comes back as a connection error
+            if e.args and isinstance(e.args[0], ReadTimeoutError):
+                self._count(timeouts=1, wasted_bytes=received)
+            else:
+                self._count(failures=1, wasted_bytes=received)
+            raise TileUnavailable(url) from e
+        self._count(downloads=1, bytes=received)
+        return b"".join(chunks)
+
+    def _count(self, **counts: int) -> None:
+        with self._condition:
+            for name, count in counts.items():
+                self._stats[name] += count
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """
+        Downloads and the bytes they brought in, loads cancelled, bytes downloaded for nothing
+        (by loads cancelled part way, or that timed out or failed), timeouts and other failures.
+        """
+        with self._condition:
+            return dict(self._stats)
+
+    @property
+    def in_flight(self) -> int:
+        """The number of tile loads currently queued or running."""
+        with self._condition:
+            return len(self._jobs)
+
+    def shutdown(self) -> None:
+        """Stop the workers and close the pooled connections."""
+        with self._condition:
+            self._running = False
+            for job in self._jobs.values():
+                job.cancelled = True
+            self._condition.notify_all()
+        self._session.close()
+
+    def _next_job(self) -> _Job | None:
+        with self._condition:
+            while self._running:
+                if not self._queue:
+                    self._condition.wait()
+                    continue
+                priority, _, job = heapq.heappop(self._queue)
+                if job.cancelled or job.started or priority != job.priority:
+                    continue
+                job.started = True
+                return job
+        return None
+
+    def _work(self) -> None:
+        while (job := self._next_job()) is not None:
+            self._local.job = job
+            # the job only leaves the jobs table once `load` has stored its result, so a
+            # request racing with the end of a load will either join it or find it cached.
+            try:
+                if not job.cancelled:
+                    job.load()
+            except (TileCancelled, TileUnavailable):
+                # already counted by `download`
+                pass
+            # pylint: disable=broad-except
+            except Exception:
+                # a broken load mustn't take its worker with it
+                self._count(failures=1)
+            finally:
+                self._local.job = None
+                with self._condition:
+                    if self._jobs.get(job.key) is job:
+                        del self._jobs[job.key]
@@ -0,0 +1,123 @@
+"""
+Tile packs - a whole region's worth of tiles in a single indexed file, which is memory-mapped
+so that reading a tile is a binary search and a slice rather than a file open.
+
+Layout (all little-endian):
+
+    header   magic "SEPK", version (u16), satellite flag (u8), tile count (u32),
+             index offset (u64)
+    data     the tile payloads, back to back - packed VectorTiles or satellite JPEGs
+    index    tile keys (u64, sorted), payload offsets (u64), payload lengths (u32)
+"""
+from array import array
+from bisect import bisect_left
+import mmap
+import os
+import struct
+import sys
+
+from map.vector_tile import VectorTile
+
+_MAGIC = b"SEPK"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHBIQ")
+
+
+def _tile_id(z: int, x: int, y: int) -> int:
+    # x and y are below 2 ** 20 for every zoom level that the map uses.
+    return (z << 48) | (x << 24) | y
+
+
+def _native(values: array) -> array:
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class TilePack:
+    """Read-only access to a tile pack."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, satellite, count, index_offset = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC or version != _VERSION:
+            self._mmap.close()
+            raise ValueError("{} is not a version {} tile pack".format(path, _VERSION))
+        self.satellite = bool(satellite)
+
+        # Only the index is read up front - the tiles stay in the page cache until needed.
+        self._ids = array("Q")
+        self._offsets = array("Q")
+        self._lengths = array("I")
+        offset = index_offset
+        for values in (self._ids, self._offsets, self._lengths):
+            end = offset + count * values.itemsize
+            values.frombytes(self._mmap[offset:end])
+            _native(values)
+            offset = end
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, z: int, x: int, y: int) -> memoryview | None:
+        """The raw payload for a tile, or None if it isn't in the pack."""
+        tile_id = _tile_id(z, x, y)
+        i = bisect_left(self._ids, tile_id)
+        if i == len(self._ids) or self._ids[i] != tile_id:
+            return None
+        offset = self._offsets[i]
+        return memoryview(self._mmap)[offset:offset + self._lengths[i]]
+
+    def vector(self, z: int, x: int, y: int) -> VectorTile | None:
+        """A vector tile from the pack, or None if it isn't in the pack."""
+        data = self.get(z, x, y)
+        return None if data is None else VectorTile.from_bytes(data)
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+class TilePackWriter:
+    """Builds a tile pack. Tiles can be added in any order; the index is sorted on close."""
+
+    def __init__(self, path: str, satellite: bool = False):
+        self._path = path
+        self._temp_path = path + ".tmp"
+        self._satellite = satellite
+        self._file = open(self._temp_path, "wb")
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION, satellite, 0, 0))
+        self._index: dict[int, tuple[int, int]] = {}
+
+    def __contains__(self, tile: tuple[int, int, int]) -> bool:
+        return _tile_id(*tile) in self._index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self._temp_path)
+
+    def add(self, z: int, x: int, y: int, data: bytes) -> None:
+        offset = self._file.tell()
+        self._file.write(data)
+        self._index[_tile_id(z, x, y)] = (offset, len(data))
+
+    def close(self) -> None:
+        """Write out the index and header, and move the finished pack into place."""
+        ids = sorted(self._index)
+        index_offset = self._file.tell()
+        self._file.write(_native(array("Q", ids)).tobytes())
+        self._file.write(_native(array("Q", [self._index[i][0] for i in ids])).tobytes())
+        self._file.write(_native(array("I", [self._index[i][1] for i in ids])).tobytes())
+        self._file.seek(0)
+        self._file.write(
+            _HEADER.pack(_MAGIC, _VERSION, self._satellite, len(ids), index_offset)
+        )
+        self._file.close()
+        os.replace(self._temp_path, self._path)
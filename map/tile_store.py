@@ -0,0 +1,145 @@
+import os
+import struct
+import threading
+
+from google.protobuf.message import DecodeError
+
+from map.satellite_tile import SatelliteTile
+from map.vector_tile import VectorTile
+
+# Every vector tile file starts with this header so that we can tell our own files apart from
+# stale ones written by older versions of the explorer.
+_MAGIC = b"SEVT"
+_VERSION = 3
+# Version 1 files hold the raw MVT data, and version 2 files packed tiles that aren't simplified
+# (see VectorTile.simplified) - both are converted when first read.
+_MVT_VERSION = 1
+_UNSIMPLIFIED_VERSION = 2
+_HEADER = struct.Struct("<4sH")
+# Rendered satellite tiles have their own header and version.
+_SATELLITE_MAGIC = b"SEST"
+_SATELLITE_VERSION = 1
+
+
+class TileStore:
+    """
+    The on-disk tile cache.
+
+    Vector tiles are kept in the packed form written by `VectorTile.to_bytes`, behind a small
+    versioned header. Satellite tiles are kept as the JPEGs that the tile server sent us, and
+    as rendered for each kind of screen (colours, unicode) that has shown them.
+    """
+
+    def __init__(self, directory: str = "mapscache"):
+        self._directory = directory
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+        self._purge_legacy()
+
+    def vector_path(self, z: int, x: int, y: int) -> str:
+        return os.path.join(self._directory, "{}.{}.{}.mvt".format(z, x, y))
+
+    def image_path(self, z: int, x: int, y: int) -> str:
+        return os.path.join(self._directory, "{}.{}.{}.jpg".format(z, x, y))
+
+    def satellite_path(self, z: int, x: int, y: int, colours: int, unicode: bool) -> str:
+        return os.path.join(
+            self._directory, "{}.{}.{}.{}{}.sat".format(z, x, y, colours, "u" if unicode else "a")
+        )
+
+    def load_vector(self, z: int, x: int, y: int) -> VectorTile | None:
+        """
+        Read a vector tile, or None if we don't have a usable copy.
+        Files written by an unknown version of the store are removed so they get rebuilt.
+        """
+        path = self.vector_path(z, x, y)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            magic, version = _HEADER.unpack_from(data)
+        except struct.error:
+            magic, version = None, None
+        payload = memoryview(data)[_HEADER.size:]
+        try:
+            if magic == _MAGIC and version == _VERSION:
+                return VectorTile.from_bytes(payload)
+            if magic == _MAGIC and version in (_MVT_VERSION, _UNSIMPLIFIED_VERSION):
+                if version == _MVT_VERSION:
+                    tile = VectorTile.from_mvt(bytes(payload))
+                else:
+                    tile = VectorTile.from_bytes(payload).simplified()
+                self.save_vector(z, x, y, tile)
+                return tile
+        except (DecodeError, struct.error, ValueError):
+            pass
+        os.remove(path)
+        return None
+
+    def save_vector(self, z: int, x: int, y: int, tile: VectorTile) -> None:
+        """Write a vector tile."""
+        self.save_packed_vector(z, x, y, tile.to_bytes())
+
+    def save_packed_vector(self, z: int, x: int, y: int, packed: bytes) -> None:
+        """Write a vector tile that is already packed by `VectorTile.to_bytes`."""
+        self._write(self.vector_path(z, x, y), _HEADER.pack(_MAGIC, _VERSION) + packed)
+
+    def save_image(self, z: int, x: int, y: int, data: bytes) -> None:
+        """Write the image data for a satellite tile."""
+        self._write(self.image_path(z, x, y), data)
+
+    def load_satellite(
+        self, z: int, x: int, y: int, colours: int, unicode: bool
+    ) -> SatelliteTile | None:
+        """Read a rendered satellite tile, or None if we don't have a usable copy."""
+        path = self.satellite_path(z, x, y, colours, unicode)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            magic, version = _HEADER.unpack_from(data)
+            if magic == _SATELLITE_MAGIC and version == _SATELLITE_VERSION:
+                return SatelliteTile.from_bytes(data[_HEADER.size:])
+        except (struct.error, ValueError):
+            pass
+        os.remove(path)
+        return None
+
+    def save_satellite(
+        self, z: int, x: int, y: int, colours: int, unicode: bool, packed: bytes
+    ) -> None:
+        """Write a rendered satellite tile, as packed by `satellite_tile.render`."""
+        self._write(
+            self.satellite_path(z, x, y, colours, unicode),
+            _HEADER.pack(_SATELLITE_MAGIC, _SATELLITE_VERSION) + packed,
+        )
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        # several fetcher threads may write at once, so never leave a half-written tile behind.
+        temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _purge_legacy(self) -> None:
+        """Remove the JSON tiles written by older versions - they are rebuilt from the server."""
+        marker = os.path.join(self._directory, ".version")
+        try:
+            with open(marker) as f:
+                if int(f.read()) == _VERSION:
+                    return
+        except (FileNotFoundError, ValueError):
+            pass
+
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith(".json"):
+                os.remove(entry.path)
+        with open(marker, "w") as f:
+            f.write(str(_VERSION))
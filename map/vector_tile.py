@@ -0,0 +1,396 @@
+from array import array
+from collections.abc import Container
+import struct
+
+import mapbox_vector_tile
+
+from map.flight_path import ZOOM_IN_SIZE
+
+# MVT geometry types, as found in the "type" of a decoded feature.
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+
+# Binary layout of a packed tile - see VectorTile.to_bytes.
+_COUNT = struct.Struct("<I")
+_STRING = struct.Struct("<H")
+_LAYER = struct.Struct("<II")
+_GROUP = struct.Struct("<BIIII")
+_LABEL = struct.Struct("<ii")
+_NO_STRING = 0xFFFF
+
+# Rough CPython overheads, for estimating how much memory a tile holds.
+_OBJECT_BYTES = 64
+_LABEL_BYTES = 160
+
+# Levels of detail. Level 0 keeps all that can be seen of a tile at its largest - ZOOM_IN_SIZE
+# lines high, mid-animation, on a canvas that draws lines at twice the character resolution -
+# and each level after that half as much.
+MAX_LOD = 2
+
+
+def lod_for_size(size: float) -> int:
+    """The level of detail for drawing tiles that are `size` lines high."""
+    level = 0
+    while level < MAX_LOD and size * 2 ** (level + 1) <= ZOOM_IN_SIZE:
+        level += 1
+    return level
+
+
+class FeatureGroup:
+    """
+    All the features in one layer of a tile that look the same to the map filters - i.e. that
+    share a class, a type property and a geometry type.
+
+    The geometry of the whole group is packed into flat arrays: `coords` holds x0, y0, x1, y1...
+    for every vertex, `ring_ends` holds the index in `coords` where each ring (or line) stops
+    and, for polygons, `polygon_ends` holds the index in `ring_ends` where each polygon stops.
+    Point features are kept as ready-to-print labels instead.
+    """
+
+    __slots__ = [
+        "feature_class",
+        "feature_type",
+        "geometry_type",
+        "coords",
+        "ring_ends",
+        "polygon_ends",
+        "labels",
+    ]
+
+    def __init__(self, feature_class: str | None, feature_type: str | None, geometry_type: int):
+        self.feature_class = feature_class
+        self.feature_type = feature_type
+        self.geometry_type = geometry_type
+        self.coords = array("i")
+        self.ring_ends = array("I")
+        self.polygon_ends = array("I")
+        self.labels: list[tuple[int, int, str]] = []
+
+    @property
+    def outline(self) -> bool:
+        """
+        Polygons are expensive to draw and the buildings layer is huge - so buildings are drawn
+        as outlines in order to process updates fast enough to animate.
+        """
+        return self.feature_type is not None and "building" in self.feature_type
+
+    def matches(self, c_filters, t_filters) -> bool:
+        """Whether this group passes the class and type filters for a map layer."""
+        if c_filters and self.feature_class not in c_filters:
+            return False
+        if (
+            t_filters
+            and self.geometry_type not in t_filters
+            and self.feature_type not in t_filters
+        ):
+            return False
+        return True
+
+    def add_ring(self, ring) -> None:
+        for x, y in ring:
+            self.coords.append(int(x))
+            self.coords.append(int(y))
+        self.ring_ends.append(len(self.coords))
+
+    def add_polygon(self, polygon) -> None:
+        for ring in polygon:
+            self.add_ring(ring)
+        self.polygon_ends.append(len(self.ring_ends))
+
+    def add_geometry(self, geometry: dict, properties: dict) -> None:
+        """Pack a GeoJSON-like geometry, as returned by `mapbox_vector_tile.decode`."""
+        match geometry["type"]:
+            case "Polygon":
+                self.add_polygon(geometry["coordinates"])
+            case "MultiPolygon":
+                for polygon in geometry["coordinates"]:
+                    self.add_polygon(polygon)
+            case "LineString":
+                self.add_ring(geometry["coordinates"])
+            case "MultiLineString":
+                for line in geometry["coordinates"]:
+                    self.add_ring(line)
+            case "Point":
+                if "name_en" in properties:
+                    x, y = geometry["coordinates"]
+                    self.labels.append(
+                        (int(x), int(y), " {} ".format(properties["name_en"]))
+                    )
+
+    @property
+    def nbytes(self) -> int:
+        """An estimate of the memory held by this group."""
+        return (
+            _OBJECT_BYTES * 4
+            + len(self.coords) * self.coords.itemsize
+            + len(self.ring_ends) * self.ring_ends.itemsize
+            + len(self.polygon_ends) * self.polygon_ends.itemsize
+            + sum(_LABEL_BYTES + len(text) for _, _, text in self.labels)
+        )
+
+    def simplified(self, extent: int, level: int) -> "FeatureGroup":
+        """
+        This group with every vertex snapped to the finest grid that can be seen at a level of
+        detail and repeated vertices dropped. A line or outline that shrinks to one point is
+        kept as a dot (once per point), and a filled polygon that shrinks to nothing is dropped.
+        Labels are kept as they are.
+        """
+        if self.geometry_type == POINT:
+            return self
+        x_step = extent * 2 ** level / (ZOOM_IN_SIZE * 4)
+        y_step = extent * 2 ** level / (ZOOM_IN_SIZE * 2)
+        group = FeatureGroup(self.feature_class, self.feature_type, self.geometry_type)
+        dots = set()
+
+        def add(start, end, filled):
+            # add a ring from coords[start:end], if there's anything left of it to draw
+            points = []
+            for i in range(start, end, 2):
+                point = (
+                    int(round(self.coords[i] / x_step) * x_step),
+                    int(round(self.coords[i + 1] / y_step) * y_step),
+                )
+                if not points or point != points[-1]:
+                    points.append(point)
+            # a closed ring repeats its first point at the end
+            distinct = len(points) - (1 if len(points) > 1 and points[0] == points[-1] else 0)
+            if filled and distinct < 3:
+                return False
+            if distinct == 1:
+                if points[0] in dots:
+                    return False
+                dots.add(points[0])
+                points = points[:1] * 2
+            group.add_ring(points)
+            return True
+
+        if self.geometry_type != POLYGON:
+            for start, end in self.rings():
+                add(start, end, False)
+            return group
+
+        filled = not self.outline
+        ring_starts = [0, *self.ring_ends]
+        for start, end in self.polygons():
+            if filled:
+                # a polygon goes if its outside collapses, a hole just goes on its own
+                if not add(ring_starts[start], ring_starts[start + 1], True):
+                    continue
+                for ring in range(start + 1, end):
+                    add(ring_starts[ring], ring_starts[ring + 1], True)
+            else:
+                added = [
+                    add(ring_starts[ring], ring_starts[ring + 1], False)
+                    for ring in range(start, end)
+                ]
+                if not any(added):
+                    continue
+            group.polygon_ends.append(len(group.ring_ends))
+        return group
+
+    @property
+    def empty(self) -> bool:
+        return not self.ring_ends and not self.labels
+
+    def rings(self):
+        """Iterate over (start, end) slices of `coords` for each ring or line."""
+        start = 0
+        for end in self.ring_ends:
+            yield start, end
+            start = end
+
+    def polygons(self):
+        """Iterate over (start, end) slices of `ring_ends` for each polygon."""
+        start = 0
+        for end in self.polygon_ends:
+            yield start, end
+            start = end
+
+
+class VectorTile:
+    """
+    A vector tile, decoded once at load time into a render-ready form: the features of every
+    layer are grouped by the properties that the map filters on, with their geometry packed
+    into flat arrays of numbers.
+    """
+
+    __slots__ = ["layers", "_selections", "_selection_bytes"]
+
+    def __init__(self, layers: dict[str, tuple[int, list[FeatureGroup]]]):
+        # layer name -> (extent, feature groups)
+        self.layers = layers
+        self._selections = {}
+        # what the coarser levels of detail worked out by `select` hold
+        self._selection_bytes = 0
+
+    def __len__(self):
+        return len(self.layers)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        An estimate of the memory held by this tile - which grows as `select` works out coarser
+        levels of detail.
+        """
+        return self._selection_bytes + sum(
+            _OBJECT_BYTES + sum(group.nbytes for group in groups)
+            for _, groups in self.layers.values()
+        )
+
+    def extent(self, layer_name: str) -> int:
+        return self.layers[layer_name][0]
+
+    def select(
+        self, layer_name: str, c_filters, t_filters, level: int = 0
+    ) -> list[FeatureGroup]:
+        """
+        The feature groups in a layer that pass its filters, at a level of detail (see
+        `simplified`). The answer is remembered, as the same few filters are asked for on every
+        frame.
+        """
+        key = (layer_name, tuple(c_filters), tuple(t_filters), level)
+        groups = self._selections.get(key)
+        if groups is None:
+            extent, layer = self.layers[layer_name]
+            groups = [group for group in layer if group.matches(c_filters, t_filters)]
+            if level:
+                groups = [group.simplified(extent, level) for group in groups]
+                groups = [group for group in groups if not group.empty]
+                self._selection_bytes += _OBJECT_BYTES + sum(group.nbytes for group in groups)
+            self._selections[key] = groups
+        return groups
+
+    def simplified(self) -> "VectorTile":
+        """
+        This tile at level of detail 0 - with none of the detail that is too fine to show on
+        the screen. Coarser levels are worked out (once) as `select` asks for them.
+        """
+        layers = {}
+        for layer_name, (extent, groups) in self.layers.items():
+            groups = [group.simplified(extent, 0) for group in groups]
+            layers[layer_name] = (extent, [group for group in groups if not group.empty])
+        return VectorTile(layers)
+
+    @classmethod
+    def from_decoded(cls, tile: dict) -> "VectorTile":
+        """Build a tile from the nested dicts returned by `mapbox_vector_tile.decode`."""
+        layers = {}
+        for layer_name, layer in tile.items():
+            groups = {}
+            for feature in layer["features"]:
+                properties = feature["properties"]
+                key = (
+                    _property(properties, "class"),
+                    _property(properties, "type"),
+                    feature["type"],
+                )
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = FeatureGroup(*key)
+                group.add_geometry(feature["geometry"], properties)
+            layers[layer_name] = (int(layer["extent"]), list(groups.values()))
+        return cls(layers)
+
+    @classmethod
+    def from_mvt(cls, data: bytes) -> "VectorTile":
+        """
+        Build a tile from raw MVT protobuf data, simplified to level of detail 0.
+        Raises google.protobuf.message.DecodeError if this isn't a valid tile.
+        """
+        return cls.from_decoded(mapbox_vector_tile.decode(data)).simplified()
+
+    @classmethod
+    def from_mvt_packed(cls, data: bytes, layers: Container[str] | None = None) -> bytes:
+        """
+        Build a tile from raw MVT data, keeping only `layers` (or all of them), simplified to
+        level of detail 0. Returns it packed by `to_bytes` - which is much cheaper to hand
+        between processes than the tile.
+        Raises google.protobuf.message.DecodeError if this isn't a valid tile.
+        """
+        decoded = mapbox_vector_tile.decode(data)
+        if layers is not None:
+            decoded = {name: layer for name, layer in decoded.items() if name in layers}
+        return cls.from_decoded(decoded).simplified().to_bytes()
+
+    def to_bytes(self) -> bytes:
+        """Serialise the tile to a compact binary form that can be read back quickly."""
+        out = bytearray(_COUNT.pack(len(self.layers)))
+        for layer_name, (extent, groups) in self.layers.items():
+            _write_string(out, layer_name)
+            out += _LAYER.pack(extent, len(groups))
+            for group in groups:
+                _write_string(out, group.feature_class)
+                _write_string(out, group.feature_type)
+                out += _GROUP.pack(
+                    group.geometry_type,
+                    len(group.coords),
+                    len(group.ring_ends),
+                    len(group.polygon_ends),
+                    len(group.labels),
+                )
+                out += group.coords.tobytes()
+                out += group.ring_ends.tobytes()
+                out += group.polygon_ends.tobytes()
+                for x, y, text in group.labels:
+                    out += _LABEL.pack(x, y)
+                    _write_string(out, text)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "VectorTile":
+        """Read back a tile written by `to_bytes`."""
+        view = memoryview(data)
+        (layer_count,), offset = _COUNT.unpack_from(view), _COUNT.size
+        layers = {}
+        for _ in range(layer_count):
+            layer_name, offset = _read_string(view, offset)
+            extent, group_count = _LAYER.unpack_from(view, offset)
+            offset += _LAYER.size
+            groups = []
+            for _ in range(group_count):
+                feature_class, offset = _read_string(view, offset)
+                feature_type, offset = _read_string(view, offset)
+                geometry_type, n_coords, n_rings, n_polygons, n_labels = _GROUP.unpack_from(
+                    view, offset
+                )
+                offset += _GROUP.size
+                group = FeatureGroup(feature_class, feature_type, geometry_type)
+                offset = _read_array(view, offset, group.coords, n_coords)
+                offset = _read_array(view, offset, group.ring_ends, n_rings)
+                offset = _read_array(view, offset, group.polygon_ends, n_polygons)
+                for _ in range(n_labels):
+                    x, y = _LABEL.unpack_from(view, offset)
+                    text, offset = _read_string(view, offset + _LABEL.size)
+                    group.labels.append((x, y, text))
+                groups.append(group)
+            layers[layer_name] = (extent, groups)
+        return cls(layers)
+
+
+def _property(properties: dict, name: str) -> str | None:
+    value = properties.get(name)
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+def _write_string(out: bytearray, value: str | None) -> None:
+    if value is None:
+        out += _STRING.pack(_NO_STRING)
+    else:
+        encoded = value.encode("utf-8")[: _NO_STRING - 1]
+        out += _STRING.pack(len(encoded))
+        out += encoded
+
+
+def _read_string(view: memoryview, offset: int) -> tuple[str | None, int]:
+    (length,) = _STRING.unpack_from(view, offset)
+    offset += _STRING.size
+    if length == _NO_STRING:
+        return None, offset
+    return str(view[offset:offset + length], "utf-8", "replace"), offset + length
+
+
+def _read_array(view: memoryview, offset: int, target: array, count: int) -> int:
+    end = offset + count * target.itemsize
+    target.frombytes(view[offset:end])
+    return end
@@ -0,0 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+
+# Leave a core for the UI and mpv - and more than a few workers just queue up on the fetchers.
+_MAX_WORKERS = 4
+
+_lock = threading.Lock()
+_pool: ProcessPoolExecutor | None = None
+
+
+def worker_pool() -> ProcessPoolExecutor:
+    """
+    The process pool that CPU-heavy tile work (decoding, dithering) is handed to, so that it
+    doesn't hold the GIL while the UI thread is drawing. Started on first use.
+
+    Workers are spawned rather than forked: the explorer runs mpv's threads, which don't
+    survive a fork. So anything that the workers run has to be importable without side effects.
+    """
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, min(_MAX_WORKERS, (os.cpu_count() or 2) - 1)),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown_worker_pool() -> None:
+    """Stop the workers, if they were ever started."""
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -10,6 +10,7 @@ from asciimatics.widgets import (
 )
 
 from map.map_widget import Map
+from map.worker_pool import shutdown_worker_pool
 
 
 class MapView(Frame):
@@ -44,9 +45,12 @@ def map_test(screen: Screen):
     )
 
 
-while True:
-    try:
-        Screen.wrapper(map_test, catch_interrupt=True)
-        sys.exit(0)
-    except ResizeScreenError as e:
-        last_scene = e.scene
+# the tile workers are spawned processes, which import this module - they mustn't start the UI
+if __name__ == "__main__":
+    while True:
+        try:
+            Screen.wrapper(map_test, catch_interrupt=True)
+            shutdown_worker_pool()
+            sys.exit(0)
+        except ResizeScreenError as e:
+            last_scene = e.scene
@@ -5,16 +5,24 @@ import mpv
 
 class MPVWrapper:
     """
-    A class to wrap the mpv player. Includes setting up the media-title observer.
+    A class to wrap the mpv player. Includes setting up the media-title and playback-time
+    observers.
     """
 
-    def __init__(self):
+    def __init__(self, **options):
+        """
+        :param options: extra mpv options (e.g. mute=True), on top of the defaults below.
+        """
         self.__mpv_player = mpv.MPV(
-            input_default_bindings=True,
-            input_vo_keyboard=True,
-            video=False,
+            **{
+                "input_default_bindings": True,
+                "input_vo_keyboard": True,
+                "video": False,
+                **options,
+            }
         )
         self._title_callback: Callable[[str], None] = lambda _: None
+        self._playback_callback: Callable[[float], None] = lambda _: None
 
         # Decorates the title_observer function, then 'promotes' it to the instance.
         # NB: This little dance needs to be done because we only have access
@@ -27,9 +35,20 @@ class MPVWrapper:
 
         self.__title_observer = title_observer
 
+        @self.__mpv_player.property_observer("playback-time")
+        def playback_observer(_name: str, value: float) -> None:
+            # playback-time only has a value once audio is actually being played
+            if value is not None:
+                self._playback_callback(value)
+
+        self.__playback_observer = playback_observer
+
     def register_title_callback(self, callback: Callable[[str], None]) -> None:
         self._title_callback = callback
 
+    def register_playback_callback(self, callback: Callable[[float], None]) -> None:
+        self._playback_callback = callback
+
     @property
     def player(self) -> mpv.MPV:
         return self.__mpv_player
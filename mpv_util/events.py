@@ -0,0 +1,166 @@
+from collections import deque
+from collections.abc import Callable
+import threading
+import time
+import traceback
+
+# Events waiting for a callback that wants all of them (rather than the latest) are capped at
+# this many - if it falls that far behind, the oldest are dropped.
+_MAX_BACKLOG = 1000
+
+UI = "ui"
+WORKER = "worker"
+
+
+class _Subscription:
+    __slots__ = [
+        "name",
+        "callback",
+        "lane",
+        "pending",
+        "calls",
+        "seconds",
+        "slowest",
+        "dropped",
+        "errors",
+    ]
+
+    def __init__(self, topic, callback, lane, coalesce):
+        self.name = "{}: {}".format(topic, getattr(callback, "__qualname__", repr(callback)))
+        self.callback = callback
+        self.lane = lane
+        self.pending = deque(maxlen=1 if coalesce else _MAX_BACKLOG)
+        self.calls = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.dropped = 0
+        self.errors = 0
+
+
+class EventBus:
+    """
+    Hands events from whichever thread raised them (e.g. mpv's event thread) to callbacks on
+    another thread, so that a slow callback never holds up the thread that raised the event.
+
+    Callbacks either run on the UI thread - whenever it calls `dispatch` - or on the bus's own
+    worker thread. By default a callback only gets the latest event of its topic that it hasn't
+    seen yet: if the station changes five times between two frames, the UI updates once.
+    Callbacks that need every event (e.g. for logging) can ask for that instead.
+
+    A callback that raises doesn't stop the others, or the worker thread: the error is
+    counted in `stats` and the latest one is kept in `last_error`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions: dict[str, list[_Subscription]] = {}
+        # subscriptions with events waiting, per lane, in the order that they became ready
+        self._ready: dict[str, dict[_Subscription, None]] = {UI: {}, WORKER: {}}
+        self._waker: Callable[[], None] = lambda: None
+        self._last_error: str | None = None
+
+        self._worker_ready = threading.Condition(self._lock)
+        self._worker = threading.Thread(target=self._work, name="event-bus", daemon=True)
+        self._worker.start()
+
+    def set_waker(self, waker: Callable[[], None]) -> None:
+        """Set a function that prompts the UI thread to call `dispatch` soon."""
+        self._waker = waker
+
+    def subscribe(
+        self, topic: str, callback: Callable, lane: str = UI, coalesce: bool = True
+    ) -> None:
+        """
+        Call `callback` with the arguments of each event published on `topic`.
+        :param lane: UI to run the callback on the UI thread, WORKER for the worker thread.
+        :param coalesce: only pass on the latest event, rather than every one.
+        """
+        with self._lock:
+            self._subscriptions.setdefault(topic, []).append(
+                _Subscription(topic, callback, lane, coalesce)
+            )
+
+    def publish(self, topic: str, *args) -> None:
+        """Queue up an event for the topic's callbacks. Safe to call from any thread."""
+        wake_ui = False
+        with self._lock:
+            for subscription in self._subscriptions.get(topic, ()):
+                if len(subscription.pending) == subscription.pending.maxlen:
+                    subscription.dropped += 1
+                subscription.pending.append(args)
+                # a re-published event moves to the back of the line
+                ready = self._ready[subscription.lane]
+                ready.pop(subscription, None)
+                ready[subscription] = None
+                if subscription.lane == UI:
+                    wake_ui = True
+                else:
+                    self._worker_ready.notify()
+        if wake_ui:
+            self._waker()
+
+    def dispatch(self, lane: str = UI) -> int:
+        """Run the callbacks for every waiting event on this thread. Returns how many ran."""
+        with self._lock:
+            ready = self._ready[lane]
+            if not ready:
+                return 0
+            batch = [
+                (subscription, list(subscription.pending)) for subscription in ready
+            ]
+            for subscription, _ in batch:
+                subscription.pending.clear()
+            ready.clear()
+
+        count = 0
+        for subscription, events in batch:
+            for args in events:
+                started = time.perf_counter()
+                # noinspection PyBroadException
+                try:
+                    subscription.callback(*args)
+                # pylint: disable=broad-except
+                except Exception:
+                    subscription.errors += 1
+                    self._last_error = "{}\n{}".format(subscription.name, traceback.format_exc())
+                elapsed = time.perf_counter() - started
+                subscription.calls += 1
+                subscription.seconds += elapsed
+                subscription.slowest = max(subscription.slowest, elapsed)
+                count += 1
+        return count
+
+    @property
+    def last_error(self) -> str | None:
+        """The callback and traceback of the latest error raised by a callback, if any."""
+        return self._last_error
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        Per "topic: callback": how often it ran, its mean and slowest times, how many events
+        it never saw (coalesced, or dropped from a full backlog) and how many times it raised.
+        """
+        with self._lock:
+            subscriptions = [s for topic in self._subscriptions.values() for s in topic]
+        stats = {}
+        for subscription in subscriptions:
+            # the same callback subscribed more than once (e.g. by a re-created frame) is summed
+            totals = stats.setdefault(
+                subscription.name,
+                {"calls": 0, "seconds": 0.0, "slowest": 0.0, "dropped": 0, "errors": 0},
+            )
+            totals["calls"] += subscription.calls
+            totals["seconds"] += subscription.seconds
+            totals["slowest"] = max(totals["slowest"], subscription.slowest)
+            totals["dropped"] += subscription.dropped
+            totals["errors"] += subscription.errors
+        for totals in stats.values():
+            totals["mean"] = totals.pop("seconds") / totals["calls"] if totals["calls"] else 0.0
+        return stats
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                while not self._ready[WORKER]:
+                    self._worker_ready.wait()
+            self.dispatch(WORKER)
@@ -0,0 +1,128 @@
+from collections.abc import Callable
+import queue
+import threading
+
+from mpv_util import MPVWrapper
+
+
+class StandbyPool:
+    """
+    Keeps a few muted mpv players already connected to, and buffering, the streams that we're
+    likely to switch to next - so that switching station is just a matter of unmuting one.
+
+    Players are started and stopped on a background thread, as bringing up mpv and connecting
+    to a stream can take a while. Memory is capped by limiting how much each player buffers.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        max_bytes: int = 16 * 1024 * 1024,
+        wrapper_factory: Callable[..., MPVWrapper] = MPVWrapper,
+    ):
+        """
+        :param size: the number of streams to keep on standby.
+        :param max_bytes: the most that the whole pool may buffer, split between its players.
+        :param wrapper_factory: makes a new MPVWrapper, given extra mpv options.
+        """
+        self._size = size
+        self._options = {
+            "mute": True,
+            "demuxer_max_bytes": max(max_bytes // max(size, 1), 64 * 1024),
+            "demuxer_max_back_bytes": 0,
+        }
+        self._wrapper_factory = wrapper_factory
+
+        # stream url -> player that is playing it
+        self._lock = threading.Lock()
+        self._players: dict[str, MPVWrapper] = {}
+        self._idle: list[MPVWrapper] = []
+        self._wanted: list[str] = []
+
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._maintain, daemon=True)
+        self._thread.start()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def streams(self) -> list[str]:
+        """The streams that are currently on standby."""
+        with self._lock:
+            return list(self._players)
+
+    def want(self, streams: list[str]) -> None:
+        """Set the streams to keep on standby - most important first."""
+        streams = streams[: self._size]
+        with self._lock:
+            self._wanted = streams
+        self._requests.put(streams)
+
+    def take(self, stream: str) -> MPVWrapper | None:
+        """Take the (still muted) player for a stream out of the pool, if there is one."""
+        with self._lock:
+            return self._players.pop(stream, None)
+
+    def give(self, stream: str | None, wrapper: MPVWrapper) -> None:
+        """
+        Hand a player that is playing `stream` (or nothing, if None) back to the pool. It is
+        muted straight away, then kept if the stream is wanted and re-used or shut down if not.
+        """
+        self._quieten(wrapper)
+        with self._lock:
+            if stream is None:
+                self._idle.append(wrapper)
+            else:
+                old = self._players.pop(stream, None)
+                self._players[stream] = wrapper
+                if old is not None:
+                    self._idle.append(old)
+            wanted = list(self._wanted)
+        self._requests.put(wanted)
+
+    def close(self) -> None:
+        self._requests.put(None)
+        with self._lock:
+            players = list(self._players.values()) + self._idle
+            self._players, self._idle = {}, []
+        for wrapper in players:
+            wrapper.player.terminate()
+
+    @staticmethod
+    def _quieten(wrapper: MPVWrapper) -> None:
+        wrapper.register_title_callback(lambda _: None)
+        wrapper.register_playback_callback(lambda _: None)
+        wrapper.player.mute = True
+
+    def _maintain(self) -> None:
+        while True:
+            wanted = self._requests.get()
+            # only the latest request matters
+            while not self._requests.empty():
+                wanted = self._requests.get()
+            if wanted is None:
+                return
+
+            with self._lock:
+                spare = self._idle + [
+                    self._players.pop(stream)
+                    for stream in list(self._players)
+                    if stream not in wanted
+                ]
+                self._idle = []
+                missing = [stream for stream in wanted if stream not in self._players]
+
+            for stream in missing:
+                wrapper = spare.pop() if spare else self._wrapper_factory(**self._options)
+                self._quieten(wrapper)
+                wrapper.player.play(stream)
+                with self._lock:
+                    if stream in self._wanted and stream not in self._players:
+                        self._players[stream] = wrapper
+                        continue
+                spare.append(wrapper)
+
+            for wrapper in spare:
+                wrapper.player.terminate()
@@ -1,68 +1,159 @@
 from collections.abc import Callable
+import threading
+import time
 
 from mpv_util import MPVWrapper
+from mpv_util.events import UI, WORKER, EventBus
+from mpv_util.standby import StandbyPool
+from stations.catalogue import StationCursor
+from stream_meta.titles import NO_SONG, SongInfo, parse_title
 
 
 class StreamPlayer:
-    def __init__(self, wrapper: MPVWrapper, stations: list[dict[str, str | list[str]]]):
-        # get the player and register the callback into this class
-        self._mpv_player = wrapper.player
-        wrapper.register_title_callback(self._song_callbacks)
-
+    def __init__(
+        self,
+        wrapper: MPVWrapper | None,
+        stations: StationCursor,
+        standby: StandbyPool | None = None,
+        events: EventBus | None = None,
+    ):
         # set player state
         self._playing = False
         self._stations = stations
-        self._station_index = 0
-        self._last_songinfo = "-"
+        self._last_songinfo = NO_SONG
+
+        # callbacks are run by the event bus rather than on whichever thread (mpv's, the UI's)
+        # noticed the change, so nothing here waits on them. The UI lane's callbacks only run
+        # when the UI thread dispatches them.
+        self._events = events or EventBus()
+
+        # switch latency: when the last play/switch was asked for, and whether it came from
+        # the standby pool. Cleared once audio arrives.
+        self._switch_started: float | None = None
+        self._switch_from_standby = False
+        self._last_switch: tuple[float, bool] | None = None
+
+        # the player can be attached later, so that mpv can start up in the background
+        self._wrapper: MPVWrapper | None = None
+        self._mpv_player = None
+        self._player_lock = threading.Lock()
+        self._standby = standby
+        if wrapper:
+            self.attach(wrapper)
+
+    def attach(self, wrapper: MPVWrapper) -> None:
+        with self._player_lock:
+            self._use(wrapper)
+
+            # start playing if we were asked to before the player was ready
+            if self._playing:
+                self._mpv_player.play(self.current_station["stream"])
+        self._refresh_standby()
+
+    def _use(self, wrapper: MPVWrapper) -> None:
+        # get the player and register the callbacks into this class
+        wrapper.register_title_callback(self._title_callback)
+        wrapper.register_playback_callback(self._playback_callback)
+        self._wrapper = wrapper
+        self._mpv_player = wrapper.player
+
+    @property
+    def playing(self) -> bool:
+        return self._playing
 
-        # initialize callbacks
-        self._songinfo_callbacks: [Callable[[dict], None]] = [
-            lambda _: None,
-        ]
-        self._stationinfo_callbacks: [Callable[[dict], None]] = [
-            lambda _: None,
-        ]
+    @property
+    def events(self) -> EventBus:
+        # the bus that runs the callbacks - the UI dispatches it, and can read its stats
+        return self._events
+
+    def register_songinfo_callback(
+        self, callback: Callable[[SongInfo], None], lane: str = UI
+    ) -> None:
+        # register a songinfo callback - it only gets the latest song if several come at once
+        self._events.subscribe("songinfo", callback, lane)
+
+    def register_stationinfo_callback(
+        self, callback: Callable[[dict], None], lane: str = UI
+    ) -> None:
+        # register a stationinfo callback - it only gets the latest station after a flurry
+        self._events.subscribe("stationinfo", callback, lane)
+
+    def register_switch_callback(
+        self, callback: Callable[[float, bool], None], lane: str = UI
+    ) -> None:
+        """
+        Register a callback for when audio starts after a play or a station switch. It is
+        passed the latency in seconds, and whether the stream came from the standby pool.
+        """
+        self._events.subscribe("switch", callback, lane)
 
-    def register_songinfo_callback(self, callback: Callable[[str], None]) -> None:
-        # register a songinfo callback
-        self._songinfo_callbacks.append(callback)
+    def register_play_callback(self, callback: Callable[[dict, SongInfo], None]) -> None:
+        """
+        Register a callback for every title that a station sends, e.g. to record them. It is
+        passed the station and the song, and runs on the event bus's worker thread.
+        """
+        self._events.subscribe("play", callback, WORKER, coalesce=False)
 
-    def register_stationinfo_callback(self, callback: Callable[[dict], None]) -> None:
-        # register a stationinfo callback
-        self._stationinfo_callbacks.append(callback)
+    @property
+    def last_switch(self) -> tuple[float, bool] | None:
+        # (latency in seconds, from standby) for the last switch that has started playing
+        return self._last_switch
+
+    def _playback_callback(self, _playback_time: float) -> None:
+        # NB: registered as the playback-time observer callback from mpv
+        with self._player_lock:
+            if self._switch_started is None:
+                return
+            self._last_switch = (
+                time.monotonic() - self._switch_started,
+                self._switch_from_standby,
+            )
+            self._switch_started = None
+            self._events.publish("switch", *self._last_switch)
 
     def force_callbacks(self) -> None:
         self._song_callbacks(self._last_songinfo)
         self._station_callbacks()
 
-    def _song_callbacks(self, songinfo: str) -> None:
+    def _title_callback(self, title: str) -> None:
         """
-        Calls the registered songinfo callbacks.
-        NB: This function is also registered as the song title observer callback from mpv
+        Normalises a stream title, then calls the songinfo callbacks with it.
+        NB: This function is registered as the song title observer callback from mpv
         """
+        station = self.current_station
+        songinfo = parse_title(title, station["name"]) or NO_SONG
+        self._events.publish("play", station, songinfo)
+        self._song_callbacks(songinfo)
+
+    def _song_callbacks(self, songinfo: SongInfo) -> None:
+        # calls the registered songinfo callbacks
         self._last_songinfo = songinfo
-        for callback in self._songinfo_callbacks:
-            callback(songinfo)
+        self._events.publish("songinfo", songinfo)
 
     def _station_callbacks(self) -> None:
         # calls the registered stationinfo callback
-        for callback in self._stationinfo_callbacks:
-            callback(self.current_station)
+        self._events.publish("stationinfo", self.current_station)
 
     @property
     def current_station(self) -> dict[str, str]:
         # returns the current station information in a dictionary
-        return self._stations[self._station_index]
+        return self._stations.current
 
     def play(self) -> None:
-        # play the currently selected stream
-        self._mpv_player.play(self._stations[self._station_index]["stream"])
-        self._playing = True
+        # play the currently selected stream - or as soon as the player is attached
+        with self._player_lock:
+            self._switch_started = time.monotonic()
+            self._switch_from_standby = False
+            if self._mpv_player:
+                self._mpv_player.play(self.current_station["stream"])
+            self._playing = True
 
     def pause(self) -> None:
         # pause the current stream
-        self._mpv_player.stop()
-        self._last_songinfo = "-"
+        with self._player_lock:
+            if self._mpv_player:
+                self._mpv_player.stop()
+        self._last_songinfo = NO_SONG
         self._playing = False
 
     def play_pause(self) -> None:
@@ -71,14 +162,64 @@ class StreamPlayer:
 
     def next_station(self) -> None:
         # select the next station from the list and play it
-        self._station_index = (self._station_index + 1) % len(self._stations)
-        self._last_songinfo = "-"
-        self._station_callbacks()
-        self.play()
+        self._switch_station(lambda: self._stations.move(1))
 
     def previous_station(self) -> None:
         # select the previous station from the list and play it
-        self._station_index = (self._station_index - 1) % len(self._stations)
-        self._last_songinfo = "-"
+        self._switch_station(lambda: self._stations.move(-1))
+
+    def select_station(self, station_id: int) -> None:
+        # jump to a station in the catalogue and play it
+        if station_id != self.current_station["id"]:
+            self._switch_station(lambda: self._stations.seek(station_id))
+
+    def _switch_station(self, move: Callable[[], dict]) -> None:
+        was_playing = self._playing
+        old_stream = self.current_station["stream"]
+        move()
+        self._last_songinfo = NO_SONG
         self._station_callbacks()
-        self.play()
+        if not self._switch_to_standby(old_stream if was_playing else None):
+            self.play()
+        self._refresh_standby()
+
+    def _switch_to_standby(self, old_stream: str | None) -> bool:
+        """
+        Swap to the standby player for the current station, if the pool has one, and hand the
+        old player (which is playing `old_stream`, or nothing) back to the pool.
+        """
+        if self._standby is None:
+            return False
+        with self._player_lock:
+            if self._wrapper is None:
+                return False
+            wrapper = self._standby.take(self.current_station["stream"])
+            if wrapper is None:
+                return False
+
+            # the pool mutes the old player and detaches it from our callbacks
+            self._standby.give(old_stream, self._wrapper)
+            self._switch_started = time.monotonic()
+            self._switch_from_standby = True
+            self._use(wrapper)
+            self._mpv_player.mute = False
+            self._playing = True
+
+        # the standby player already has a title, which mpv won't tell us about again
+        title = wrapper.player.media_title
+        if title:
+            self._title_callback(title)
+        return True
+
+    def _refresh_standby(self) -> None:
+        # keep the closest stations either side of this one on standby
+        if self._standby is None or self._wrapper is None:
+            return
+        current = self.current_station["stream"]
+        neighbours = []
+        for offset in range(1, min(self._standby.size, len(self._stations) // 2) + 1):
+            for steps in (offset, -offset):
+                stream = self._stations.peek(steps)["stream"]
+                if stream != current and stream not in neighbours:
+                    neighbours.append(stream)
+        self._standby.want(neighbours[: self._standby.size])
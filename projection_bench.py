@@ -0,0 +1,97 @@
+"""
+Micro-benchmark for the map projection helpers: the old per-vertex path, where every point went
+through a method call inside a list comprehension, against the batched transforms in
+map.projection working on packed coordinate arrays.
+
+    python projection_bench.py
+"""
+from array import array
+from math import pi, log, tan
+import random
+import timeit
+
+from map import projection
+
+_EXTENT = 4096
+_SIZE = 64
+_ZOOM = 12
+_RINGS = 400
+_VERTICES_PER_RING = 50
+_REPEATS = 20
+
+
+class PerPoint:
+    """The scalar helpers as they used to be called from Map._draw_lines / _draw_polygons."""
+
+    def __init__(self):
+        self._size = _SIZE
+        self._zoom = _ZOOM
+
+    def _scale_coords(self, x, y, extent, xo, yo):
+        return xo + (x * self._size * 2 / extent), yo + (
+            (extent - y) * self._size / extent
+        )
+
+    def _convert_latitude(self, latitude):
+        return int(
+            (180 - (180 / pi * log(tan(pi / 4 + latitude * pi / 360))))
+            * (2 ** self._zoom)
+            * self._size
+            / 360
+        )
+
+
+def _report(name, per_point, batched, vertices):
+    per_point_time = min(timeit.repeat(per_point, number=1, repeat=_REPEATS))
+    batched_time = min(timeit.repeat(batched, number=1, repeat=_REPEATS))
+    print(
+        "{:<22} {:>9.2f} ms {:>9.2f} ms {:>7.1f}x  ({} vertices)".format(
+            name,
+            per_point_time * 1000,
+            batched_time * 1000,
+            per_point_time / batched_time,
+            vertices,
+        )
+    )
+
+
+def main():
+    random.seed(1)
+    rings = [
+        [
+            (random.randint(0, _EXTENT), random.randint(0, _EXTENT))
+            for _ in range(_VERTICES_PER_RING)
+        ]
+        for _ in range(_RINGS)
+    ]
+    packed = array("i", [value for ring in rings for point in ring for value in point])
+    packed_rings = [array("i", [value for point in ring for value in point]) for ring in rings]
+    latitudes = [random.uniform(-80, 80) for _ in range(_RINGS * _VERTICES_PER_RING)]
+    old = PerPoint()
+
+    def scale_per_point():
+        for ring in rings:
+            [old._scale_coords(x, y, _EXTENT, 10, 20) for x, y in ring]
+
+    def scale_batched():
+        projection.scale_coords(packed, _EXTENT, _SIZE, 10, 20)
+
+    def scale_batched_by_ring():
+        for ring in packed_rings:
+            projection.scale_coords(ring, _EXTENT, _SIZE, 10, 20)
+
+    def latitude_per_point():
+        [old._convert_latitude(latitude) for latitude in latitudes]
+
+    def latitude_batched():
+        projection.convert_latitudes(latitudes, _ZOOM, _SIZE)
+
+    print("{:<22} {:>12} {:>12} {:>8}".format("", "per-point", "batched", "speedup"))
+    _report("scale_coords", scale_per_point, scale_batched, len(packed) // 2)
+    # the same vertices, one ring at a time - as a tile with many small features is drawn
+    _report("scale_coords by ring", scale_per_point, scale_batched_by_ring, len(packed) // 2)
+    _report("convert_latitude", latitude_per_point, latitude_batched, len(latitudes))
+
+
+if __name__ == "__main__":
+    main()
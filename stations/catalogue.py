@@ -0,0 +1,256 @@
+"""
+The station catalogue - every known station in a SQLite database, indexed by country, city,
+name and location, so that the explorer only ever reads the stations that it actually needs.
+"""
+from collections.abc import Iterable, Iterator
+import sqlite3
+import threading
+
+from stations import STATIONS_DB
+
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE stations (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    city TEXT NOT NULL,
+    country TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    stream TEXT NOT NULL
+);
+CREATE INDEX stations_country ON stations (country, city);
+CREATE INDEX stations_city ON stations (city);
+CREATE INDEX stations_name ON stations (name COLLATE NOCASE);
+"""
+
+# An R*Tree gives us proper bounding box queries; not every SQLite is built with it, in which
+# case a plain index on latitude narrows things down well enough.
+_RTREE_SCHEMA = """
+CREATE VIRTUAL TABLE station_locations USING rtree (
+    id, min_latitude, max_latitude, min_longitude, max_longitude
+);
+"""
+_FALLBACK_SCHEMA = "CREATE INDEX stations_location ON stations (latitude, longitude);"
+
+_COLUMNS = "id, name, city, country, latitude, longitude, stream"
+
+
+def _station(row: tuple) -> dict:
+    # stations are handed out in the same shape as the STATIONS_DB entries, plus their id
+    station_id, name, city, country, latitude, longitude, stream = row
+    return {
+        "id": station_id,
+        "name": name,
+        "city": city,
+        "country": country,
+        "location": (latitude, longitude),
+        "stream": stream,
+    }
+
+
+class StationCatalogue:
+    """
+    A SQLite backed catalogue of stations. Safe to share between threads - the connection is
+    guarded by a lock, and every query is small.
+    """
+
+    def __init__(self, path: str = "stations.db"):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                self._create()
+            self._rtree = bool(
+                self._db.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'station_locations'"
+                ).fetchone()
+            )
+        self._count: int | None = None
+
+    def _create(self) -> None:
+        self._db.executescript(
+            "DROP TABLE IF EXISTS stations; DROP TABLE IF EXISTS station_locations;" + _SCHEMA
+        )
+        try:
+            self._db.executescript(_RTREE_SCHEMA)
+        except sqlite3.OperationalError:
+            self._db.executescript(_FALLBACK_SCHEMA)
+        self._db.execute("PRAGMA user_version = {}".format(_SCHEMA_VERSION))
+
+    def __len__(self) -> int:
+        if self._count is None:
+            self._count = self._scalar("SELECT COUNT(*) FROM stations")
+        return self._count
+
+    def add_stations(self, stations: Iterable[dict]) -> None:
+        """Add stations (dicts like the STATIONS_DB entries) to the catalogue."""
+        with self._lock, self._db:
+            for station in stations:
+                latitude, longitude = station["location"]
+                cursor = self._db.execute(
+                    "INSERT INTO stations (name, city, country, latitude, longitude, stream)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        station["name"],
+                        station["city"],
+                        station["country"],
+                        latitude,
+                        longitude,
+                        station["stream"],
+                    ),
+                )
+                if self._rtree:
+                    self._db.execute(
+                        "INSERT INTO station_locations VALUES (?, ?, ?, ?, ?)",
+                        (cursor.lastrowid, latitude, latitude, longitude, longitude),
+                    )
+        self._count = None
+
+    def get(self, station_id: int) -> dict | None:
+        rows = self._query(f"SELECT {_COLUMNS} FROM stations WHERE id = ?", (station_id,))
+        return rows[0] if rows else None
+
+    def first_id(self) -> int | None:
+        return self._scalar("SELECT MIN(id) FROM stations")
+
+    def step(self, station_id: int, forwards: bool = True) -> int | None:
+        """The id of the station after (or before) `station_id`, wrapping around at the ends."""
+        if forwards:
+            following = "SELECT MIN(id) FROM stations WHERE id > ?"
+            wrapped = "SELECT MIN(id) FROM stations"
+        else:
+            following = "SELECT MAX(id) FROM stations WHERE id < ?"
+            wrapped = "SELECT MAX(id) FROM stations"
+        found = self._scalar(following, (station_id,))
+        return found if found is not None else self._scalar(wrapped)
+
+    def in_country(self, country: str) -> list[dict]:
+        return self._query(
+            f"SELECT {_COLUMNS} FROM stations WHERE country = ? ORDER BY city, id", (country,)
+        )
+
+    def in_city(self, city: str) -> list[dict]:
+        return self._query(f"SELECT {_COLUMNS} FROM stations WHERE city = ? ORDER BY id", (city,))
+
+    def named(self, prefix: str) -> list[dict]:
+        """Stations whose name starts with `prefix`, ignoring case."""
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return self._query(
+            f"SELECT {_COLUMNS} FROM stations WHERE name LIKE ? ESCAPE '\\'"
+            " ORDER BY name COLLATE NOCASE",
+            (escaped + "%",),
+        )
+
+    def in_bounds(
+        self, south: float, west: float, north: float, east: float
+    ) -> list[dict]:
+        """Stations inside a latitude/longitude box. `west` > `east` crosses the antimeridian."""
+        if west > east:
+            return self.in_bounds(south, west, north, 180) + self.in_bounds(
+                south, -180, north, east
+            )
+        if self._rtree:
+            return self._query(
+                f"SELECT {_COLUMNS} FROM stations WHERE id IN ("
+                " SELECT id FROM station_locations"
+                " WHERE min_latitude >= ? AND max_latitude <= ?"
+                " AND min_longitude >= ? AND max_longitude <= ?)",
+                (south, north, west, east),
+            )
+        return self._query(
+            f"SELECT {_COLUMNS} FROM stations"
+            " WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?",
+            (south, north, west, east),
+        )
+
+    def locations(self) -> Iterator[tuple[int, float, float]]:
+        """(id, latitude, longitude) for every station, for building a spatial index."""
+        last_id = -1
+        while True:
+            with self._lock:
+                page = self._db.execute(
+                    "SELECT id, latitude, longitude FROM stations WHERE id > ?"
+                    " ORDER BY id LIMIT 5000",
+                    (last_id,),
+                ).fetchall()
+            if not page:
+                return
+            yield from page
+            last_id = page[-1][0]
+
+    def __iter__(self) -> Iterator[dict]:
+        # a page at a time, so that walking the whole world doesn't hold it all in memory
+        last_id = -1
+        while page := self._query(
+            f"SELECT {_COLUMNS} FROM stations WHERE id > ? ORDER BY id LIMIT 500", (last_id,)
+        ):
+            yield from page
+            last_id = page[-1]["id"]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _query(self, sql: str, parameters: tuple = ()) -> list[dict]:
+        with self._lock:
+            return [_station(row) for row in self._db.execute(sql, parameters)]
+
+    def _scalar(self, sql: str, parameters: tuple = ()):
+        with self._lock:
+            return self._db.execute(sql, parameters).fetchone()[0]
+
+
+class StationCursor:
+    """A position in a StationCatalogue, which moves from station to station (wrapping around)."""
+
+    def __init__(self, catalogue: StationCatalogue, station_id: int | None = None):
+        self._catalogue = catalogue
+        self._station_id = station_id if station_id is not None else catalogue.first_id()
+        if self._station_id is None:
+            raise ValueError("the station catalogue is empty")
+        self._current = catalogue.get(self._station_id)
+
+    def __len__(self) -> int:
+        return len(self._catalogue)
+
+    @property
+    def catalogue(self) -> StationCatalogue:
+        return self._catalogue
+
+    @property
+    def current(self) -> dict:
+        return self._current
+
+    def seek(self, station_id: int) -> dict:
+        """Move straight to a station."""
+        station = self._catalogue.get(station_id)
+        if station is None:
+            raise KeyError(station_id)
+        self._station_id, self._current = station_id, station
+        return station
+
+    def move(self, steps: int) -> dict:
+        """Move forwards (or backwards, for negative steps) through the catalogue."""
+        self._station_id = self._walk(steps)
+        self._current = self._catalogue.get(self._station_id)
+        return self._current
+
+    def peek(self, steps: int) -> dict:
+        """The station `steps` away, without moving."""
+        return self._catalogue.get(self._walk(steps))
+
+    def _walk(self, steps: int) -> int:
+        station_id = self._station_id
+        for _ in range(abs(steps) % len(self._catalogue)):
+            station_id = self._catalogue.step(station_id, steps > 0)
+        return station_id
+
+
+def open_catalogue(path: str = "stations.db") -> StationCatalogue:
+    """Open the station catalogue, filling a new one with the built in stations."""
+    catalogue = StationCatalogue(path)
+    if not len(catalogue):
+        catalogue.add_stations(STATIONS_DB)
+    return catalogue
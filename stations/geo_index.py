@@ -0,0 +1,219 @@
+"""
+A spatial index over the station catalogue, for finding stations by where they are on the map:
+the nearest one to a point, the next one in a compass direction, and everything in a box.
+
+Stations are bucketed into a fixed grid of latitude/longitude cells, and each row of the grid
+keeps a sorted list of its occupied columns. Point searches walk out from the starting row a
+row at a time, and along each row out from the starting column - visiting only occupied cells,
+skipping any that can't lie in the direction asked for, and stopping once no unvisited cell can
+hold anything closer than the best station found so far.
+"""
+from array import array
+from bisect import bisect_left, insort
+from collections.abc import Iterable
+from math import cos, inf, radians
+import threading
+
+# Cell size in degrees. At 2 degrees there are ~16k cells, so even 50k+ stations spread thin.
+_CELL_DEGREES = 2.0
+_COLUMNS = int(360 / _CELL_DEGREES)
+_ROWS = int(180 / _CELL_DEGREES)
+# Searches look this many columns either way - i.e. halfway round the world.
+_HALF_COLUMNS = _COLUMNS // 2
+
+NORTH = "north"
+SOUTH = "south"
+EAST = "east"
+WEST = "west"
+
+
+def _wrap(delta_longitude: float) -> float:
+    # the shortest way round, in (-180, 180]
+    delta_longitude %= 360
+    return delta_longitude - 360 if delta_longitude > 180 else delta_longitude
+
+
+def _cell(latitude: float, longitude: float) -> tuple[int, int]:
+    row = min(max(int((latitude + 90) / _CELL_DEGREES), 0), _ROWS - 1)
+    column = int(((longitude + 180) % 360) / _CELL_DEGREES) % _COLUMNS
+    return row, column
+
+
+def _in_direction(direction: str, dx: float, dy: float) -> bool:
+    # within 45 degrees either side of the direction
+    match direction:
+        case "north":
+            return dy > 0 and abs(dx) <= dy
+        case "south":
+            return dy < 0 and abs(dx) <= -dy
+        case "east":
+            return dx > 0 and abs(dy) <= dx
+        case "west":
+            return dx < 0 and abs(dy) <= -dx
+    raise ValueError("unknown direction: {}".format(direction))
+
+
+def _row_offsets(row: int, direction: str | None):
+    # rows from `row` out to the edge of the grid, nearest first, that can hold anything in
+    # the direction
+    yield 0
+    for distance in range(1, max(row, _ROWS - 1 - row) + 1):
+        if direction != SOUTH and row + distance < _ROWS:
+            yield distance
+        if direction != NORTH and row - distance >= 0:
+            yield -distance
+
+
+def _column_span(direction: str | None, row_offset: int, scale: float) -> tuple[float, float]:
+    """
+    The range of column offsets, in a row `row_offset` rows away, of cells that can hold
+    anything in the direction - see _in_direction. Longitude distances are scaled by `scale`.
+    """
+    rows = abs(row_offset)
+    match direction:
+        case None:
+            return -_HALF_COLUMNS, _HALF_COLUMNS
+        case "north" | "south":
+            # |dx| <= |dy|, and |dy| is less than rows + 1 cells
+            columns = min((rows + 1) / scale + 1, _HALF_COLUMNS)
+            return -columns, columns
+        case "east":
+            # dx >= |dy|, and |dy| is more than rows - 1 cells
+            return max((rows - 1) / scale - 1, 0), _HALF_COLUMNS
+        case "west":
+            return -_HALF_COLUMNS, -max((rows - 1) / scale - 1, 0)
+    raise ValueError("unknown direction: {}".format(direction))
+
+
+class StationIndex:
+    """
+    A grid index of station locations. It holds only ids and coordinates (in packed arrays),
+    so it stays small even for the whole world's stations.
+    """
+
+    def __init__(self, locations: Iterable[tuple[int, float, float]] = ()):
+        """
+        :param locations: (station id, latitude, longitude) for every station to index.
+        """
+        self._lock = threading.Lock()
+        self._ids = array("q")
+        self._latitudes = array("d")
+        self._longitudes = array("d")
+        # (row, column) -> positions in the arrays above
+        self._cells: dict[tuple[int, int], array] = {}
+        # row -> its occupied columns, in order
+        self._rows: dict[int, list[int]] = {}
+        self.add(locations)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, locations: Iterable[tuple[int, float, float]]) -> None:
+        with self._lock:
+            for station_id, latitude, longitude in locations:
+                row, column = _cell(latitude, longitude)
+                cell = self._cells.get((row, column))
+                if cell is None:
+                    cell = self._cells[row, column] = array("I")
+                    insort(self._rows.setdefault(row, []), column)
+                cell.append(len(self._ids))
+                self._ids.append(station_id)
+                self._latitudes.append(latitude)
+                self._longitudes.append(longitude)
+
+    def nearest(
+        self, latitude: float, longitude: float, exclude: int | None = None
+    ) -> int | None:
+        """The id of the station nearest to a point, other than `exclude`."""
+        return self._search(latitude, longitude, None, exclude)
+
+    def towards(
+        self, latitude: float, longitude: float, direction: str, exclude: int | None = None
+    ) -> int | None:
+        """
+        The id of the nearest station from a point in a compass direction (NORTH, SOUTH, EAST
+        or WEST), other than `exclude`. East and west wrap around the world.
+        """
+        return self._search(latitude, longitude, direction, exclude)
+
+    def within(self, south: float, west: float, north: float, east: float) -> list[int]:
+        """The ids of the stations inside a box. `west` > `east` crosses the antimeridian."""
+        first_row, first_column = _cell(south, west)
+        last_row, last_column = _cell(north, east)
+        columns = (last_column - first_column) % _COLUMNS + 1
+        if west <= east and east - west >= 360 - _CELL_DEGREES:
+            columns = _COLUMNS
+        found = []
+        with self._lock:
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, first_column + columns):
+                    for i in self._cells.get((row, column % _COLUMNS), ()):
+                        if not south <= self._latitudes[i] <= north:
+                            continue
+                        longitude = self._longitudes[i]
+                        if west <= east:
+                            inside = west <= longitude <= east
+                        else:
+                            inside = longitude >= west or longitude <= east
+                        if inside:
+                            found.append(self._ids[i])
+        return found
+
+    def _search(self, latitude, longitude, direction, exclude) -> int | None:
+        # distances are in degrees of latitude - longitude is scaled down away from the equator
+        scale = max(cos(radians(latitude)), 0.01)
+        row, column = _cell(latitude, longitude)
+        best, best_distance = None, inf
+        with self._lock:
+            for row_offset in _row_offsets(row, direction):
+                # anything in this row is at least this far away, north to south
+                dy_min = max(abs(row_offset) - 1, 0) * _CELL_DEGREES
+                if dy_min * dy_min > best_distance:
+                    # and the rows come nearest first
+                    break
+                columns = self._rows.get(row + row_offset)
+                if not columns:
+                    continue
+                first, last = _column_span(direction, row_offset, scale)
+                if first > last:
+                    continue
+
+                def visit(column_offset):
+                    # look through a cell, returning False once it is out of reach
+                    nonlocal best, best_distance
+                    dx_min = max(abs(column_offset) - 1, 0) * _CELL_DEGREES * scale
+                    if dx_min * dx_min + dy_min * dy_min > best_distance:
+                        return False
+                    cell = (row + row_offset, (column + column_offset) % _COLUMNS)
+                    for i in self._cells[cell]:
+                        if self._ids[i] == exclude:
+                            continue
+                        dx = _wrap(self._longitudes[i] - longitude) * scale
+                        dy = self._latitudes[i] - latitude
+                        if direction is not None and not _in_direction(direction, dx, dy):
+                            continue
+                        distance = dx * dx + dy * dy
+                        if distance < best_distance:
+                            best, best_distance = self._ids[i], distance
+                    return True
+
+                # East from the starting column, then west - each occupied column once, even
+                # where the two meet on the far side of the world.
+                start = bisect_left(columns, column)
+                east = 0
+                while last >= 0 and east < len(columns):
+                    column_offset = (columns[(start + east) % len(columns)] - column) % _COLUMNS
+                    if column_offset > last:
+                        break
+                    east += 1
+                    if column_offset >= first and not visit(column_offset):
+                        break
+                west = 1
+                while first <= -1 and west <= len(columns) - east:
+                    column_offset = -((column - columns[start - west]) % _COLUMNS)
+                    if column_offset < first:
+                        break
+                    west += 1
+                    if column_offset <= last and not visit(column_offset):
+                        break
+        return best
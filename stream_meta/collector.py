@@ -0,0 +1,218 @@
+"""
+Headless metadata collection: keep hundreds of station streams open at once, read the ICY
+metadata straight out of them (no audio is decoded or played) and log every title change.
+"""
+import asyncio
+from datetime import datetime, timezone
+import json
+import random
+from urllib.parse import urljoin
+
+from history.store import PlayHistory
+
+from stream_meta.icy import (
+    MAX_HEAD_BYTES,
+    ChunkedDecoder,
+    IcyError,
+    IcyParser,
+    parse_head,
+    request,
+)
+from stream_meta.playlist import MAX_PLAYLIST_BYTES, is_playlist, parse_playlist
+from stream_meta.titles import parse_title
+
+# Audio is skipped in reads of at most this size, so each connection holds very little.
+_CHUNK_SIZE = 16 * 1024
+_CONNECT_TIMEOUT = 15
+# A stream that sends nothing for this long is treated as dropped.
+_READ_TIMEOUT = 60
+_MAX_REDIRECTS = 5
+_MAX_PLAYLIST_DEPTH = 2
+
+# Reconnects back off exponentially, with full jitter so that a dropped server isn't hit by
+# every station at once. A connection that lasted this long starts the backoff again.
+_BASE_BACKOFF = 2
+_MAX_BACKOFF = 300
+_HEALTHY_SECONDS = 60
+
+
+class Collector:
+    """
+    Watches a set of stations, writing a JSON line to the log for every title change:
+
+        {"time": "2022-08-01T12:00:00+00:00", "station": 1, "name": "...", "country": "...",
+         "title": "..."}
+
+    Log writes go through a bounded queue. If the log falls behind, stations stop reading
+    their streams until it catches up - TCP flow control then slows the servers down - rather
+    than titles piling up in memory.
+    """
+
+    def __init__(
+        self,
+        stations: list[dict],
+        log_path: str,
+        streams: int = 200,
+        connecting: int = 20,
+        queue_size: int = 1000,
+        history: PlayHistory | None = None,
+    ):
+        """
+        :param stations: catalogue stations to watch.
+        :param log_path: the file that title changes are appended to.
+        :param streams: the most streams to hold open at once - any other stations wait.
+        :param connecting: the most connections to be setting up at once.
+        :param queue_size: the most title changes waiting to be logged.
+        :param history: a play history to record the title changes in too.
+        """
+        self._stations = stations
+        self._log_path = log_path
+        self._streams = streams
+        self._connecting = connecting
+        self._queue_size = queue_size
+        self._history = history
+        self.stats = {"open": 0, "connects": 0, "failures": 0, "titles": 0}
+
+    async def run(self) -> None:
+        """Watch every station until cancelled."""
+        self._stream_slots = asyncio.Semaphore(self._streams)
+        self._connect_slots = asyncio.Semaphore(self._connecting)
+        self._log = asyncio.Queue(self._queue_size)
+        writer = asyncio.create_task(self._write_log())
+        try:
+            await asyncio.gather(*(self._watch(station) for station in self._stations))
+        finally:
+            writer.cancel()
+
+    async def _watch(self, station: dict) -> None:
+        """Follow one station for ever, reconnecting after every drop."""
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            async with self._stream_slots:
+                # waiting for a slot doesn't count towards a connection being healthy
+                started = loop.time()
+                try:
+                    await self._follow(station)
+                except (OSError, EOFError, IcyError, asyncio.TimeoutError):
+                    self.stats["failures"] += 1
+            if loop.time() - started > _HEALTHY_SECONDS:
+                attempt = 0
+            await asyncio.sleep(
+                random.uniform(0, min(_MAX_BACKOFF, _BASE_BACKOFF * 2 ** attempt))
+            )
+            attempt += 1
+
+    async def _follow(self, station: dict) -> None:
+        """Connect to a station and log its titles until the stream ends."""
+        async with self._connect_slots:
+            reader, writer, headers = await asyncio.wait_for(
+                self._connect(station["stream"]), _CONNECT_TIMEOUT
+            )
+        self.stats["connects"] += 1
+        self.stats["open"] += 1
+        try:
+            metaint = headers.get("icy-metaint", "")
+            parser = IcyParser(int(metaint) if metaint.isdigit() else 0)
+            chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+            decoder = ChunkedDecoder() if chunked else None
+            last_title = None
+            while True:
+                data = await asyncio.wait_for(
+                    reader.read(_CHUNK_SIZE if chunked else min(parser.wanted, _CHUNK_SIZE)),
+                    _READ_TIMEOUT,
+                )
+                if not data or (decoder and decoder.done):
+                    raise EOFError("stream closed")
+                if decoder:
+                    data = b"".join(decoder.feed(data))
+                for fields in parser.feed(data):
+                    title = fields.get("StreamTitle")
+                    if title and title != last_title:
+                        last_title = title
+                        await self._log.put(self._record(station, title))
+        finally:
+            self.stats["open"] -= 1
+            writer.close()
+
+    @classmethod
+    async def _connect(cls, url: str, depth: int = 0):
+        """
+        Open a metadata request to `url`, following redirects and playlists.
+        Returns the stream reader and writer, and the response headers.
+        """
+        for _ in range(_MAX_REDIRECTS + 1):
+            host, port, tls, head = request(url)
+            reader, writer = await asyncio.open_connection(
+                host, port, ssl=tls or None, limit=MAX_HEAD_BYTES
+            )
+            try:
+                writer.write(head)
+                await writer.drain()
+                status, headers = parse_head(await reader.readuntil(b"\r\n\r\n"))
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+                writer.close()
+                raise IcyError("bad response from {}".format(url)) from e
+            except IcyError:
+                writer.close()
+                raise
+            if status in (301, 302, 303, 307, 308) and "location" in headers:
+                writer.close()
+                url = urljoin(url, headers["location"])
+                continue
+            if status != 200:
+                writer.close()
+                raise IcyError("{} from {}".format(status, url))
+            if not is_playlist(url, headers.get("content-type")):
+                return reader, writer, headers
+
+            # read the (small) playlist, then try its streams in turn
+            try:
+                playlist = await cls._read_playlist(reader, headers)
+            finally:
+                writer.close()
+            if depth >= _MAX_PLAYLIST_DEPTH:
+                raise IcyError("playlists nested too deep at {}".format(url))
+            error = IcyError("empty playlist at {}".format(url))
+            for entry in parse_playlist(url, playlist):
+                try:
+                    return await cls._connect(entry, depth + 1)
+                except (OSError, IcyError) as e:
+                    error = e
+            raise error
+        raise IcyError("too many redirects from {}".format(url))
+
+    @staticmethod
+    async def _read_playlist(reader: asyncio.StreamReader, headers: dict[str, str]) -> bytes:
+        chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+        decoder = ChunkedDecoder() if chunked else None
+        playlist = bytearray()
+        while len(playlist) <= MAX_PLAYLIST_BYTES and not (decoder and decoder.done):
+            data = await reader.read(_CHUNK_SIZE)
+            if not data:
+                break
+            playlist += b"".join(decoder.feed(data)) if decoder else data
+        return bytes(playlist)
+
+    @staticmethod
+    def _record(station: dict, title: str) -> dict:
+        return {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "station": station["id"],
+            "name": station["name"],
+            "country": station["country"],
+            "title": title,
+        }
+
+    async def _write_log(self) -> None:
+        with open(self._log_path, "a", encoding="utf-8") as log:
+            while True:
+                record = await self._log.get()
+                log.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if self._history is not None:
+                    station = {"id": record["station"], "country": record["country"]}
+                    self._history.record(station, parse_title(record["title"], record["name"]))
+                self.stats["titles"] += 1
+                # flush whenever we've caught up, rather than after every line
+                if self._log.empty():
+                    log.flush()
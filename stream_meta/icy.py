@@ -0,0 +1,185 @@
+"""
+The ICY (Shoutcast/Icecast) metadata protocol, without any I/O - so the same code serves the
+asyncio collector and the blocking reader.
+
+A client asks for metadata with an `Icy-MetaData: 1` request header. The server then says how
+many audio bytes come between metadata blocks (`icy-metaint`), and after every that many
+bytes sends a length byte (times 16) followed by that much metadata, e.g.
+
+    StreamTitle='Artist - Title';StreamUrl='';
+"""
+from collections.abc import Iterator
+import re
+from urllib.parse import urlsplit
+
+_USER_AGENT = "stream-explorer"
+# Response heads are never anywhere near this long - it just bounds what we'll hold on to.
+MAX_HEAD_BYTES = 16 * 1024
+
+_METADATA_FIELD = re.compile(rb"(\w+)='(.*?)';", re.DOTALL)
+
+
+class IcyError(Exception):
+    """Raised when a server doesn't answer the way that a stream server should."""
+
+
+def request(url: str) -> tuple[str, int, bool, bytes]:
+    """
+    The (host, port, use TLS, request bytes) for a metadata request for `url`.
+    HTTP/1.0 is used so that servers don't answer with chunked encoding.
+    Raises IcyError if the url can't be requested - which catalogue urls often can't.
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError as e:
+        # e.g. a port that isn't a number, or out of range
+        raise IcyError("bad url: {}".format(url)) from e
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise IcyError("unsupported url: {}".format(url))
+    tls = parts.scheme == "https"
+    port = port or (443 if tls else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    head = (
+        "GET {} HTTP/1.0\r\n"
+        "Host: {}\r\n"
+        "User-Agent: {}\r\n"
+        "Accept: */*\r\n"
+        "Icy-MetaData: 1\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+    ).format(path, parts.netloc.rpartition("@")[2], _USER_AGENT)
+    try:
+        # the host has to make it through IDNA to be connected to (e.g. no empty labels), and
+        # the request can't have anything outside Latin-1 in it (e.g. an unquoted path)
+        parts.hostname.encode("idna")
+        return parts.hostname, port, tls, head.encode("latin-1")
+    except UnicodeError as e:
+        raise IcyError("bad url: {}".format(url)) from e
+
+
+def parse_head(head: bytes) -> tuple[int, dict[str, str]]:
+    """
+    The status code and (lower-cased) headers from a response head - either HTTP or the
+    Shoutcast v1 "ICY 200 OK" flavour.
+    """
+    lines = head.decode("latin-1").split("\r\n")
+    status = lines[0].split(None, 2)
+    if len(status) < 2 or not status[0].startswith(("HTTP/", "ICY")) or not status[1].isdigit():
+        raise IcyError("not an HTTP response: {!r}".format(lines[0]))
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return int(status[1]), headers
+
+
+def parse_metadata(block: bytes) -> dict[str, str]:
+    """The fields of a metadata block, e.g. {"StreamTitle": "Artist - Title"}."""
+    block = block.rstrip(b"\0")
+    return {
+        name.decode("latin-1"): _decode(value) for name, value in _METADATA_FIELD.findall(block)
+    }
+
+
+def _decode(value: bytes) -> str:
+    # Most servers send UTF-8; the older ones send Latin-1.
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+class IcyParser:
+    """
+    Picks the metadata out of a stream body as it arrives, skipping over the audio without
+    keeping it. Holds on to at most one metadata block (up to 4080 bytes) at a time.
+    """
+
+    def __init__(self, metaint: int):
+        if metaint <= 0:
+            raise IcyError("bad icy-metaint: {}".format(metaint))
+        self._metaint = metaint
+        self._audio_left = metaint
+        self._metadata_left = None
+        self._metadata = bytearray()
+
+    def feed(self, data: bytes) -> Iterator[dict[str, str]]:
+        """Parse some more of the body, yielding the fields of any complete metadata blocks."""
+        view = memoryview(data)
+        while view:
+            if self._audio_left:
+                skipped = min(self._audio_left, len(view))
+                self._audio_left -= skipped
+                view = view[skipped:]
+            elif self._metadata_left is None:
+                self._metadata_left = view[0] * 16
+                view = view[1:]
+            else:
+                taken = min(self._metadata_left, len(view))
+                self._metadata += view[:taken]
+                self._metadata_left -= taken
+                view = view[taken:]
+
+            # a block is finished (an empty block means nothing has changed)
+            if self._metadata_left == 0:
+                if self._metadata:
+                    yield parse_metadata(bytes(self._metadata))
+                self._metadata.clear()
+                self._metadata_left = None
+                self._audio_left = self._metaint
+
+    @property
+    def wanted(self) -> int:
+        """How many bytes it's worth reading next - the rest of the audio, or of the metadata."""
+        if self._audio_left:
+            return self._audio_left
+        return 1 if self._metadata_left is None else self._metadata_left
+
+
+class ChunkedDecoder:
+    """Undoes chunked transfer encoding as the body arrives, for servers that use it anyway."""
+
+    # chunk size lines are a few hex digits, plus the odd extension
+    _MAX_LINE = 1024
+
+    def __init__(self):
+        self._line = bytearray()
+        self._chunk_left = 0
+        self.done = False
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        """Decode some more of the body, yielding the pieces of chunk data in it."""
+        data = bytes(data)
+        position = 0
+        while position < len(data) and not self.done:
+            if self._chunk_left:
+                end = min(position + self._chunk_left, len(data))
+                yield data[position:end]
+                self._chunk_left -= end - position
+                position = end
+                continue
+
+            # a chunk size line - or the blank line that ends the chunk before
+            end = data.find(b"\n", position)
+            if end < 0:
+                self._line += data[position:]
+                if len(self._line) > self._MAX_LINE:
+                    raise IcyError("bad chunk size line")
+                return
+            self._line += data[position:end]
+            position = end + 1
+            line = bytes(self._line).split(b";")[0].strip()
+            self._line.clear()
+            if not line:
+                continue
+            try:
+                size = int(line, 16)
+            except ValueError as e:
+                raise IcyError("bad chunk size: {!r}".format(line)) from e
+            if size == 0:
+                self.done = True
+            self._chunk_left = size
@@ -0,0 +1,49 @@
+"""
+Playlist (.m3u/.pls) resolution - plenty of stations publish a playlist pointing at their
+stream rather than the stream itself.
+"""
+from urllib.parse import urljoin, urlsplit
+
+# Playlists are a few lines long - anything bigger is not a playlist that we care about.
+MAX_PLAYLIST_BYTES = 64 * 1024
+
+_PLAYLIST_TYPES = {
+    "audio/x-mpegurl",
+    "audio/mpegurl",
+    "application/x-mpegurl",
+    "application/vnd.apple.mpegurl",
+    "audio/x-scpls",
+    "application/pls+xml",
+}
+_PLAYLIST_EXTENSIONS = (".m3u", ".pls")
+
+
+def is_playlist(url: str, content_type: str | None) -> bool:
+    """Whether a response (from its url and Content-Type) is a playlist rather than a stream."""
+    if content_type and content_type.split(";")[0].strip().lower() in _PLAYLIST_TYPES:
+        return True
+    return urlsplit(url).path.lower().endswith(_PLAYLIST_EXTENSIONS)
+
+
+def parse_playlist(url: str, body: bytes) -> list[str]:
+    """
+    The stream urls in an .m3u or .pls playlist, in order. HLS (.m3u8 style) playlists are
+    lists of segments rather than streams, so they give nothing.
+    """
+    text = body.decode("utf-8", errors="replace")
+    if "#EXT-X-" in text:
+        return []
+
+    entries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(("#", "[")):
+            continue
+        # .pls entries look like "File1=http://..."; .m3u entries are just the url
+        name, sep, value = line.partition("=")
+        if sep and name.lower().startswith("file"):
+            line = value.strip()
+        elif sep and "://" not in name:
+            continue
+        entries.append(urljoin(url, line))
+    return [entry for entry in entries if urlsplit(entry).scheme in ("http", "https")]
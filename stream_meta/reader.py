@@ -0,0 +1,182 @@
+from collections.abc import Callable, Iterator
+import random
+import socket
+import ssl
+import threading
+from urllib.parse import urljoin
+
+from stream_meta.icy import (
+    MAX_HEAD_BYTES,
+    ChunkedDecoder,
+    IcyError,
+    IcyParser,
+    parse_head,
+    request,
+)
+from stream_meta.playlist import MAX_PLAYLIST_BYTES, is_playlist, parse_playlist
+
+# Audio is skipped through a buffer of this size, which is re-used for every read.
+_CHUNK_SIZE = 16 * 1024
+_TIMEOUT = 30
+_MAX_REDIRECTS = 5
+# A playlist pointing at a playlist is fine; deeper than this is a loop.
+_MAX_PLAYLIST_DEPTH = 2
+_MAX_BACKOFF = 60
+
+
+class IcyReader:
+    """
+    Follows the song titles of a stream without playing it: the ICY metadata is read straight
+    off the socket and the audio in between is skipped. A lightweight stand-in for MPVWrapper
+    wherever only the titles are wanted - no decoder, no audio output, one thread and a 16 KiB
+    buffer per stream - with the same register_title_callback interface.
+    """
+
+    def __init__(self, timeout: float = _TIMEOUT):
+        self._timeout = timeout
+        self._title_callback: Callable[[str], None] = lambda _: None
+        self._title = None
+
+        self._lock = threading.Lock()
+        self._stopped: threading.Event | None = None
+        self._socket: socket.socket | None = None
+
+    def register_title_callback(self, callback: Callable[[str], None]) -> None:
+        self._title_callback = callback
+
+    @property
+    def title(self) -> str | None:
+        # the last title that the stream sent
+        return self._title
+
+    def play(self, url: str) -> None:
+        """Start following the titles of `url` (resolving playlists), instead of any other."""
+        self.stop()
+        stopped = threading.Event()
+        with self._lock:
+            self._stopped = stopped
+        threading.Thread(target=self._run, args=(url, stopped), daemon=True).start()
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._stopped is not None:
+                self._stopped.set()
+                self._stopped = None
+            if self._socket is not None:
+                # unblocks the reading thread straight away
+                self._socket.close()
+                self._socket = None
+        self._title = None
+
+    def _run(self, url: str, stopped: threading.Event) -> None:
+        # follow the stream until stopped, reconnecting (with jittered backoff) when it drops
+        attempt = 0
+        while not stopped.is_set():
+            try:
+                for _ in self._follow(url, stopped):
+                    attempt = 0
+            except (OSError, IcyError):
+                pass
+            attempt += 1
+            stopped.wait(random.uniform(0, min(_MAX_BACKOFF, 2 ** attempt)))
+
+    def _follow(self, url: str, stopped: threading.Event) -> Iterator[str]:
+        """Read titles from the stream, yielding each new one."""
+        sock, headers, body = self._open(url, 0)
+        with self._lock:
+            if stopped.is_set():
+                sock.close()
+                return
+            self._socket = sock
+
+        try:
+            metaint = headers.get("icy-metaint", "")
+            parser = IcyParser(int(metaint) if metaint.isdigit() else 0)
+            for data in body:
+                for fields in parser.feed(data):
+                    title = fields.get("StreamTitle")
+                    if title and title != self._title and not stopped.is_set():
+                        self._title = title
+                        self._title_callback(title)
+                        yield title
+        finally:
+            sock.close()
+
+    def _open(self, url: str, depth: int):
+        """
+        Connect to a stream, following redirects and playlists.
+        Returns the socket, the response headers and an iterator over the body.
+        """
+        for _ in range(_MAX_REDIRECTS + 1):
+            sock, status, headers, rest = self._request(url)
+            if status in (301, 302, 303, 307, 308) and "location" in headers:
+                sock.close()
+                url = urljoin(url, headers["location"])
+                continue
+            if status != 200:
+                sock.close()
+                raise IcyError("{} from {}".format(status, url))
+
+            body = self._body(sock, headers, rest)
+            if not is_playlist(url, headers.get("content-type")):
+                return sock, headers, body
+
+            # read the (small) playlist, then try its streams in turn
+            playlist = bytearray()
+            for data in body:
+                playlist += data
+                if len(playlist) > MAX_PLAYLIST_BYTES:
+                    break
+            sock.close()
+            if depth >= _MAX_PLAYLIST_DEPTH:
+                raise IcyError("playlists nested too deep at {}".format(url))
+            error = IcyError("empty playlist at {}".format(url))
+            for entry in parse_playlist(url, bytes(playlist)):
+                try:
+                    return self._open(entry, depth + 1)
+                except (OSError, IcyError) as e:
+                    error = e
+            raise error
+        raise IcyError("too many redirects from {}".format(url))
+
+    def _request(self, url: str):
+        # send the request and read the response head - returns whatever followed it too
+        host, port, tls, head = request(url)
+        sock = socket.create_connection((host, port), self._timeout)
+        try:
+            if tls:
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+            sock.sendall(head)
+            received = bytearray()
+            while (end := received.find(b"\r\n\r\n")) < 0:
+                if len(received) > MAX_HEAD_BYTES:
+                    raise IcyError("response head too long from {}".format(url))
+                data = sock.recv(4096)
+                if not data:
+                    raise IcyError("no response from {}".format(url))
+                received += data
+            status, headers = parse_head(bytes(received[:end]))
+        except BaseException:
+            sock.close()
+            raise
+        return sock, status, headers, bytes(received[end + 4:])
+
+    @staticmethod
+    def _body(sock: socket.socket, headers: dict[str, str], rest: bytes) -> Iterator[bytes]:
+        """The response body, with any chunked encoding undone. Ends when the server closes."""
+        chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+        decoder = ChunkedDecoder() if chunked else None
+        buffer = bytearray(_CHUNK_SIZE)
+        view = memoryview(buffer)
+        data = rest
+        while True:
+            if decoder is None:
+                yield data
+            else:
+                yield from decoder.feed(data)
+                if decoder.done:
+                    return
+            size = sock.recv_into(buffer)
+            if not size:
+                return
+            data = view[:size]
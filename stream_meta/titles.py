@@ -0,0 +1,114 @@
+"""
+Stream title normalisation: turning whatever a station puts in its StreamTitle into an artist
+and a song title - or nothing, for jingles and adverts.
+
+Stations mostly send "Artist - Title", but with plenty of variations: other dashes, Latin-1
+read as UTF-8 (or the other way around), HTML entities, "text=" tags from some ad-inserting
+servers, and ad break or station ID markers instead of a song. The same few thousand strings
+come round again and again across stations, so results are memoized.
+"""
+from functools import lru_cache
+import html
+import re
+from typing import NamedTuple
+import unicodedata
+
+# Enough for every title on air across a few hundred stations over a good few hours.
+_CACHE_SIZE = 8192
+
+# Tell-tale sequences of UTF-8 that has been decoded as Latin-1/cp1252.
+# If the text doesn't then decode as UTF-8, it was fine all along.
+_MOJIBAKE = re.compile("[ÂÃÄÅ][^\u0000-\u007f]|â€")
+_CONTROL = re.compile("[\u0000-\u001f\u007f-\u009f]")
+_SPACE = re.compile(r"\s+")
+_URL = re.compile(r"\s*(?:https?://|www\.)\S+", re.IGNORECASE)
+# Some ad-inserting servers send: Artist - text="Title" song_spot="M" length="..." ...
+_TAGGED = re.compile(r'text="(?P<title>[^"]*)"(?P<rest>.*)', re.IGNORECASE)
+_AD_SPOT = re.compile(r'song_spot="[^M"]"', re.IGNORECASE)
+_SEPARATOR = re.compile(r"\s+[-–—~|]\s+")
+_FEATURING = re.compile(r"\s*[\(\[]?\s*\b(?:featuring|feat\.?|ft\.?)\s+", re.IGNORECASE)
+# Whole titles that mean there's no song on right now.
+_NOT_A_SONG = re.compile(
+    r"^\W*(?:ad ?break|advert(?:isement)?s?|commercials?|jingles?|station id|sweepers?|promos?"
+    r"|news|weather|traffic|live|on air|unknown|untitled|n/?a|-+|\d+)\W*$",
+    re.IGNORECASE,
+)
+
+
+class SongInfo(NamedTuple):
+    artist: str
+    title: str
+    raw: str
+
+    def __str__(self):
+        return "{} - {}".format(self.artist, self.title) if self.artist else self.title
+
+
+# Shown when nothing (that is a song) is playing.
+NO_SONG = SongInfo("", "-", "-")
+
+
+def _fix_encoding(text: str) -> str:
+    if _MOJIBAKE.search(text):
+        for encoding in ("cp1252", "latin-1"):
+            try:
+                return text.encode(encoding).decode("utf-8")
+            except UnicodeError:
+                continue
+    return text
+
+
+def _clean(text: str) -> str:
+    text = html.unescape(_fix_encoding(text))
+    text = _CONTROL.sub(" ", unicodedata.normalize("NFC", text))
+    return _SPACE.sub(" ", text).strip()
+
+
+def canonical_artist(artist: str) -> str:
+    """An artist's name as shown: tidied up, with every "featuring" written as "feat."."""
+    artist = _clean(artist)
+    parts = _FEATURING.split(artist, maxsplit=1)
+    if len(parts) == 1:
+        return artist
+    main, featured = parts
+    return "{} feat. {}".format(main.strip(), featured.strip(" ()[]"))
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def artist_key(artist: str) -> str:
+    """
+    A key that is the same for the different spellings of an artist's name, for counting:
+    no accents, case, featured artists or leading "The".
+    """
+    main = _FEATURING.split(artist, maxsplit=1)[0]
+    decomposed = unicodedata.normalize("NFKD", main)
+    key = "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+    key = _SPACE.sub(" ", key.replace("&", " and ")).strip()
+    return key[4:] if key.startswith("the ") else key
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def parse_title(raw: str, station_name: str = "") -> SongInfo | None:
+    """
+    The artist and title in a stream title, or None if it isn't a song (an ad, a jingle, or
+    just the station's own name).
+    """
+    text = _clean(raw)
+
+    tagged = _TAGGED.search(text)
+    if tagged:
+        if _AD_SPOT.search(tagged["rest"]):
+            return None
+        text = _clean(text[: tagged.start()].rstrip(" -") + " - " + tagged["title"])
+
+    text = _URL.sub("", text).strip(" -|")
+    if not text or _NOT_A_SONG.match(text):
+        return None
+    if station_name and text.casefold() == _clean(station_name).casefold():
+        return None
+
+    parts = _SEPARATOR.split(text, maxsplit=1)
+    if len(parts) == 2 and parts[0] and parts[1]:
+        artist, title = (part.strip(" \"'") for part in parts)
+        return SongInfo(canonical_artist(artist), title, raw)
+    return SongInfo("", text.strip(" \"'"), raw)
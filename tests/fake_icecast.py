@@ -0,0 +1,124 @@
+"""
+A stand-in Icecast server for the stream tests, on localhost: ICY streams that send the titles
+a test chooses, redirects, and .pls/.m3u playlists - any of them optionally chunked.
+"""
+import socketserver
+import threading
+
+# Streams send this much (silent) audio between metadata blocks.
+METAINT = 64
+# Once a stream has sent its titles, it carries on sending audio this often until closed.
+_IDLE_SECONDS = 0.05
+
+
+def metadata_block(title: str | None) -> bytes:
+    """An ICY metadata block: a length byte then the fields, padded to 16 bytes - or none."""
+    if title is None:
+        return b"\0"
+    fields = "StreamTitle='{}';".format(title).encode("utf-8")
+    fields += b"\0" * (-len(fields) % 16)
+    return bytes([len(fields) // 16]) + fields
+
+
+def chunk(data: bytes) -> bytes:
+    return b"%x\r\n%s\r\n" % (len(data), data)
+
+
+class FakeIcecast:
+    """
+    A threaded server with a route per path. Every request is kept in `requests`, as (path,
+    lower-cased headers), so that tests can see what was asked for.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self.requests: list[tuple[str, dict[str, str]]] = []
+        self._closed = threading.Event()
+
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake._handle(self.rfile, self.wfile)
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self._closed.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def url(self, path: str) -> str:
+        return "http://127.0.0.1:{}{}".format(self._server.server_address[1], path)
+
+    def stream(self, path: str, titles: list[str], chunked: bool = False, icy: bool = False):
+        """Serve a stream that sends `titles` in turn, then audio with no title changes."""
+        self._routes[path] = ("stream", titles, chunked, icy)
+
+    def playlist(self, path: str, body: str, content_type: str = "", chunked: bool = False):
+        self._routes[path] = ("playlist", body.encode("utf-8"), content_type, chunked)
+
+    def redirect(self, path: str, location: str):
+        self._routes[path] = ("redirect", location)
+
+    def _handle(self, rfile, wfile):
+        request_line = rfile.readline().decode("latin-1").split()
+        headers = {}
+        while (line := rfile.readline().decode("latin-1").strip()):
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        path = request_line[1] if len(request_line) > 1 else ""
+        self.requests.append((path, headers))
+
+        route = self._routes.get(path)
+        try:
+            if route is None:
+                wfile.write(b"HTTP/1.0 404 Not Found\r\n\r\n")
+            elif route[0] == "redirect":
+                head = "HTTP/1.0 302 Found\r\nLocation: {}\r\n\r\n".format(route[1])
+                wfile.write(head.encode())
+            elif route[0] == "playlist":
+                self._send_playlist(wfile, *route[1:])
+            else:
+                self._send_stream(wfile, *route[1:])
+        except OSError:
+            # the client hung up
+            pass
+
+    @staticmethod
+    def _send_playlist(wfile, body, content_type, chunked):
+        head = "HTTP/1.1 200 OK\r\n"
+        if content_type:
+            head += "Content-Type: {}\r\n".format(content_type)
+        if chunked:
+            # split the playlist over chunks, so that it has to be put back together
+            head += "Transfer-Encoding: chunked\r\n\r\n"
+            middle = len(body) // 2
+            body = chunk(body[:middle]) + chunk(body[middle:]) + b"0\r\n\r\n"
+            wfile.write(head.encode() + body)
+        else:
+            wfile.write(head.encode() + b"\r\n" + body)
+
+    def _send_stream(self, wfile, titles, chunked, icy):
+        head = "ICY 200 OK\r\n" if icy else "HTTP/1.1 200 OK\r\n"
+        head += "Content-Type: audio/mpeg\r\nicy-metaint: {}\r\n".format(METAINT)
+        if chunked:
+            head += "Transfer-Encoding: chunked\r\n"
+        wfile.write((head + "\r\n").encode())
+
+        def send(data):
+            wfile.write(chunk(data) if chunked else data)
+            wfile.flush()
+
+        for title in titles:
+            send(b"\0" * METAINT + metadata_block(title))
+        while not self._closed.wait(_IDLE_SECONDS):
+            send(b"\0" * METAINT + metadata_block(None))
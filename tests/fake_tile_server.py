@@ -0,0 +1,67 @@
+"""
+A stand-in for the map tile server, on localhost: answers /{z}/{x}/{y} with made-up tile data,
+over keep-alive HTTP/1.1, counting the requests and the connections that they came in on.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+
+def tile_data(z: int, x: int, y: int) -> bytes:
+    return "tile {} {} {}".format(z, x, y).encode() * 100
+
+
+class FakeTileServer:
+    """
+    Tile requests are kept, in order, in `requests` as (z, x, y). While `gate` is clear,
+    requests wait for it before they are answered - so that a test can hold loads in flight.
+    Tiles in `errors` are answered with that HTTP status, and an error page.
+    """
+
+    def __init__(self):
+        self.requests: list[tuple[int, int, int]] = []
+        self.errors: dict[tuple[int, int, int], int] = {}
+        self.connections = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def do_GET(self):
+                z, x, y = (int(part) for part in self.path.split("?")[0].strip("/").split("/"))
+                with fake._lock:
+                    fake.requests.append((z, x, y))
+                fake.gate.wait()
+                status = fake.errors.get((z, x, y), 200)
+                body = tile_data(z, x, y) if status == 200 else b"<html>Not a tile</html>"
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url_template(self) -> str:
+        """A url template for TileFetcher."""
+        return "http://127.0.0.1:{}/{{}}/{{}}/{{}}?access_token={{}}".format(
+            self._server.server_address[1]
+        )
+
+    def close(self) -> None:
+        self.gate.set()
+        self._server.shutdown()
+        self._server.server_close()
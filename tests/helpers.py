@@ -0,0 +1,12 @@
+"""Helpers shared by the tests."""
+import time
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    """Poll `condition` until it is true, or `timeout` seconds have passed."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from stream_meta.collector import Collector
+from tests.fake_icecast import FakeIcecast
+
+
+def _station(station_id: int, stream: str) -> dict:
+    return {
+        "id": station_id,
+        "name": "Station {}".format(station_id),
+        "country": "SN",
+        "stream": stream,
+    }
+
+
+class CollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeIcecast()
+        self.addCleanup(self.server.close)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_path = os.path.join(directory.name, "titles.jsonl")
+
+    def collect(
+        self, stations: list[dict], titles: int, failures: int = 0, timeout: float = 5
+    ) -> Collector:
+        """Run a collector until it has logged `titles` title changes and seen `failures`."""
+        collector = Collector(stations, self.log_path, streams=10, connecting=5)
+
+        async def run():
+            task = asyncio.create_task(collector.run())
+            deadline = asyncio.get_running_loop().time() + timeout
+            while collector.stats["titles"] < titles or collector.stats["failures"] < failures:
+                if asyncio.get_running_loop().time() > deadline or task.done():
+                    break
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        asyncio.run(run())
+        return collector
+
+    def logged(self) -> list[tuple[int, str]]:
+        with open(self.log_path, encoding="utf-8") as log:
+            return [(record["station"], record["title"]) for record in map(json.loads, log)]
+
+    def test_logs_title_changes_from_every_stream(self):
+        self.server.stream("/one", ["A - One", "A - One", "B - Two"])
+        self.server.stream("/two", ["C - Three"], icy=True)
+        self.server.stream("/three", ["Ümlaut - Four"], chunked=True)
+        collector = self.collect(
+            [
+                _station(1, self.server.url("/one")),
+                _station(2, self.server.url("/two")),
+                _station(3, self.server.url("/three")),
+            ],
+            titles=4,
+        )
+
+        # a title repeated by the stream is only logged once
+        self.assertEqual(
+            sorted(self.logged()),
+            [(1, "A - One"), (1, "B - Two"), (2, "C - Three"), (3, "Ümlaut - Four")],
+        )
+        self.assertEqual(collector.stats["connects"], 3)
+        self.assertEqual(collector.stats["failures"], 0)
+        for _, headers in self.server.requests:
+            self.assertEqual(headers["icy-metadata"], "1")
+
+    def test_follows_redirects_and_playlists(self):
+        self.server.stream("/stream", ["A - One"])
+        self.server.stream("/other", ["B - Two"])
+        self.server.redirect("/moved", "/listen.pls")
+        self.server.playlist(
+            "/listen.pls", "[playlist]\nFile1=/missing\nFile2=/stream\n", chunked=True
+        )
+        self.server.playlist("/listen", "#EXTM3U\n/other\n", content_type="audio/x-mpegurl")
+        self.collect(
+            [_station(1, self.server.url("/moved")), _station(2, self.server.url("/listen"))],
+            titles=2,
+        )
+
+        self.assertEqual(sorted(self.logged()), [(1, "A - One"), (2, "B - Two")])
+
+    def test_bad_stations_dont_stop_the_others(self):
+        self.server.stream("/stream", ["A - One"])
+        collector = self.collect(
+            [
+                _station(1, "http://127.0.0.1:notaport/"),
+                _station(2, "http://bad..host/"),
+                _station(3, "http://127.0.0.1/ストリーム"),
+                _station(4, self.server.url("/missing")),
+                _station(5, self.server.url("/stream")),
+            ],
+            titles=1,
+            failures=4,
+        )
+
+        self.assertEqual(self.logged(), [(5, "A - One")])
+        self.assertGreaterEqual(collector.stats["failures"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+from math import cos, radians
+import random
+import time
+import unittest
+
+from stations.geo_index import EAST, NORTH, SOUTH, WEST, StationIndex, _in_direction, _wrap
+
+_DIRECTIONS = (None, NORTH, SOUTH, EAST, WEST)
+
+
+def nearest(locations, latitude, longitude, direction=None, exclude=None):
+    """The distance to the nearest station, by looking at every one - or None."""
+    scale = max(cos(radians(latitude)), 0.01)
+    distances = []
+    for station_id, station_latitude, station_longitude in locations:
+        dx = _wrap(station_longitude - longitude) * scale
+        dy = station_latitude - latitude
+        if station_id != exclude and (direction is None or _in_direction(direction, dx, dy)):
+            distances.append(dx * dx + dy * dy)
+    return min(distances, default=None)
+
+
+class StationIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(1)
+
+    def search(self, index, latitude, longitude, direction=None, exclude=None):
+        if direction is None:
+            return index.nearest(latitude, longitude, exclude)
+        return index.towards(latitude, longitude, direction, exclude)
+
+    def test_finds_the_nearest_station(self):
+        for count in (5, 200, 2000):
+            locations = [
+                (i, self.random.uniform(-90, 90), self.random.uniform(-180, 180))
+                for i in range(count)
+            ]
+            index = StationIndex(locations)
+            for _ in range(300):
+                latitude = self.random.uniform(-90, 90)
+                longitude = self.random.uniform(-180, 180)
+                exclude = self.random.randrange(count)
+                for direction in _DIRECTIONS:
+                    found = self.search(index, latitude, longitude, direction, exclude)
+                    expected = nearest(locations, latitude, longitude, direction, exclude)
+                    if expected is None:
+                        self.assertIsNone(found)
+                        continue
+                    # the same distance, in case of a tie
+                    self.assertNotEqual(found, exclude)
+                    self.assertAlmostEqual(
+                        nearest([locations[found]], latitude, longitude, direction), expected
+                    )
+
+    def test_wraps_around_the_antimeridian(self):
+        index = StationIndex([(1, 0, 179), (2, 0, -170)])
+        self.assertEqual(index.towards(0, -179, WEST), 1)
+        self.assertEqual(index.towards(0, 179.5, EAST), 2)
+        self.assertEqual(index.nearest(0, -179.5), 1)
+
+    def test_gives_up_quickly_when_nothing_qualifies(self):
+        # every station is south of the equator and west of the meridian, but not far enough
+        # west to be east of it the other way round
+        index = StationIndex(
+            (i, self.random.uniform(-89, -1), self.random.uniform(-170, -0.01))
+            for i in range(50000)
+        )
+        small = StationIndex([(1, -10, -10)])
+        for index, latitude, longitude, direction in (
+            (index, 0, 0, NORTH),
+            (index, 89, 0, EAST),
+            (index, -89, 0.5, EAST),
+            (small, 0, 0, NORTH),
+            (small, 0, 0, EAST),
+            (small, -10, -10, None),
+        ):
+            started = time.perf_counter()
+            for _ in range(20):
+                self.assertIsNone(self.search(index, latitude, longitude, direction, 1))
+            # well under a millisecond a query, with room for a slow machine
+            self.assertLess((time.perf_counter() - started) / 20, 0.005)
+
+
+if __name__ == "__main__":
+    unittest.main()
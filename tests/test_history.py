@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from history.store import PlayHistory
+from stream_meta.titles import SongInfo
+
+_STATION = {"id": 1, "country": "NL"}
+
+
+def song(number: int) -> SongInfo:
+    return SongInfo("Artist {}".format(number), "Title {}".format(number), "raw {}".format(number))
+
+
+class PlayHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open(self, batch_size: int = 3) -> PlayHistory:
+        history = PlayHistory(self.directory, batch_size)
+        self.addCleanup(history.close)
+        return history
+
+    def record(self, history: PlayHistory, numbers) -> None:
+        for number in numbers:
+            history.record(_STATION, song(number), when=1000 + number)
+
+    @staticmethod
+    def crash(history: PlayHistory) -> None:
+        """Leave a history as the process dying would - without writing out its batch."""
+        history._journal.close()
+        history._batch = []
+
+    def titles(self, history: PlayHistory) -> list[str]:
+        return [play.title for play in history.scan()]
+
+    def test_replays_the_journal(self):
+        history = self.open()
+        self.record(history, range(5))
+        self.crash(history)
+
+        history = self.open()
+        self.assertEqual(self.titles(history), ["Title {}".format(i) for i in range(5)])
+
+    def test_skips_plays_already_in_a_segment(self):
+        history = self.open()
+        # a crash straight after a batch is written out stops the journal being emptied
+        history._journal.truncate = lambda size: None
+        self.record(history, range(4))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.crash(history)
+
+        history = self.open()
+        self.assertEqual(self.titles(history), ["Title {}".format(i) for i in range(4)])
+        self.assertEqual(len(history), 4)
+
+        # and the numbering carries on from where it was
+        self.record(history, range(4, 6))
+        history.close()
+        history = self.open()
+        self.assertEqual(self.titles(history), ["Title {}".format(i) for i in range(6)])
+
+    def test_sets_aside_broken_segments(self):
+        history = self.open()
+        self.record(history, range(9))
+        history.close()
+        segments = sorted(name for name in os.listdir(self.directory) if name.endswith(".seg"))
+        self.assertEqual(len(segments), 3)
+        # one cut short, one not a segment at all
+        with open(os.path.join(self.directory, segments[0]), "r+b") as f:
+            f.truncate(30)
+        with open(os.path.join(self.directory, segments[1]), "wb") as f:
+            f.write(b"nonsense")
+
+        history = self.open()
+        self.assertEqual(self.titles(history), ["Title {}".format(i) for i in range(6, 9)])
+        for name in segments[:2]:
+            self.assertTrue(os.path.isfile(os.path.join(self.directory, name + ".bad")))
+
+        # new segments don't take the names of the ones set aside
+        self.record(history, range(9, 12))
+        history.close()
+        history = self.open()
+        self.assertEqual(self.titles(history), ["Title {}".format(i) for i in range(6, 12)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import threading
+import unittest
+
+from stream_meta.reader import IcyReader
+from tests.fake_icecast import FakeIcecast
+from tests.helpers import wait_for
+
+
+class IcyReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeIcecast()
+        self.addCleanup(self.server.close)
+        self.reader = IcyReader(timeout=5)
+        self.addCleanup(self.reader.stop)
+        self.titles = []
+        self.reader.register_title_callback(self.titles.append)
+
+    def test_reads_titles(self):
+        self.server.stream("/stream", ["A - One", "A - One", "B - Two"])
+        self.reader.play(self.server.url("/stream"))
+
+        self.assertTrue(wait_for(lambda: len(self.titles) == 2))
+        self.assertEqual(self.titles, ["A - One", "B - Two"])
+        self.assertEqual(self.reader.title, "B - Two")
+
+    def test_reads_chunked_streams(self):
+        self.server.stream("/stream", ["A - One", "B - Two"], chunked=True)
+        self.reader.play(self.server.url("/stream"))
+
+        self.assertTrue(wait_for(lambda: len(self.titles) == 2))
+        self.assertEqual(self.titles, ["A - One", "B - Two"])
+
+    def test_follows_chunked_pls_playlists(self):
+        self.server.stream("/stream", ["A - One"])
+        self.server.playlist(
+            "/listen.pls",
+            "[playlist]\nNumberOfEntries=2\nFile1=/missing\nFile2=/stream\n",
+            chunked=True,
+        )
+        self.reader.play(self.server.url("/listen.pls"))
+
+        self.assertTrue(wait_for(lambda: self.titles == ["A - One"]))
+
+    def test_follows_chunked_m3u_playlists_by_content_type(self):
+        self.server.stream("/stream", ["A - One"], icy=True)
+        self.server.playlist(
+            "/listen", "#EXTM3U\n#EXTINF:-1,Station\n/stream\n", "audio/x-mpegurl", True
+        )
+        self.server.redirect("/moved", "/listen")
+        self.reader.play(self.server.url("/moved"))
+
+        self.assertTrue(wait_for(lambda: self.titles == ["A - One"]))
+
+    def test_keeps_going_after_a_bad_url(self):
+        threads = threading.active_count()
+        bad_urls = ("http://127.0.0.1:notaport/", "http://bad..host/", "http://127.0.0.1/ストリーム")
+        for url in bad_urls:
+            self.reader.play(url)
+            # the reader's thread is waiting to try again, rather than having died
+            self.assertFalse(wait_for(lambda: threading.active_count() == threads, 0.2))
+
+        # and can still be pointed at a stream that works
+        self.server.stream("/stream", ["A - One"])
+        self.reader.play(self.server.url("/stream"))
+        self.assertTrue(wait_for(lambda: self.titles == ["A - One"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
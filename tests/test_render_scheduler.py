@@ -0,0 +1,70 @@
+import threading
+import unittest
+
+from map.render_scheduler import RenderScheduler
+
+
+class Screen:
+    """Just enough of a Screen to count how often the scheduler wakes it up."""
+
+    def __init__(self):
+        self.wakes = 0
+
+    def force_update(self):
+        self.wakes += 1
+
+
+class RenderSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = RenderScheduler()
+        self.screen = Screen()
+        self.scheduler.attach(self.screen)
+
+    def draw(self, frame_no: int) -> None:
+        # a frame with two parts to it, as the map and the player are
+        for _ in range(2):
+            with self.scheduler.drawing(frame_no):
+                pass
+
+    def test_coalesces_requests_into_one_redraw(self):
+        threads = [
+            threading.Thread(target=lambda: [self.scheduler.request_redraw() for _ in range(50)])
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.screen.wakes, 1)
+
+        # once that frame is drawn, the next request wakes the screen again
+        self.draw(1)
+        self.scheduler.request_redraw()
+        self.scheduler.request_redraw()
+        self.assertEqual(self.screen.wakes, 2)
+        self.assertEqual(self.scheduler.stats["requests"], 202)
+        self.assertEqual(self.scheduler.stats["redraws"], 2)
+
+    def test_stays_idle_until_asked(self):
+        self.draw(1)
+        self.draw(2)
+        frames = self.scheduler.stats["frames"]
+        # nothing asks for a redraw, so nothing wakes the screen and no frames are drawn
+        self.assertEqual(self.screen.wakes, 0)
+        self.assertEqual(self.scheduler.stats["frames"], frames)
+
+        self.scheduler.request_redraw()
+        self.assertEqual(self.screen.wakes, 1)
+        self.draw(3)
+        # a frame is counted once its last part is done - i.e. when the next one starts
+        self.draw(4)
+        self.assertEqual(self.scheduler.stats["frames"], frames + 2)
+
+    def test_caps_the_animation_frame_rate(self):
+        self.assertEqual(RenderScheduler(fps=20).animation_interval, 1)
+        self.assertEqual(RenderScheduler(fps=10).animation_interval, 2)
+        self.assertEqual(RenderScheduler(fps=100).animation_interval, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
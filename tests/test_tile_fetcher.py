@@ -0,0 +1,131 @@
+import threading
+import unittest
+
+from map.tile_fetcher import TileFetcher, TileUnavailable
+from tests.fake_tile_server import FakeTileServer, tile_data
+from tests.helpers import wait_for
+
+
+class TileFetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeTileServer()
+        self.addCleanup(self.server.close)
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    def fetcher(self, workers: int = 4) -> TileFetcher:
+        fetcher = TileFetcher(self.server.url_template, "token", workers=workers)
+        self.addCleanup(fetcher.shutdown)
+        return fetcher
+
+    def submit(self, fetcher: TileFetcher, z: int, x: int, y: int, priority=(0,)) -> None:
+        def load():
+            try:
+                data = fetcher.download(z, x, y)
+            except TileUnavailable:
+                data = None
+            with self.lock:
+                self.loaded.setdefault((z, x, y), []).append(data)
+
+        fetcher.submit(z, x, y, load, priority)
+
+    def test_downloads_tiles_in_parallel(self):
+        fetcher = self.fetcher(workers=4)
+        self.server.gate.clear()
+        tiles = [(10, x, y) for x in range(2) for y in range(2)]
+        for tile in tiles:
+            self.submit(fetcher, *tile)
+
+        # every worker has a request waiting on the server at once
+        self.assertTrue(wait_for(lambda: len(self.server.requests) == 4))
+        self.server.gate.set()
+        self.assertTrue(wait_for(lambda: len(self.loaded) == 4 and fetcher.in_flight == 0))
+        for tile in tiles:
+            self.assertEqual(self.loaded[tile], [tile_data(*tile)])
+        self.assertEqual(fetcher.stats["downloads"], 4)
+        self.assertEqual(fetcher.stats["bytes"], sum(len(tile_data(*tile)) for tile in tiles))
+
+    def test_reuses_connections(self):
+        fetcher = self.fetcher(workers=1)
+        for x in range(5):
+            self.submit(fetcher, 10, x, 0)
+        self.assertTrue(wait_for(lambda: len(self.loaded) == 5))
+
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_never_downloads_a_tile_twice_at_once(self):
+        fetcher = self.fetcher()
+        self.server.gate.clear()
+        # asked for again while queued, and again while downloading
+        for _ in range(3):
+            self.submit(fetcher, 10, 1, 1)
+        self.assertTrue(wait_for(lambda: self.server.requests == [(10, 1, 1)]))
+        self.submit(fetcher, 10, 1, 1)
+        self.server.gate.set()
+        self.assertTrue(wait_for(lambda: fetcher.in_flight == 0))
+
+        self.assertEqual(self.server.requests, [(10, 1, 1)])
+        self.assertEqual(len(self.loaded[(10, 1, 1)]), 1)
+
+    def test_loads_in_priority_order(self):
+        fetcher = self.fetcher(workers=1)
+        self.server.gate.clear()
+        self.submit(fetcher, 10, 0, 0, (0,))
+        self.assertTrue(wait_for(lambda: len(self.server.requests) == 1))
+        # queued behind the first while it downloads
+        self.submit(fetcher, 10, 1, 0, (3,))
+        self.submit(fetcher, 10, 2, 0, (1,))
+        self.submit(fetcher, 10, 3, 0, (2,))
+        # moved up the queue when asked for again, more urgently
+        self.submit(fetcher, 10, 1, 0, (0,))
+        self.server.gate.set()
+        self.assertTrue(wait_for(lambda: fetcher.in_flight == 0))
+
+        self.assertEqual([x for _, x, _ in self.server.requests], [0, 1, 2, 3])
+
+    def test_fails_on_error_statuses(self):
+        fetcher = self.fetcher()
+        self.server.errors[(10, 0, 0)] = 404
+        self.server.errors[(10, 1, 0)] = 503
+        for x in range(3):
+            self.submit(fetcher, 10, x, 0)
+        self.assertTrue(wait_for(lambda: len(self.loaded) == 3))
+
+        # the error pages are never handed over as tiles
+        self.assertEqual(self.loaded[(10, 0, 0)], [None])
+        self.assertEqual(self.loaded[(10, 1, 0)], [None])
+        self.assertEqual(self.loaded[(10, 2, 0)], [tile_data(10, 2, 0)])
+        self.assertEqual(fetcher.stats["failures"], 2)
+        self.assertEqual(fetcher.stats["downloads"], 1)
+
+    def test_keeps_working_after_a_load_fails(self):
+        fetcher = self.fetcher(workers=1)
+
+        def broken():
+            raise RuntimeError("broken tile")
+
+        fetcher.submit(10, 0, 0, broken)
+        self.submit(fetcher, 10, 1, 0)
+        # the one worker is still there to load the next tile
+        self.assertTrue(wait_for(lambda: len(self.loaded) == 1 and fetcher.in_flight == 0))
+        self.assertEqual(fetcher.stats["failures"], 1)
+
+    def test_cancels_unwanted_loads(self):
+        fetcher = self.fetcher(workers=1)
+        self.server.gate.clear()
+        for x in range(4):
+            self.submit(fetcher, 10, x, 0)
+        self.assertTrue(wait_for(lambda: len(self.server.requests) == 1))
+        fetcher.cancel_except({(10, 3, 0)})
+        self.server.gate.set()
+        self.assertTrue(wait_for(lambda: fetcher.in_flight == 0))
+
+        # the one that was downloading is given up on, and the queued ones never start
+        self.assertEqual(self.server.requests, [(10, 0, 0), (10, 3, 0)])
+        self.assertEqual(list(self.loaded), [(10, 3, 0)])
+        self.assertEqual(fetcher.stats["cancelled"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()